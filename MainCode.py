@@ -1,10 +1,14 @@
 import math
+import numpy as np
 import networkx as nx
 import matplotlib.pyplot as plt
 import matplotlib.image as mpimg
 import pandas as pd
 import streamlit as st
 from io import StringIO, BytesIO
+from disegno import (arrays_grafo, limiti_disegno, disegna_archi, disegna_nodi,
+                     disegna_etichette, disegna_etichette_archi,
+                     layer_archi, layer_nodi, vista_webgl)
 
 """
 ======================================
@@ -124,37 +128,30 @@ def calcola_percorsi_macchine(G, macchine_list):
 # 3. Funzione per Disegnare il Grafo (con dimensioni differenti per macchine e corridoi)
 ###############################
 
-def disegna_grafo(G, background_img=None, extent=None):
+def disegna_grafo(G, background_img=None, extent=None, max_etichette=200, tolleranza=None):
     # Posizioni dei nodi in base alle coordinate reali
-    pos = {}
-    node_colors = []
-    node_sizes = []  # Dimensione specifica per ogni nodo
-
-    for node in G.nodes():
-        punto = G.nodes[node]['punto']
-        pos[node] = (punto.x, punto.y)
-        if punto.categoria == "macchina":
-            node_colors.append('red')
-            node_sizes.append(600)  # Dimensione maggiore per le macchine
-        else:
-            node_colors.append('blue')
-            node_sizes.append(300)  # Dimensione ridotta per i corridoi
+    pos = {node: (G.nodes[node]['punto'].x, G.nodes[node]['punto'].y) for node in G.nodes()}
+    nodi, _, coords, archi = arrays_grafo(G, pos)
+    is_macchina = np.array([G.nodes[n]['punto'].categoria == "macchina" for n in nodi], dtype=bool)
+    node_colors = np.where(is_macchina, 'red', 'blue')
+    node_sizes = np.where(is_macchina, 600, 300)  # Dimensione maggiore per le macchine
 
     fig, ax = plt.subplots(figsize=(8, 6))
     
     if background_img is not None and extent is not None:
         ax.imshow(background_img, extent=extent, aspect='auto', alpha=0.5)
     
-    if isinstance(G, nx.DiGraph):
-        nx.draw_networkx_nodes(G, pos, node_color=node_colors, node_size=node_sizes, ax=ax)
-        nx.draw_networkx_labels(G, pos, ax=ax)
-        nx.draw_networkx_edges(G, pos, ax=ax, arrowstyle='->', arrowsize=15)
-    else:
-        nx.draw(G, pos, with_labels=True, node_color=node_colors, node_size=node_sizes, font_weight='bold', ax=ax)
+    # Archi in un'unica LineCollection, nodi in un unico scatter
+    disegnati = disegna_archi(ax, coords, archi, colors='black', frecce=isinstance(G, nx.DiGraph),
+                              tolleranza=tolleranza)
+    disegna_nodi(ax, coords, node_colors, sizes=node_sizes)
+    limiti = limiti_disegno(coords, extent)
+    # Etichette con livello di dettaglio: le macchine hanno la precedenza
+    disegna_etichette(ax, coords, [str(n) for n in nodi], limiti, max_etichette,
+                      priorita=is_macchina, fontweight='bold')
     
-    edge_labels = nx.get_edge_attributes(G, 'weight')
-    edge_labels = {edge: f"{weight:.2f}" for edge, weight in edge_labels.items()}
-    nx.draw_networkx_edge_labels(G, pos, edge_labels=edge_labels, ax=ax)
+    pesi = [f"{G.edges[nodi[u], nodi[v]]['weight']:.2f}" for u, v in archi[disegnati]]
+    disegna_etichette_archi(ax, coords, archi[disegnati], pesi, limiti, max_etichette)
     
     ax.set_xlabel("Coordinata X")
     ax.set_ylabel("Coordinata Y")
@@ -163,6 +160,14 @@ def disegna_grafo(G, background_img=None, extent=None):
     ax.set_title("Grafo: Macchine e Corridoi")
     return fig
 
+def disegna_grafo_webgl(G):
+    """Vista interattiva (pydeck) dello stesso grafo: archi in un LineLayer, nodi in uno ScatterplotLayer."""
+    pos = {node: (G.nodes[node]['punto'].x, G.nodes[node]['punto'].y) for node in G.nodes()}
+    nodi, _, coords, archi = arrays_grafo(G, pos)
+    colori = ['red' if G.nodes[n]['punto'].categoria == "macchina" else 'blue' for n in nodi]
+    return vista_webgl([layer_archi(coords, archi, 'black', alpha=90),
+                        layer_nodi(coords, colori, [str(n) for n in nodi], raggio=6)], coords)
+
 ###############################
 # 4. Funzione per Generare il File Excel Riassuntivo
 ###############################
@@ -395,8 +400,13 @@ else:
         st.write(f"Distanza totale: {info['distance']:.2f}")
 
     st.subheader("Grafico del Grafo")
-    fig = disegna_grafo(G, background_img=background_img, extent=extent)
-    st.pyplot(fig)
+    modalita_grafico = st.radio("Tipo di grafico:", ("Immagine statica", "Interattivo (WebGL)"), index=0,
+                                horizontal=True, key="modalita_grafico")
+    if modalita_grafico == "Interattivo (WebGL)":
+        st.pydeck_chart(disegna_grafo_webgl(G))
+    else:
+        fig = disegna_grafo(G, background_img=background_img, extent=extent)
+        st.pyplot(fig)
     
     # Genera il file Excel riassuntivo e abilita il download
     excel_data = genera_excel(percorsi_macchine)
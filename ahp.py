@@ -0,0 +1,167 @@
+import numpy as np
+import streamlit as st
+
+"""
+======================================
+MOTORE AHP (Analytic Hierarchy Process)
+======================================
+
+- Costruzione vettoriale delle matrici di confronto reciproche a partire dai
+  giudizi sulla parte triangolare superiore.
+- Autovettore principale con iterazione di potenza, anche su pile di matrici
+  (array di forma (..., n, n)) per le analisi di sensibilità.
+- Indice (CI) e rapporto (CR) di consistenza di Saaty.
+- Memoizzazione del calcolo sulla singola matrice.
+- Controllo delle matrici caricate da file (valori positivi, diagonale
+  unitaria, reciprocità) prima di aggregarle.
+- Aggregazione di più esperti per media geometrica e sensibilità Monte Carlo
+  dei pesi rispetto a perturbazioni dei giudizi.
+"""
+
+# Scala di Saaty usata nel form di confronto
+SCALA_GIUDIZI = {
+    "Sono equamente importanti": 1,
+    "poco più importante": 3,
+    "abbastanza più importante": 5,
+    "decisamente più importante": 7,
+    "assolutamente più importante": 9,
+}
+
+# Random Index di Saaty per n = 0..15 (per n <= 2 la matrice è sempre consistente)
+RANDOM_INDEX = np.array([0.0, 0.0, 0.0, 0.58, 0.90, 1.12, 1.24, 1.32, 1.41, 1.45,
+                         1.49, 1.51, 1.48, 1.56, 1.57, 1.59])
+
+# Soglia usuale oltre la quale i giudizi vanno rivisti
+SOGLIA_CR = 0.10
+
+def valore_giudizio(option):
+    """Valore della scala di Saaty corrispondente al testo di un'opzione del form."""
+    for chiave, valore in SCALA_GIUDIZI.items():
+        if chiave in option:
+            return valore
+    return 1
+
+def indici_triangolo_superiore(n):
+    """Coppie (i, j) con i < j nello stesso ordine dei doppi cicli for del form."""
+    return np.triu_indices(n, k=1)
+
+def matrice_confronto(n, valori):
+    """
+    Costruisce la matrice (o la pila di matrici) reciproca a partire dai valori
+    della parte triangolare superiore: `valori` ha forma (..., n*(n-1)/2).
+    """
+    valori = np.asarray(valori, dtype=float)
+    i, j = indici_triangolo_superiore(n)
+    matrici = np.ones(valori.shape[:-1] + (n, n))
+    matrici[..., i, j] = valori
+    matrici[..., j, i] = 1.0 / valori
+    return matrici
+
+def autovettore_principale(matrici, tol=1e-12, max_iter=500):
+    """
+    Iterazione di potenza vettoriale su una matrice (n, n) o una pila (..., n, n).
+    Il punto di partenza è la media geometrica delle righe, già molto vicina
+    all'autovettore per matrici reciproche, per cui bastano poche iterazioni.
+    Restituisce (pesi normalizzati a somma 1, lambda_max).
+    """
+    matrici = np.asarray(matrici, dtype=float)
+    w = np.exp(np.log(matrici).mean(axis=-1))
+    w /= w.sum(axis=-1, keepdims=True)
+    for _ in range(max_iter):
+        w_new = np.einsum("...ij,...j->...i", matrici, w)
+        w_new /= w_new.sum(axis=-1, keepdims=True)
+        converged = np.max(np.abs(w_new - w)) < tol
+        w = w_new
+        if converged:
+            break
+    lambda_max = (np.einsum("...ij,...j->...i", matrici, w) / w).mean(axis=-1)
+    return w, lambda_max
+
+def consistenza(lambda_max, n):
+    """Indice di consistenza CI = (lambda_max - n) / (n - 1) e rapporto CR = CI / RI(n)."""
+    if n <= 2:
+        zero = np.zeros_like(np.asarray(lambda_max, dtype=float))
+        return zero, zero
+    ci = (np.asarray(lambda_max, dtype=float) - n) / (n - 1)
+    ri = RANDOM_INDEX[n] if n < len(RANDOM_INDEX) else RANDOM_INDEX[-1]
+    return ci, ci / ri
+
+def valuta_matrici(matrici):
+    """
+    Valutazione in blocco di una pila di matrici (..., n, n).
+    Restituisce (pesi, lambda_max, CI, CR) con le stesse dimensioni di batch.
+    """
+    matrici = np.asarray(matrici, dtype=float)
+    n = matrici.shape[-1]
+    pesi, lambda_max = autovettore_principale(matrici)
+    ci, cr = consistenza(lambda_max, n)
+    return pesi, lambda_max, ci, cr
+
+@st.cache_data(show_spinner=False)
+def calcola_ahp(matrice):
+    """Pesi, lambda_max, CI e CR di una singola matrice (memoizzati sulla matrice)."""
+    pesi, lambda_max, ci, cr = valuta_matrici(matrice)
+    return pesi, float(lambda_max), float(ci), float(cr)
+
+def errore_matrice(matrice, tolleranza=0.02):
+    """
+    Controllo di una matrice di confronto caricata da file: valori finiti e
+    positivi, diagonale unitaria e reciprocità (a_ij * a_ji = 1 a meno di
+    `tolleranza`, per i giudizi scritti con pochi decimali come 0.33).
+    Restituisce la descrizione del primo problema trovato, o None.
+    """
+    matrice = np.asarray(matrice, dtype=float)
+    if not np.isfinite(matrice).all():
+        return "contiene celle vuote o non numeriche"
+    if (matrice <= 0).any():
+        return "contiene valori nulli o negativi"
+    if not np.allclose(np.diag(matrice), 1.0, rtol=0.0, atol=tolleranza):
+        return "la diagonale non vale 1"
+    i, j = indici_triangolo_superiore(matrice.shape[-1])
+    prodotti = matrice[i, j] * matrice[j, i]
+    if not np.allclose(prodotti, 1.0, rtol=0.0, atol=tolleranza):
+        k = int(np.argmax(np.abs(prodotti - 1.0)))
+        return f"non è reciproca (riga {i[k] + 1}, colonna {j[k] + 1}: {matrice[i[k], j[k]]:g} e {matrice[j[k], i[k]]:g})"
+    return None
+
+def aggrega_geometrica(matrici):
+    """
+    Aggregazione dei giudizi individuali (AIJ): media geometrica elemento per
+    elemento di una pila (k, n, n). Il risultato resta una matrice reciproca.
+    """
+    return np.exp(np.log(np.asarray(matrici, dtype=float)).mean(axis=0))
+
+def perturba_giudizi(matrice, n_campioni, sigma, rng, limita=True):
+    """
+    Campioni Monte Carlo di una matrice di confronto: ogni giudizio della parte
+    triangolare superiore viene perturbato in scala logaritmica con rumore
+    normale di deviazione `sigma` (e, se richiesto, limitato alla scala 1/9..9).
+    Restituisce una pila (n_campioni, n, n) di matrici reciproche.
+    """
+    n = matrice.shape[-1]
+    i, j = indici_triangolo_superiore(n)
+    log_valori = np.log(matrice[i, j]) + rng.normal(0.0, sigma, size=(n_campioni, len(i)))
+    if limita:
+        log_valori = np.clip(log_valori, -np.log(9), np.log(9))
+    return matrice_confronto(n, np.exp(log_valori))
+
+@st.cache_data(show_spinner="Analisi Monte Carlo in corso...")
+def sensibilita_monte_carlo(matrice, n_campioni=10000, sigma=0.2, livello=0.95, seed=0, blocco=5000):
+    """
+    Intervalli di confidenza dei pesi sotto perturbazione dei giudizi.
+    Le perturbazioni sono valutate a blocchi di `blocco` matrici alla volta.
+    Restituisce (media, inferiore, superiore, cr_medio, quota_consistenti).
+    """
+    rng = np.random.default_rng(seed)
+    pesi = []
+    cr = []
+    for inizio in range(0, n_campioni, blocco):
+        campioni = perturba_giudizi(matrice, min(blocco, n_campioni - inizio), sigma, rng)
+        w, _, _, cr_blocco = valuta_matrici(campioni)
+        pesi.append(w)
+        cr.append(cr_blocco)
+    pesi = np.concatenate(pesi)
+    cr = np.concatenate(cr)
+    alpha = (1 - livello) / 2
+    inferiore, superiore = np.quantile(pesi, [alpha, 1 - alpha], axis=0)
+    return pesi.mean(axis=0), inferiore, superiore, float(cr.mean()), float((cr <= SOGLIA_CR).mean())
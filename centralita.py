@@ -0,0 +1,236 @@
+import heapq
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+"""
+======================================
+BETWEENNESS CAMPIONATA (COLLI DI BOTTIGLIA)
+======================================
+
+- La betweenness esatta richiede una ricerca per ogni nodo (O(VE)): qui le
+  sorgenti sono un campione casuale di k nodi, eventualmente ristretto a un
+  sottoinsieme (le macchine nelle pagine dei percorsi), e i contributi vengono
+  riscalati sul numero totale di sorgenti.
+- Algoritmo di Brandes con Dijkstra su array CSR (posizioni intere invece dei
+  dizionari di networkx); con un insieme di destinazioni la ricerca si ferma
+  quando tutte sono state raggiunte.
+- Le sorgenti sono divise fra più processi, con un budget di tempo comune:
+  allo scadere ogni processo restituisce i contributi delle sorgenti già
+  elaborate, che restano un campione casuale (l'ordine è una permutazione).
+- In cache restano solo le stime complete: una stima troncata dal budget si
+  ricalcola alla prossima esecuzione invece di essere riproposta come finale.
+- Errore standard della stima per nodo dalla varianza campionaria dei
+  contributi per sorgente (campionamento senza reinserimento).
+"""
+
+###############################
+# 1. Grafo come array CSR
+###############################
+
+def grafo_csr(G, weight="weight", inverso=False):
+    """
+    Liste di adiacenza di G come array CSR (indptr, indici, pesi) sulle posizioni
+    dei nodi in G.nodes(). Con `inverso` la lunghezza dell'arco è 1/peso (i grafi
+    di Geo.py hanno peso = 1/distanza). Per i grafi non orientati ogni arco
+    compare nei due versi, come in G.adj. Restituisce (nodi, indptr, indici, pesi).
+    """
+    nodi = list(G.nodes())
+    posizione = {n: k for k, n in enumerate(nodi)}
+    indptr = [0]
+    indici, pesi = [], []
+    for n in nodi:
+        for m, attr in G.adj[n].items():
+            indici.append(posizione[m])
+            pesi.append(attr.get(weight, 1.0) if weight else 1.0)
+        indptr.append(len(indici))
+    pesi = np.asarray(pesi, dtype=float)
+    if inverso:
+        pesi = 1.0 / pesi
+    return nodi, np.asarray(indptr, dtype=np.int64), np.asarray(indici, dtype=np.int64), pesi
+
+###############################
+# 2. Contributo di una sorgente (Brandes)
+###############################
+
+def dipendenze_sorgente(indptr, indici, pesi, s, bersaglio, n_bersagli):
+    """
+    Dipendenze di Brandes della sorgente `s` verso i nodi con bersaglio[v] True
+    (liste Python, per velocità). Restituisce {nodo: dipendenza} dei soli nodi
+    intermedi con contributo non nullo.
+    """
+    sigma = {s: 1.0}
+    pred = {s: []}
+    visti = {s: 0.0}
+    fissati = {}
+    ordine = []
+    conta = itertools.count()
+    frangia = [(0.0, next(conta), s)]
+    mancanti = n_bersagli - (1 if bersaglio[s] else 0)
+    ultima = 0.0
+    while frangia:
+        d, _, v = heapq.heappop(frangia)
+        if v in fissati:
+            continue
+        # Raggiunti tutti i bersagli, i nodi più lontani non sono su nessun cammino minimo
+        if mancanti <= 0 and d > ultima:
+            break
+        fissati[v] = d
+        ordine.append(v)
+        if bersaglio[v] and v != s:
+            mancanti -= 1
+            ultima = d
+        sigma_v = sigma[v]
+        for k in range(indptr[v], indptr[v + 1]):
+            u = indici[k]
+            du = d + pesi[k]
+            if u in fissati:
+                continue
+            if u not in visti or du < visti[u]:
+                visti[u] = du
+                sigma[u] = sigma_v
+                pred[u] = [v]
+                heapq.heappush(frangia, (du, next(conta), u))
+            elif du == visti[u]:
+                sigma[u] += sigma_v
+                pred[u].append(v)
+    # Accumulazione all'indietro, nell'ordine inverso di visita
+    delta = dict.fromkeys(ordine, 0.0)
+    for w in reversed(ordine):
+        coeff = ((delta[w] + 1.0) if bersaglio[w] and w != s else delta[w]) / sigma[w]
+        for v in pred[w]:
+            delta[v] += sigma[v] * coeff
+    return {w: dw for w, dw in delta.items() if w != s and dw}
+
+###############################
+# 3. Campionamento parallelo con budget di tempo
+###############################
+
+# Grafo del processo di lavoro, impostato una volta sola dall'initializer
+_GRAFO = None
+
+def _imposta_grafo(indptr, indici, pesi, bersaglio):
+    global _GRAFO
+    bersaglio = np.asarray(bersaglio, dtype=bool)
+    _GRAFO = (indptr.tolist(), indici.tolist(), pesi.tolist(), bersaglio.tolist(), int(bersaglio.sum()))
+
+def _lotto(sorgenti, scadenza):
+    """Somma e somma dei quadrati dei contributi delle sorgenti elaborate entro la scadenza."""
+    indptr, indici, pesi, bersaglio, n_bersagli = _GRAFO
+    somma = np.zeros(len(indptr) - 1)
+    quadrati = np.zeros(len(indptr) - 1)
+    fatte = 0
+    for s in sorgenti:
+        if time.monotonic() > scadenza:
+            break
+        delta = dipendenze_sorgente(indptr, indici, pesi, s, bersaglio, n_bersagli)
+        if delta:
+            nodi = np.fromiter(delta.keys(), dtype=np.int64, count=len(delta))
+            valori = np.fromiter(delta.values(), dtype=float, count=len(delta))
+            somma[nodi] += valori
+            quadrati[nodi] += valori ** 2
+        fatte += 1
+    return somma, quadrati, fatte
+
+class _StimaInterrotta(Exception):
+    """Stima troncata dal budget di tempo: porta il risultato parziale fuori dalla cache."""
+
+    def __init__(self, risultato):
+        super().__init__("budget di tempo esaurito")
+        self.risultato = risultato
+
+def betweenness_campionata(indptr, indici, pesi, sorgenti=None, destinazioni=None,
+                           k=100, budget=30.0, processi=None, seed=0, non_orientato=False):
+    """
+    Stima della betweenness (non normalizzata, su coppie ordinate) con k sorgenti
+    estratte senza reinserimento da `sorgenti` (posizioni; None = tutti i nodi),
+    contando solo i cammini minimi verso `destinazioni` (None = tutti i nodi).
+    Con `non_orientato` (grafo non orientato, sorgenti e destinazioni uguali)
+    ogni coppia è contata una volta sola, come in networkx.
+    Il calcolo si divide su `processi` processi (None = numero di CPU) e si
+    interrompe dopo `budget` secondi.
+    Restituisce un dizionario: stima, errore (standard, per nodo), campioni
+    elaborati, sorgenti totali, completa (tutte le k sorgenti elaborate entro il
+    budget), coppie (numero di coppie sorgente-destinazione considerate) e tempo.
+    Solo le stime complete restano in cache: una stima troncata si ricalcola.
+    """
+    try:
+        risultato = _betweenness_completa(indptr, indici, pesi, sorgenti, destinazioni, k, budget, processi, seed)
+    except _StimaInterrotta as interrotta:
+        risultato = interrotta.risultato
+    if non_orientato:
+        risultato = dict(risultato, stima=risultato["stima"] / 2, errore=risultato["errore"] / 2,
+                         coppie=risultato["coppie"] // 2)
+    return risultato
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _betweenness_completa(indptr, indici, pesi, sorgenti, destinazioni, k, budget, processi, seed):
+    """Calcolo di betweenness_campionata. Le eccezioni non entrano in cache: una stima troncata solleva _StimaInterrotta."""
+    inizio = time.monotonic()
+    n = len(indptr) - 1
+    sorgenti = np.arange(n) if sorgenti is None else np.unique(np.asarray(sorgenti, dtype=np.int64))
+    bersaglio = np.ones(n, dtype=bool)
+    if destinazioni is not None:
+        bersaglio[:] = False
+        bersaglio[np.asarray(destinazioni, dtype=np.int64)] = True
+    N = len(sorgenti)
+    campione = np.random.default_rng(seed).permutation(sorgenti)[:min(k, N)].tolist()
+    processi = max(1, min(processi or os.cpu_count() or 1, len(campione)))
+    scadenza = inizio + budget
+    if processi == 1:
+        _imposta_grafo(indptr, indici, pesi, bersaglio)
+        parziali = [_lotto(campione, scadenza)]
+    else:
+        # Sorgenti distribuite a turno: ogni lotto è una parte della stessa permutazione casuale
+        with ProcessPoolExecutor(processi, initializer=_imposta_grafo,
+                                 initargs=(indptr, indici, pesi, bersaglio)) as pool:
+            parziali = list(pool.map(_lotto, [campione[p::processi] for p in range(processi)],
+                                     itertools.repeat(scadenza)))
+    somma = sum(p[0] for p in parziali)
+    quadrati = sum(p[1] for p in parziali)
+    m = sum(p[2] for p in parziali)
+    if m:
+        media = somma / m
+        stima = N * media
+    else:
+        stima = np.full(n, np.nan)
+    if m > 1:
+        varianza = np.maximum(quadrati - m * media ** 2, 0.0) / (m - 1)
+        # Correzione per popolazione finita: errore nullo se tutte le sorgenti sono state elaborate
+        errore = N * np.sqrt((1 - m / N) * varianza / m)
+    else:
+        errore = np.full(n, np.nan)
+    n_bersagli = int(bersaglio.sum())
+    coppie = N * n_bersagli - int(bersaglio[sorgenti].sum())
+    risultato = {"stima": stima, "errore": errore, "campioni": m, "sorgenti": N, "completa": m == len(campione),
+                 "coppie": coppie, "tempo": time.monotonic() - inizio}
+    if not risultato["completa"]:
+        raise _StimaInterrotta(risultato)
+    return risultato
+
+###############################
+# 4. Classifica
+###############################
+
+def classifica_colli(nomi, risultato, candidati=None, n=20):
+    """
+    I primi `n` nodi per betweenness stimata (solo le posizioni `candidati`, se
+    indicate), con errore standard, intervallo al 95% e quota dei cammini.
+    """
+    stima, errore = risultato["stima"], risultato["errore"]
+    candidati = np.arange(len(stima)) if candidati is None else np.asarray(candidati, dtype=np.int64)
+    primi = candidati[np.argsort(-np.nan_to_num(stima[candidati]), kind="stable")][:n]
+    primi = primi[np.nan_to_num(stima[primi]) > 0]
+    return pd.DataFrame({
+        "Nodo": [nomi[p] for p in primi],
+        "Betweenness stimata": stima[primi],
+        "Errore standard": errore[primi],
+        "Minimo (95%)": np.maximum(stima[primi] - 1.96 * errore[primi], 0.0),
+        "Massimo (95%)": stima[primi] + 1.96 * errore[primi],
+        "Quota dei cammini": stima[primi] / risultato["coppie"] if risultato["coppie"] else np.nan,
+    })
@@ -0,0 +1,142 @@
+import numpy as np
+import streamlit as st
+from scipy.spatial import cKDTree
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import minimum_spanning_tree
+import shapely
+
+"""
+======================================
+MOTORE DI CONNETTIVITÀ PER AREE VERDI E PARCHI
+======================================
+
+- Grafo di prossimità da coordinate con indice spaziale (KD-tree): due aree
+  sono collegate se la distanza è al di sotto della soglia.
+- In alternativa ai centroidi, distanza reale tra i bordi dei poligoni, con i
+  candidati filtrati da un STRtree (query "dwithin") invece di N² distanze.
+- Indici alpha/beta/gamma (come in Geo.py) e k/ρ/ε (come nella pagina dei parchi).
+- Curva delle metriche al variare della soglia in un solo passaggio: le coppie
+  vengono ordinate per distanza, per cui L(soglia) è una ricerca binaria, e le
+  componenti connesse seguono dall'unione incrementale delle coppie ordinate
+  (algoritmo di Kruskal, cioè gli archi dell'albero ricoprente minimo).
+"""
+
+###############################
+# 1. Coordinate e coppie vicine
+###############################
+
+def coordinate_metriche(lon, lat):
+    """
+    Proiezione equirettangolare locale (metri) di coordinate geografiche,
+    centrata sulla latitudine media: sufficiente a scala comunale/regionale.
+    """
+    lon = np.asarray(lon, dtype=float)
+    lat = np.asarray(lat, dtype=float)
+    lat0 = np.radians(lat.mean()) if lat.size else 0.0
+    x = (lon - lon.mean()) * 111320.0 * np.cos(lat0) if lon.size else lon
+    y = (lat - lat.mean()) * 110540.0 if lat.size else lat
+    return np.column_stack([x, y])
+
+def coppie_entro(coords, raggio):
+    """
+    Coppie (i, j) con i < j a distanza <= raggio, tramite KD-tree.
+    Restituisce (i, j, dist) ordinati per distanza crescente.
+    """
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    if len(coords) < 2:
+        vuoto = np.empty(0, dtype=np.int64)
+        return vuoto, vuoto, np.empty(0)
+    coppie = cKDTree(coords).query_pairs(r=raggio, output_type="ndarray")
+    i, j = coppie[:, 0], coppie[:, 1]
+    dist = np.linalg.norm(coords[i] - coords[j], axis=1)
+    ordine = np.argsort(dist, kind="stable")
+    return i[ordine], j[ordine], dist[ordine]
+
+###############################
+# 2. Indici di rete
+###############################
+
+def indici_alpha_beta_gamma(N, E):
+    """Alpha (circuitazione), beta (archi per nodo) e gamma (archi su massimo planare)."""
+    N = np.asarray(N, dtype=float)
+    E = np.asarray(E, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        alpha = np.where(N > 2, (E - N + 1) / (2 * N - 5), 0.0)
+        beta = np.where(N > 0, E / N, 0.0)
+        gamma = np.where(N > 2, E / (3 * (N - 2)), 0.0)
+    return alpha, beta, gamma
+
+def indici_k_rho_epsilon(V, L):
+    """Connettività k = L / (3(V-2)), resilienza ρ = (L-(V+1)) / (2V-5) ed ε = k + ρ."""
+    L = np.asarray(L, dtype=float)
+    if V <= 2 or (2 * V - 5) == 0:
+        nan = np.full_like(L, np.nan)
+        return nan, nan, nan
+    k = L / (3 * (V - 2))
+    rho = (L - (V + 1)) / (2 * V - 5)
+    return k, rho, k + rho
+
+###############################
+# 3. Grafo e curva delle metriche
+###############################
+
+def archi_prossimita(coords, soglia, pesi_inversi=True):
+    """
+    Archi del grafo di prossimità come array (i, j, peso): coppie a distanza
+    strettamente minore della soglia; con pesi_inversi il peso è 1/dist
+    (convenzione di Geo.py) e le coppie a distanza nulla vengono scartate.
+    """
+    i, j, dist = coppie_entro(coords, soglia)
+    valide = (dist < soglia) & (dist > 0) if pesi_inversi else dist < soglia
+    pesi = 1.0 / dist[valide] if pesi_inversi else dist[valide]
+    return i[valide], j[valide], pesi
+
+def archi_poligoni(geometrie, soglia, distanza_minima=1.0):
+    """
+    Archi tra poligoni il cui bordo dista meno della soglia (distanza 0 se si
+    toccano o si sovrappongono). I candidati vengono dall'STRtree con predicato
+    "dwithin", poi le distanze esatte sono calcolate in blocco solo su quelli.
+    Per restare compatibili con peso = 1/dist, la distanza usata per il peso è
+    limitata inferiormente a `distanza_minima`.
+    Restituisce (i, j, peso, dist) con i < j.
+    """
+    geometrie = np.asarray(geometrie)
+    albero = shapely.STRtree(geometrie)
+    i, j = albero.query(geometrie, predicate="dwithin", distance=soglia)
+    tieni = i < j
+    i, j = i[tieni], j[tieni]
+    dist = shapely.distance(geometrie[i], geometrie[j])
+    tieni = dist < soglia
+    i, j, dist = i[tieni], j[tieni], dist[tieni]
+    return i, j, 1.0 / np.maximum(dist, distanza_minima), dist
+
+@st.cache_data(show_spinner=False)
+def curva_connettivita(coords, soglie):
+    """
+    Metriche per tutte le soglie in un solo passaggio (soglie crescenti, inclusive).
+    Restituisce un dizionario di array allineati a `soglie`:
+    L, componenti, alpha, beta, gamma, k, rho, epsilon.
+    """
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    soglie = np.asarray(soglie, dtype=float)
+    V = len(coords)
+    i, j, dist = coppie_entro(coords, soglie.max() if soglie.size else 0.0)
+    L = np.searchsorted(dist, soglie, side="right")
+    # Unione incrementale delle coppie ordinate = archi dell'albero ricoprente minimo:
+    # le componenti a soglia t sono V meno gli archi dell'MST con peso <= t.
+    if len(dist):
+        # Le distanze nulle sarebbero scartate dalla matrice sparsa: l'albero si
+        # calcola sui pesi limitati, ma le unioni si decidono con le distanze originali
+        pesi = np.maximum(dist, np.finfo(float).tiny)
+        mst = minimum_spanning_tree(coo_matrix((pesi, (i, j)), shape=(V, V)).tocsr()).tocoo()
+        chiavi = i * V + j
+        ordine = np.argsort(chiavi)
+        chiavi_mst = np.minimum(mst.row, mst.col).astype(np.int64) * V + np.maximum(mst.row, mst.col)
+        dist_mst = np.sort(dist[ordine[np.searchsorted(chiavi[ordine], chiavi_mst)]])
+        componenti = V - np.searchsorted(dist_mst, soglie, side="right")
+    else:
+        componenti = np.full(len(soglie), V)
+    alpha, beta, gamma = indici_alpha_beta_gamma(V, L)
+    k, rho, epsilon = indici_k_rho_epsilon(V, L)
+    return {"soglia": soglie, "L": L, "componenti": componenti, "alpha": alpha, "beta": beta,
+            "gamma": gamma, "k": k, "rho": rho, "epsilon": epsilon}
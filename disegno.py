@@ -0,0 +1,358 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pydeck as pdk
+import streamlit as st
+import PIL.Image
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.patches import Patch
+from matplotlib.colors import to_rgba, Normalize
+from matplotlib.cm import ScalarMappable
+
+"""
+======================================
+DISEGNO VELOCE E CACHE DI RENDERING PER I GRAFI DEI CORRIDOI
+======================================
+
+- Tutti gli archi in un'unica LineCollection e tutti i nodi in un unico scatter
+  (invece di un artist per arco/etichetta come in nx.draw_networkx_*).
+- Etichette con livello di dettaglio: al massimo una per cella di una griglia
+  sull'area visibile, con priorità configurabile.
+- Decimazione opzionale degli archi quasi duplicati.
+- Il grafo di base (archi, nodi, etichette) e l'eventuale immagine di sfondo
+  vengono rasterizzati una sola volta per combinazione di layout, grafo ed
+  estensione; ai rerun successivi si riusa l'immagine in cache e si disegnano
+  sopra solo i percorsi selezionati.
+- Vista interattiva WebGL con pydeck (LineLayer/PathLayer/ScatterplotLayer) in
+  coordinate locali, alimentata da array compatti di coordinate.
+- Carichi sugli archi come mappa di calore (colore e spessore per arco) sopra
+  lo strato di base in cache o nella vista WebGL.
+- Campi raster (ad es. le distanze su griglia) sovrapposti in trasparenza allo
+  strato di base, senza cambiare i limiti del disegno.
+"""
+
+###############################
+# 1. Conversione del grafo in array
+###############################
+
+def arrays_grafo(G, pos):
+    """
+    Restituisce (nodi, indice, coords, archi):
+      - nodi: lista dei nodi nell'ordine di G.nodes()
+      - indice: dizionario nodo -> posizione nella lista
+      - coords: array (n, 2) con le coordinate dei nodi
+      - archi: array (m, 2) di indici interi (u, v)
+    """
+    nodi = list(G.nodes())
+    indice = {n: i for i, n in enumerate(nodi)}
+    coords = np.array([pos[n] for n in nodi], dtype=float).reshape(-1, 2)
+    archi = np.array([(indice[u], indice[v]) for u, v in G.edges()], dtype=np.int64).reshape(-1, 2)
+    return nodi, indice, coords, archi
+
+def limiti_disegno(coords, extent=None, margine=0.05):
+    """
+    Limiti (xmin, xmax, ymin, ymax) dell'area disegnata: bounding box dei nodi
+    (unito all'estensione dello sfondo, se presente) con un margine relativo.
+    """
+    if coords.size:
+        x_min, y_min = coords.min(axis=0)
+        x_max, y_max = coords.max(axis=0)
+    else:
+        x_min = y_min = 0.0
+        x_max = y_max = 1.0
+    if extent is not None:
+        x_min, x_max = min(x_min, extent[0]), max(x_max, extent[1])
+        y_min, y_max = min(y_min, extent[2]), max(y_max, extent[3])
+    dx = (x_max - x_min) * margine or 1.0
+    dy = (y_max - y_min) * margine or 1.0
+    return (float(x_min - dx), float(x_max + dx), float(y_min - dy), float(y_max + dy))
+
+###############################
+# 2. Primitive di disegno in blocco
+###############################
+
+def decima_archi(coords, archi, tolleranza=None):
+    """
+    Indici degli archi da disegnare dopo aver scartato i quasi duplicati:
+    gli estremi vengono arrotondati a una griglia di passo `tolleranza` e si tiene
+    un solo arco per coppia di celle (senza distinguere il verso). Gli archi che
+    collassano in un punto vengono scartati.
+    """
+    if not tolleranza or len(archi) == 0:
+        return np.arange(len(archi))
+    q = np.round(coords / tolleranza).astype(np.int64)
+    a = q[archi[:, 0]]
+    b = q[archi[:, 1]]
+    scambia = (a[:, 0] > b[:, 0]) | ((a[:, 0] == b[:, 0]) & (a[:, 1] > b[:, 1]))
+    lo = np.where(scambia[:, None], b, a)
+    hi = np.where(scambia[:, None], a, b)
+    chiavi = np.hstack([lo, hi])
+    _, keep = np.unique(chiavi, axis=0, return_index=True)
+    keep = keep[(chiavi[keep, :2] != chiavi[keep, 2:]).any(axis=1)]
+    return np.sort(keep)
+
+def seleziona_etichette(punti, limiti, max_etichette=200, priorita=None):
+    """
+    Livello di dettaglio delle etichette: scarta i punti fuori dai limiti e, se
+    ne restano più di `max_etichette`, ne tiene al più uno per cella di una griglia
+    di circa `max_etichette` celle (a parità di cella vince la priorità più alta).
+    """
+    x0, x1, y0, y1 = limiti
+    visibili = np.flatnonzero((punti[:, 0] >= x0) & (punti[:, 0] <= x1) &
+                              (punti[:, 1] >= y0) & (punti[:, 1] <= y1))
+    if len(visibili) <= max_etichette:
+        return visibili
+    if priorita is not None:
+        visibili = visibili[np.argsort(-np.asarray(priorita)[visibili], kind="stable")]
+    lato = max(int(np.sqrt(max_etichette)), 1)
+    gx = np.clip(((punti[visibili, 0] - x0) / ((x1 - x0) or 1.0) * lato).astype(np.int64), 0, lato - 1)
+    gy = np.clip(((punti[visibili, 1] - y0) / ((y1 - y0) or 1.0) * lato).astype(np.int64), 0, lato - 1)
+    _, primi = np.unique(gx * lato + gy, return_index=True)
+    return visibili[np.sort(primi)][:max_etichette]
+
+def disegna_archi(ax, coords, archi, colors="black", linewidths=1.0, alpha=1.0,
+                  frecce=False, tolleranza=None, zorder=1):
+    """
+    Disegna gli archi come un'unica LineCollection. Con `frecce=True` le punte
+    vengono aggiunte con un unico quiver (solo se gli archi sono al più 5000,
+    oltre sarebbero illeggibili). Restituisce gli indici degli archi disegnati.
+    """
+    keep = decima_archi(coords, archi, tolleranza)
+    if len(keep) == 0:
+        return keep
+    segmenti = coords[archi[keep]]
+    if not isinstance(colors, str):
+        colors = np.asarray(colors, dtype=object)[keep].tolist()
+    ax.add_collection(LineCollection(segmenti, colors=colors, linewidths=linewidths,
+                                     alpha=alpha, zorder=zorder))
+    if frecce and len(keep) <= 5000:
+        # Punta della freccia sull'ultimo 15% di ogni arco
+        inizio = segmenti[:, 0] + 0.85 * (segmenti[:, 1] - segmenti[:, 0])
+        delta = segmenti[:, 1] - inizio
+        ax.quiver(inizio[:, 0], inizio[:, 1], delta[:, 0], delta[:, 1],
+                  angles="xy", scale_units="xy", scale=1, width=0.003,
+                  headwidth=4, headlength=5, color=colors if isinstance(colors, str) else "black",
+                  alpha=alpha, zorder=zorder)
+    ax.update_datalim(segmenti.reshape(-1, 2))
+    ax.autoscale_view()
+    return keep
+
+def disegna_nodi(ax, coords, colors, sizes=50, zorder=2, label=None):
+    """Disegna tutti i nodi con un unico scatter."""
+    if len(coords) == 0:
+        return None
+    if not isinstance(colors, str):
+        colors = list(colors)
+    return ax.scatter(coords[:, 0], coords[:, 1], s=sizes, c=colors, zorder=zorder, label=label)
+
+def disegna_etichette(ax, punti, testi, limiti=None, max_etichette=200, priorita=None,
+                      fontsize=8, zorder=3, **kwargs):
+    """Disegna le etichette dei punti dopo la selezione per livello di dettaglio."""
+    if len(punti) == 0:
+        return
+    if limiti is None:
+        limiti = limiti_disegno(punti)
+    for i in seleziona_etichette(punti, limiti, max_etichette, priorita):
+        ax.text(punti[i, 0], punti[i, 1], testi[i], fontsize=fontsize,
+                ha="center", va="center", zorder=zorder, **kwargs)
+
+def disegna_etichette_archi(ax, coords, archi, testi, limiti=None, max_etichette=200, fontsize=7):
+    """Etichette degli archi al punto medio, con la stessa selezione delle etichette dei nodi."""
+    if len(archi) == 0:
+        return
+    medi = (coords[archi[:, 0]] + coords[archi[:, 1]]) / 2
+    disegna_etichette(ax, medi, testi, limiti, max_etichette, fontsize=fontsize,
+                      bbox=dict(boxstyle="round,pad=0.1", fc="white", ec="none", alpha=0.7))
+
+###############################
+# 3. Immagine di sfondo
+###############################
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def carica_sfondo(image_bytes: bytes) -> np.ndarray:
+    """Decodifica l'immagine di sfondo (una sola volta per contenuto del file)."""
+    return np.array(PIL.Image.open(io.BytesIO(image_bytes)).convert("RGB"))
+
+###############################
+# 4. Strato di base rasterizzato
+###############################
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def rasterizza_base(coords, archi, colori_nodi, limiti, sfondo_bytes=None, sfondo_extent=None,
+                    etichette=None, legenda=None, edge_color="lightgray", edge_alpha=0.4,
+                    node_size=50, max_etichette=200, tolleranza=None, figsize=(8, 6), dpi=150):
+    """
+    Disegna archi, nodi, etichette e sfondo su una figura che occupa tutta l'area
+    dei limiti e restituisce l'immagine RGBA come array (altezza, larghezza, 4).
+    Il risultato è in cache sugli input: grafo, sfondo, estensione e layout.
+    """
+    fig = Figure(figsize=figsize, dpi=dpi)
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.set_axis_off()
+    if sfondo_bytes is not None:
+        ax.imshow(carica_sfondo(sfondo_bytes), extent=sfondo_extent or limiti, aspect="auto")
+    disegna_archi(ax, coords, archi, colors=edge_color, alpha=edge_alpha, tolleranza=tolleranza)
+    disegna_nodi(ax, coords, colori_nodi, sizes=node_size)
+    if etichette is not None:
+        disegna_etichette(ax, coords, etichette, limiti, max_etichette)
+    if legenda:
+        handles = [Patch(color=colore, label=nome) for nome, colore in legenda]
+        ax.legend(handles=handles, loc="upper left")
+    ax.set_xlim(limiti[0], limiti[1])
+    ax.set_ylim(limiti[2], limiti[3])
+    canvas.draw()
+    return np.asarray(canvas.buffer_rgba()).copy()
+
+def mostra_base(ax, raster, limiti):
+    """Disegna lo strato di base in cache sull'asse, allineato alle coordinate reali."""
+    ax.imshow(raster, extent=limiti, aspect="auto", zorder=0)
+    ax.set_xlim(limiti[0], limiti[1])
+    ax.set_ylim(limiti[2], limiti[3])
+
+###############################
+# 5. Vista interattiva WebGL (pydeck)
+###############################
+
+def colore_rgba(colore, alpha=255):
+    """Converte un colore matplotlib (es. "skyblue") nella lista [r, g, b, a] usata da pydeck."""
+    r, g, b, _ = to_rgba(colore)
+    return [int(r * 255), int(g * 255), int(b * 255), int(alpha)]
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def dati_archi_webgl(coords, archi, decimali=3):
+    """
+    Tabella compatta degli archi per il LineLayer: solo le coordinate degli estremi
+    (sx, sy, tx, ty) in float32 arrotondato, calcolata una volta per grafo.
+    """
+    segmenti = np.round(coords[archi], decimali).astype(np.float32).reshape(-1, 4)
+    return pd.DataFrame(segmenti, columns=["sx", "sy", "tx", "ty"])
+
+def layer_archi(coords, archi, colore="lightgray", alpha=160, larghezza=1):
+    """LineLayer con tutti gli archi del grafo."""
+    return pdk.Layer(
+        "LineLayer",
+        data=dati_archi_webgl(coords, archi),
+        get_source_position="[sx, sy]",
+        get_target_position="[tx, ty]",
+        get_color=colore_rgba(colore, alpha),
+        get_width=larghezza,
+        width_units="pixels",
+    )
+
+def layer_nodi(coords, colori, nomi, raggio=4):
+    """ScatterplotLayer per macchine e corridoi (colore per nodo, nome nel tooltip)."""
+    df_nodi = pd.DataFrame({
+        "x": np.round(coords[:, 0], 3),
+        "y": np.round(coords[:, 1], 3),
+        "nome": list(nomi),
+        "colore": [colore_rgba(c) for c in colori],
+    })
+    return pdk.Layer(
+        "ScatterplotLayer",
+        data=df_nodi,
+        get_position="[x, y]",
+        get_fill_color="colore",
+        get_radius=raggio,
+        radius_units="pixels",
+        pickable=True,
+        auto_highlight=True,
+    )
+
+def layer_percorsi(percorsi, colori, nomi, larghezza=4):
+    """PathLayer con un percorso per riga (lista di coordinate [x, y])."""
+    df_percorsi = pd.DataFrame({
+        "path": [np.round(np.asarray(p, dtype=float), 3).tolist() for p in percorsi],
+        "nome": list(nomi),
+        "colore": [colore_rgba(c) for c in colori],
+    })
+    return pdk.Layer(
+        "PathLayer",
+        data=df_percorsi,
+        get_path="path",
+        get_color="colore",
+        get_width=larghezza,
+        width_units="pixels",
+        pickable=True,
+    )
+
+def vista_webgl(layers, coords):
+    """
+    Deck con vista ortografica (coordinate locali, nessuna mappa di base),
+    centrata sul bounding box dei nodi.
+    """
+    x_min, x_max, y_min, y_max = limiti_disegno(coords)
+    lato = max(x_max - x_min, y_max - y_min, 1e-9)
+    # Zoom ortografico: 2**zoom pixel per unità, in modo che il lato stia in ~800 px
+    zoom = float(np.log2(800 / lato))
+    view_state = pdk.ViewState(target=[(x_min + x_max) / 2, (y_min + y_max) / 2, 0], zoom=zoom,
+                               min_zoom=zoom - 4, max_zoom=zoom + 12)
+    return pdk.Deck(
+        layers=layers,
+        views=[pdk.View(type="OrthographicView", controller=True, flipY=False)],
+        initial_view_state=view_state,
+        map_style=None,
+        tooltip={"text": "{nome}"},
+    )
+
+###############################
+# 6. Carichi sugli archi (mappa di calore)
+###############################
+
+def scala_carichi(carichi, cmap="YlOrRd", larghezza_max=6.0):
+    """
+    Indici degli archi con carico positivo, colori RGBA e spessori proporzionali
+    al carico, più lo ScalarMappable per la barra dei colori.
+    """
+    carichi = np.asarray(carichi, dtype=float)
+    caricati = np.flatnonzero(carichi > 0)
+    massimo = carichi[caricati].max() if len(caricati) else 1.0
+    mappabile = ScalarMappable(norm=Normalize(vmin=0, vmax=massimo), cmap=cmap)
+    colori = mappabile.to_rgba(carichi[caricati])
+    larghezze = 1.0 + (larghezza_max - 1.0) * carichi[caricati] / massimo
+    return caricati, colori, larghezze, mappabile
+
+def disegna_carichi(ax, coords, archi, carichi, cmap="YlOrRd", zorder=2):
+    """Archi carichi come un'unica LineCollection colorata e con spessore per carico."""
+    caricati, colori, larghezze, mappabile = scala_carichi(carichi, cmap)
+    if len(caricati):
+        ax.add_collection(LineCollection(coords[archi[caricati]], colors=colori,
+                                         linewidths=larghezze, zorder=zorder))
+    return mappabile
+
+def layer_carichi(coords, archi, carichi, cmap="YlOrRd"):
+    """LineLayer dei soli archi carichi, con colore e spessore per arco e il carico nel tooltip."""
+    caricati, colori, larghezze, _ = scala_carichi(carichi, cmap)
+    df_carichi = dati_archi_webgl(coords, archi).iloc[caricati].reset_index(drop=True)
+    df_carichi["colore"] = (np.round(colori * 255).astype(int)).tolist()
+    df_carichi["larghezza"] = larghezze
+    df_carichi["nome"] = [f"Carico: {c:g}" for c in np.asarray(carichi, dtype=float)[caricati]]
+    return pdk.Layer(
+        "LineLayer",
+        data=df_carichi,
+        get_source_position="[sx, sy]",
+        get_target_position="[tx, ty]",
+        get_color="colore",
+        get_width="larghezza",
+        width_units="pixels",
+        pickable=True,
+    )
+
+###############################
+# 7. Campi raster sovrapposti
+###############################
+
+def disegna_campo(ax, valori, estensione, cmap="viridis", alpha=0.6, zorder=1):
+    """
+    Campo raster (righe crescenti con Y, NaN trasparenti) sopra lo strato di
+    base, con i limiti dell'asse invariati. Restituisce l'immagine per la colorbar.
+    """
+    xlim, ylim = ax.get_xlim(), ax.get_ylim()
+    immagine = ax.imshow(np.ma.masked_invalid(valori), origin="lower", extent=estensione, cmap=cmap,
+                         alpha=alpha, aspect="auto", interpolation="nearest", zorder=zorder)
+    ax.set_xlim(xlim)
+    ax.set_ylim(ylim)
+    return immagine
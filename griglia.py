@@ -0,0 +1,276 @@
+import hashlib
+import heapq
+import itertools
+import math
+import tempfile
+
+import numpy as np
+import streamlit as st
+from scipy.spatial import cKDTree
+
+"""
+======================================
+PERCORSI SU GRIGLIA (AREE CORRIDOIO MENO INGOMBRI DELLE MACCHINE)
+======================================
+
+- Griglia di occupazione: una cella è percorribile se il suo centro cade in un
+  rettangolo "Area Corridoio" e fuori dagli ingombri "Macchina_1". I
+  rettangoli si rasterizzano con differenze 2D e somme cumulative, senza cicli
+  sulle celle.
+- La griglia ha un bordo bloccato di una cella: i vicini (8 direzioni, le
+  diagonali solo se le due celle ortogonali sono libere) sono offset costanti
+  sull'array appiattito, con le mosse valide precalcolate per direzione.
+- A* con euristica octile per la singola coppia, senza calcolare campi.
+- Campo delle distanze da una destinazione con un fronte d'onda vettoriale: a
+  ogni passo si rilassano in blocco i vicini delle sole celle migliorate al
+  passo precedente. Il percorso da una cella qualsiasi scende lungo il campo,
+  per cui basta un campo per macchina di destinazione (anche come mappa).
+- Campi di tutte le macchine a blocchi di destinazioni: il fronte d'onda
+  avanza insieme su un blocco (indici piatti destinazione x cella) e i campi
+  impilati si scrivono in un file mappato in memoria (float32), per cui
+  qualsiasi distanza fra due macchine è una lettura O(1).
+- Le distanze sono in celle (passi 1 e √2) e si convertono con il passo della griglia.
+"""
+
+RADICE_2 = math.sqrt(2.0)
+
+# Direzioni (riga, colonna) e costo in celle: prima le ortogonali, poi le diagonali
+DIREZIONI = ((0, 1, 1.0), (0, -1, 1.0), (1, 0, 1.0), (-1, 0, 1.0),
+             (1, 1, RADICE_2), (1, -1, RADICE_2), (-1, 1, RADICE_2), (-1, -1, RADICE_2))
+
+###############################
+# 1. Griglia di occupazione
+###############################
+
+def rettangoli(df):
+    """Rettangoli (xmin, ymin, xmax, ymax) dalle colonne X, Y (vertice) e LenX, LenY (lati, anche negativi)."""
+    x = df["X"].to_numpy(dtype=float)
+    y = df["Y"].to_numpy(dtype=float)
+    x1 = x + df["LenX"].to_numpy(dtype=float)
+    y1 = y + df["LenY"].to_numpy(dtype=float)
+    rett = np.column_stack([np.minimum(x, x1), np.minimum(y, y1), np.maximum(x, x1), np.maximum(y, y1)])
+    return rett[np.isfinite(rett).all(axis=1)]
+
+def _copertura(rett, origine, passo, forma):
+    """Celle il cui centro cade in almeno un rettangolo: differenze 2D e somme cumulative."""
+    H, W = forma
+    if len(rett) == 0:
+        return np.zeros(forma, dtype=bool)
+    c0 = np.clip(np.ceil((rett[:, 0] - origine[0]) / passo - 0.5), 0, W).astype(np.int64)
+    c1 = np.clip(np.floor((rett[:, 2] - origine[0]) / passo - 0.5) + 1, 0, W).astype(np.int64)
+    r0 = np.clip(np.ceil((rett[:, 1] - origine[1]) / passo - 0.5), 0, H).astype(np.int64)
+    r1 = np.clip(np.floor((rett[:, 3] - origine[1]) / passo - 0.5) + 1, 0, H).astype(np.int64)
+    validi = (c1 > c0) & (r1 > r0)
+    c0, c1, r0, r1 = c0[validi], c1[validi], r0[validi], r1[validi]
+    diff = np.zeros((H + 1, W + 1), dtype=np.int32)
+    np.add.at(diff, (r0, c0), 1)
+    np.add.at(diff, (r0, c1), -1)
+    np.add.at(diff, (r1, c0), -1)
+    np.add.at(diff, (r1, c1), 1)
+    return diff.cumsum(axis=0).cumsum(axis=1)[:H, :W] > 0
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def griglia_occupazione(aree, ingombri, passo):
+    """
+    Griglia delle celle percorribili: aree corridoio meno ingombri delle macchine
+    (rettangoli come da `rettangoli`). Le righe crescono con Y.
+    Restituisce un dizionario: libero (H x W), origine (x, y dell'angolo), passo,
+    gli array appiattiti con bordo bloccato usati dalle ricerche e la chiave
+    (hash degli ingressi) per le cache dei campi.
+    """
+    aree = np.asarray(aree, dtype=float).reshape(-1, 4)
+    if len(aree) == 0:
+        raise ValueError("Nessuna area corridoio da rasterizzare")
+    origine = (float(aree[:, 0].min()), float(aree[:, 1].min()))
+    W = max(1, int(math.ceil((aree[:, 2].max() - origine[0]) / passo)))
+    H = max(1, int(math.ceil((aree[:, 3].max() - origine[1]) / passo)))
+    libero = (_copertura(aree, origine, passo, (H, W))
+              & ~_copertura(np.asarray(ingombri, dtype=float).reshape(-1, 4), origine, passo, (H, W)))
+    bordo = np.pad(libero, 1, constant_values=False)
+    Wp = W + 2
+    piatto = bordo.ravel()
+    offset = np.array([dr * Wp + dc for dr, dc, _ in DIREZIONI], dtype=np.int64)
+    costo = np.array([c for _, _, c in DIREZIONI])
+    # mosse[d, i]: da i si può andare in direzione d (destinazione libera e, in
+    # diagonale, entrambe le celle ortogonali libere: niente tagli sugli spigoli)
+    interni = np.flatnonzero(piatto)
+    mosse = np.zeros((len(DIREZIONI), piatto.size), dtype=bool)
+    for d, (dr, dc, _) in enumerate(DIREZIONI):
+        ok = piatto[interni + offset[d]]
+        if dr and dc:
+            ok &= piatto[interni + dr * Wp] & piatto[interni + dc]
+        mosse[d, interni[ok]] = True
+    chiave = hashlib.sha1(aree.tobytes() + np.asarray(ingombri, dtype=float).tobytes()
+                          + np.float64(passo).tobytes()).hexdigest()
+    return {"libero": libero, "origine": origine, "passo": float(passo), "larghezza": Wp,
+            "piatto": piatto, "offset": offset, "costo": costo, "mosse": mosse, "chiave": chiave}
+
+def centri(griglia, celle):
+    """Coordinate dei centri delle celle (indici appiattiti con bordo)."""
+    celle = np.asarray(celle, dtype=np.int64)
+    righe = celle // griglia["larghezza"] - 1
+    colonne = celle % griglia["larghezza"] - 1
+    return np.column_stack([griglia["origine"][0] + (colonne + 0.5) * griglia["passo"],
+                            griglia["origine"][1] + (righe + 0.5) * griglia["passo"]])
+
+def estensione(griglia):
+    """Estensione (xmin, xmax, ymin, ymax) della griglia, per imshow con origin="lower"."""
+    H, W = griglia["libero"].shape
+    x0, y0 = griglia["origine"]
+    return (x0, x0 + W * griglia["passo"], y0, y0 + H * griglia["passo"])
+
+def celle_accesso(griglia, punti):
+    """
+    Cella libera più vicina a ciascun punto (ad es. il centro di una macchina,
+    che cade nel suo ingombro) e distanza dal centro della cella.
+    Restituisce (celle, distanze).
+    """
+    libere = np.flatnonzero(griglia["piatto"])
+    if len(libere) == 0:
+        raise ValueError("La griglia non ha celle percorribili")
+    dist, vicino = cKDTree(centri(griglia, libere)).query(np.asarray(punti, dtype=float).reshape(-1, 2))
+    return libere[vicino], dist
+
+###############################
+# 2. A* sulla singola coppia
+###############################
+
+def a_stella(griglia, partenza, arrivo):
+    """
+    A* con euristica octile (ammissibile per passi 1 e √2).
+    Restituisce (lunghezza in celle, celle del percorso) oppure (None, None).
+    """
+    partenza, arrivo = int(partenza), int(arrivo)
+    Wp = griglia["larghezza"]
+    offset = griglia["offset"].tolist()
+    costo = griglia["costo"].tolist()
+    mosse = griglia["mosse"]
+    ra, ca = divmod(arrivo, Wp)
+
+    def stima(i):
+        dr, dc = abs(i // Wp - ra), abs(i % Wp - ca)
+        return (RADICE_2 - 1.0) * min(dr, dc) + max(dr, dc)
+
+    g = {partenza: 0.0}
+    pred = {partenza: None}
+    chiusi = set()
+    conta = itertools.count()
+    frangia = [(stima(partenza), next(conta), partenza)]
+    while frangia:
+        _, _, v = heapq.heappop(frangia)
+        if v in chiusi:
+            continue
+        if v == arrivo:
+            percorso = []
+            while v is not None:
+                percorso.append(v)
+                v = pred[v]
+            return g[arrivo], percorso[::-1]
+        chiusi.add(v)
+        gv = g[v]
+        for d in range(len(offset)):
+            if not mosse[d, v]:
+                continue
+            u = v + offset[d]
+            gu = gv + costo[d]
+            if u not in chiusi and gu < g.get(u, math.inf):
+                g[u] = gu
+                pred[u] = v
+                heapq.heappush(frangia, (gu + stima(u), next(conta), u))
+    return None, None
+
+###############################
+# 3. Campi delle distanze (fronte d'onda)
+###############################
+
+def campo_distanze(griglia, bersaglio):
+    """
+    Distanza in celle di ogni cella da `bersaglio` (inf se non raggiungibile),
+    sull'array appiattito con bordo. Le mosse sono simmetriche, per cui è anche
+    la distanza verso il bersaglio.
+    """
+    offset, costo, mosse = griglia["offset"], griglia["costo"], griglia["mosse"]
+    dist = np.full(griglia["piatto"].size, np.inf)
+    dist[bersaglio] = 0.0
+    fronte = np.array([bersaglio], dtype=np.int64)
+    while fronte.size:
+        celle, valori = [], []
+        for d in range(len(offset)):
+            da = fronte[mosse[d, fronte]]
+            celle.append(da + offset[d])
+            valori.append(dist[da] + costo[d])
+        celle = np.concatenate(celle)
+        valori = np.concatenate(valori)
+        # Solo i miglioramenti reali (la tolleranza evita ripassaggi per arrotondamento)
+        migliori = valori < dist[celle] - 1e-9
+        celle, valori = celle[migliori], valori[migliori]
+        np.minimum.at(dist, celle, valori)
+        fronte = np.unique(celle)
+    return dist
+
+def discesa(griglia, campo, partenza):
+    """Celle del percorso da `partenza` al bersaglio del campo, scendendo lungo le distanze (None se irraggiungibile)."""
+    if not np.isfinite(campo[partenza]):
+        return None
+    offset, costo, mosse = griglia["offset"], griglia["costo"], griglia["mosse"]
+    percorso = [int(partenza)]
+    v = int(partenza)
+    while campo[v] > 0:
+        validi = mosse[:, v]
+        vicini = v + offset[validi]
+        v = int(vicini[np.argmin(campo[vicini] + costo[validi])])
+        percorso.append(v)
+    return percorso
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def campi_distanze(chiave, _griglia, bersagli, blocco=8):
+    """
+    Campi delle distanze (in celle) da tutti i `bersagli` (celle), calcolati a
+    blocchi di `blocco` destinazioni con un solo fronte d'onda per blocco e
+    scritti in un memmap float32 (righe = bersagli, colonne = celle con bordo)
+    su un file temporaneo anonimo. `chiave` è la chiave della griglia: la
+    griglia stessa non viene ri-hashata. In cache come risorsa, senza copie.
+    """
+    offset, costo, mosse = _griglia["offset"], _griglia["costo"], _griglia["mosse"]
+    N = _griglia["piatto"].size
+    campi = np.memmap(tempfile.TemporaryFile(), dtype=np.float32, mode="w+", shape=(len(bersagli), N))
+    for inizio in range(0, len(bersagli), blocco):
+        gruppo = np.asarray(bersagli[inizio:inizio + blocco], dtype=np.int64)
+        # Indici piatti (riga del blocco) * N + cella: le mosse non escono mai dalla
+        # riga perché partono e arrivano su celle interne (bordo bloccato)
+        dist = np.full(len(gruppo) * N, np.inf)
+        fronte = np.arange(len(gruppo)) * N + gruppo
+        dist[fronte] = 0.0
+        while fronte.size:
+            cella = fronte % N
+            celle, valori = [], []
+            for d in range(len(offset)):
+                ok = mosse[d, cella]
+                da = fronte[ok]
+                celle.append(da + offset[d])
+                valori.append(dist[da] + costo[d])
+            celle = np.concatenate(celle)
+            valori = np.concatenate(valori)
+            migliori = valori < dist[celle] - 1e-9
+            celle, valori = celle[migliori], valori[migliori]
+            np.minimum.at(dist, celle, valori)
+            fronte = np.unique(celle)
+        campi[inizio:inizio + len(gruppo)] = dist.reshape(len(gruppo), N)
+    campi.flush()
+    return campi
+
+def distanze_fra_accessi(griglia, campi, celle, scarti):
+    """
+    Matrice delle distanze (unità del disegno) fra i punti di accesso dei
+    bersagli dei campi, nello stesso ordine: una lettura per coppia, più i
+    tratti punto -> cella ai due estremi. D[i, j] va da i a j (inf se irraggiungibile).
+    """
+    scarti = np.asarray(scarti, dtype=float)
+    return (np.asarray(campi[:, celle], dtype=float).T * griglia["passo"]
+            + scarti[:, None] + scarti[None, :])
+
+def mappa_campo(griglia, campo):
+    """Campo di un bersaglio come immagine H x W nelle unità del disegno (NaN fuori dalle celle raggiungibili)."""
+    H, W = griglia["libero"].shape
+    valori = np.asarray(campo, dtype=float).reshape(H + 2, W + 2)[1:-1, 1:-1] * griglia["passo"]
+    return np.where(np.isfinite(valori), valori, np.nan)
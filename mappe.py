@@ -0,0 +1,109 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+import folium
+from folium.plugins import FastMarkerCluster
+import streamlit as st
+import streamlit.components.v1 as components
+
+"""
+======================================
+RENDERING IN BLOCCO DELLE MAPPE FOLIUM
+======================================
+
+- Un solo layer GeoJSON per tutto il GeoDataFrame (invece di un layer per riga).
+- Semplificazione opzionale delle geometrie con tolleranza pari a circa un
+  pixel al livello di zoom iniziale.
+- Punti come un unico layer GeoJSON di CircleMarker oppure, con il clustering,
+  come un unico FastMarkerCluster (i marker vengono creati dal browser).
+- L'HTML generato è in cache per hash del dataset e dei parametri di resa.
+"""
+
+# Metri per pixel all'equatore a zoom 0 (tile 256 px, Web Mercator)
+METRI_PIXEL_ZOOM_0 = 156543.03392
+
+def hash_dataset(df) -> str:
+    """Hash del contenuto di un (Geo)DataFrame, geometrie incluse (come WKB)."""
+    h = hashlib.sha1()
+    h.update(repr(list(df.columns)).encode())
+    dati = df.drop(columns=[df.geometry.name]) if hasattr(df, "geometry") else df
+    h.update(pd.util.hash_pandas_object(dati, index=True).to_numpy().tobytes())
+    if hasattr(df, "geometry"):
+        h.update(b"".join(df.geometry.to_wkb().tolist()))
+    return h.hexdigest()
+
+def tolleranza_zoom(zoom, lat):
+    """Tolleranza di semplificazione (gradi) pari a circa un pixel allo zoom indicato."""
+    metri = METRI_PIXEL_ZOOM_0 * np.cos(np.radians(lat)) / 2 ** zoom
+    return metri / 111320.0
+
+def mostra_html(html, height=500, width=700):
+    """Visualizza l'HTML di una mappa folium (come folium_static, ma da stringa in cache)."""
+    components.html(html, height=height + 10, width=width)
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def mappa_poligoni_html(chiave, _gdf, zoom_start=13, semplifica=True,
+                        fill_color="green", color="black", weight=1):
+    """
+    HTML di una mappa con tutte le geometrie in un unico layer GeoJSON.
+    `chiave` è l'hash del dataset (hash_dataset): il GeoDataFrame non viene
+    ri-hashato a ogni rerun.
+    """
+    gdf = _gdf[[_gdf.geometry.name]]
+    if gdf.crs is not None and not gdf.crs.is_geographic:
+        gdf = gdf.to_crs(epsg=4326)
+    minx, miny, maxx, maxy = gdf.total_bounds
+    centro = [(miny + maxy) / 2, (minx + maxx) / 2]
+    if semplifica:
+        gdf = gdf.set_geometry(gdf.geometry.simplify(tolleranza_zoom(zoom_start, centro[0]),
+                                                     preserve_topology=True))
+    m = folium.Map(location=centro, zoom_start=zoom_start)
+    folium.GeoJson(
+        gdf.to_json(),
+        style_function=lambda x: {"fillColor": fill_color, "color": color, "weight": weight},
+    ).add_to(m)
+    return m.get_root().render()
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def mappa_punti_html(chiave, _df, lat_col, lon_col, popup_col=None, radius_col=None, radius_scale=1.0,
+                     cluster=False, color="blue", zoom_start=13):
+    """
+    HTML di una mappa di punti in un unico layer: GeoJSON di CircleMarker con
+    raggio per punto, oppure FastMarkerCluster con `cluster=True`.
+    `chiave` è l'hash del DataFrame (hash_dataset).
+    """
+    lat = _df[lat_col].to_numpy(dtype=float)
+    lon = _df[lon_col].to_numpy(dtype=float)
+    m = folium.Map(location=[lat.mean(), lon.mean()], zoom_start=zoom_start)
+    popup = _df[popup_col].astype(str).tolist() if popup_col else [""] * len(_df)
+    raggi = (_df[radius_col].to_numpy(dtype=float) * radius_scale if radius_col
+             else np.full(len(_df), 5.0))
+    if cluster:
+        callback = f"""
+        function (row) {{
+            var marker = L.circleMarker(new L.LatLng(row[0], row[1]),
+                {{radius: row[3], color: '{color}', fill: true, fillColor: '{color}', fillOpacity: 0.6}});
+            marker.bindPopup(row[2]);
+            return marker;
+        }};
+        """
+        dati = [[a, b, p, r] for a, b, p, r in zip(lat.tolist(), lon.tolist(), popup, raggi.tolist())]
+        FastMarkerCluster(dati, callback=callback).add_to(m)
+    else:
+        features = {
+            "type": "FeatureCollection",
+            "features": [
+                {"type": "Feature",
+                 "geometry": {"type": "Point", "coordinates": [b, a]},
+                 "properties": {"popup": p, "radius": r}}
+                for a, b, p, r in zip(lat.tolist(), lon.tolist(), popup, raggi.tolist())
+            ],
+        }
+        folium.GeoJson(
+            features,
+            marker=folium.CircleMarker(color=color, fill=True, fill_color=color, fill_opacity=0.6),
+            style_function=lambda x: {"radius": x["properties"]["radius"]},
+            popup=folium.GeoJsonPopup(fields=["popup"], labels=False),
+        ).add_to(m)
+    return m.get_root().render()
@@ -2,6 +2,8 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import io
+from ahp import (indici_triangolo_superiore, matrice_confronto, valore_giudizio, calcola_ahp, SOGLIA_CR,
+                 valuta_matrici, errore_matrice, aggrega_geometrica, sensibilita_monte_carlo)
 
 st.title("AHP per la Biodiversità")
 st.write("Questa app permette di selezionare indicatori per ogni macrofamiglia e confrontarli tramite AHP.")
@@ -47,63 +49,50 @@ st.write("Indicatori selezionati:", all_selected)
 if len(all_selected) > 1:
     st.header("Confronto AHP")
     n = len(all_selected)
-    # Inizializza la matrice AHP con la diagonale uguale a 1
-    comparison_matrix = np.ones((n, n))
+    i_idx, j_idx = indici_triangolo_superiore(n)
+    opzioni = [
+        "Sono equamente importanti",
+        "A è poco più importante di B",
+        "A è abbastanza più importante di B",
+        "A è decisamente più importante di B",
+        "A è assolutamente più importante di B"
+    ]
+    pairs_df = pd.DataFrame({
+        "Indicatore A": [all_selected[i] for i in i_idx],
+        "Indicatore B": [all_selected[j] for j in j_idx],
+        "Giudizio": opzioni[0]
+    })
     
-    # Creiamo un form per raccogliere le risposte
+    # Creiamo un form per raccogliere le risposte: un'unica tabella con una riga per coppia
     with st.form("ahp_form"):
-        responses = {}
-        st.write("Per ciascuna coppia, espandi la sezione e seleziona il rapporto di importanza.")
-        for i in range(n):
-            for j in range(i+1, n):
-                indic_i = all_selected[i]
-                indic_j = all_selected[j]
-                with st.expander(f"Confronta '{indic_i}' vs '{indic_j}'", expanded=False):
-                    option = st.radio(
-                        "Seleziona l'opzione che descrive meglio il rapporto di importanza:",
-                        (
-                            "Sono equamente importanti",
-                            f"'{indic_i}' è poco più importante di '{indic_j}'",
-                            f"'{indic_i}' è abbastanza più importante di '{indic_j}'",
-                            f"'{indic_i}' è decisamente più importante di '{indic_j}'",
-                            f"'{indic_i}' è assolutamente più importante di '{indic_j}'"
-                        ),
-                        index=0,
-                        key=f"{i}_{j}"
-                    )
-                    responses[f"{i}_{j}"] = option
+        st.write("Per ciascuna coppia, seleziona nella colonna 'Giudizio' il rapporto di importanza di A rispetto a B.")
+        responses_df = st.data_editor(
+            pairs_df,
+            column_config={
+                "Giudizio": st.column_config.SelectboxColumn("Giudizio", options=opzioni, required=True)
+            },
+            disabled=["Indicatore A", "Indicatore B"],
+            hide_index=True,
+            use_container_width=True,
+            key="ahp_pairs"
+        )
         submit = st.form_submit_button("Calcola Pesi")
     
     if submit:
         # Costruzione della matrice di confronto AHP basata sulle risposte
-        for i in range(n):
-            for j in range(i+1, n):
-                option = responses[f"{i}_{j}"]
-                if option == "Sono equamente importanti":
-                    value = 1
-                elif "poco più importante" in option:
-                    value = 3
-                elif "abbastanza più importante" in option:
-                    value = 5
-                elif "decisamente più importante" in option:
-                    value = 7
-                elif "assolutamente più importante" in option:
-                    value = 9
-                else:
-                    value = 1
-                comparison_matrix[i, j] = value
-                comparison_matrix[j, i] = 1 / value
+        valori = [valore_giudizio(option) for option in responses_df["Giudizio"]]
+        comparison_matrix = matrice_confronto(n, valori)
         
         # Creazione di un DataFrame per la matrice con etichette su righe e colonne
         matrix_df = pd.DataFrame(comparison_matrix, index=all_selected, columns=all_selected)
         st.subheader("Matrice di confronto AHP")
         st.dataframe(matrix_df)
         
-        # 4. Calcolo dei pesi relativi tramite il metodo degli autovalori
-        eigenvalues, eigenvectors = np.linalg.eig(comparison_matrix)
-        max_index = np.argmax(eigenvalues.real)
-        weights = eigenvectors[:, max_index].real
-        weights = weights / np.sum(weights)  # normalizza i pesi
+        # 4. Calcolo dei pesi relativi (autovettore principale) e della consistenza
+        weights, lambda_max, ci, cr = calcola_ahp(comparison_matrix)
+        st.write(f"**λ max:** {lambda_max:.4f} — **CI:** {ci:.4f} — **CR:** {cr:.4f}")
+        if cr > SOGLIA_CR:
+            st.warning(f"Il rapporto di consistenza supera {SOGLIA_CR:.2f}: i giudizi andrebbero rivisti.")
         
         weights_df = pd.DataFrame({
             'Indicatore': all_selected,
@@ -130,3 +119,77 @@ if len(all_selected) > 1:
 
 
 
+
+# 6. Modalità multi-esperto: più questionari in un unico passaggio
+st.header("Analisi multi-esperto")
+st.write("Carica un file Excel con un foglio per esperto: ogni foglio contiene la matrice di confronto "
+         "quadrata, con i nomi degli indicatori nella prima colonna e nell'intestazione.")
+experts_file = st.file_uploader("File dei questionari (un foglio per esperto)", type=["xlsx"], key="ahp_esperti")
+if experts_file is not None:
+    try:
+        sheets = pd.read_excel(experts_file, sheet_name=None, index_col=0)
+    except Exception as e:
+        st.error("Errore nel caricamento del file: " + str(e))
+        sheets = {}
+    if sheets:
+        esperti = list(sheets.keys())
+        indicatori = [str(c) for c in next(iter(sheets.values())).columns]
+        matrici = []
+        for nome, sheet in sheets.items():
+            sheet.index = sheet.index.astype(str)
+            sheet.columns = sheet.columns.astype(str)
+            if sorted(sheet.index) != sorted(indicatori) or sorted(sheet.columns) != sorted(indicatori):
+                st.error(f"Il foglio '{nome}' non contiene gli stessi indicatori del primo foglio.")
+                matrici = []
+                break
+            # Testo e celle vuote diventano NaN e vengono segnalati dal controllo
+            matrice = sheet.loc[indicatori, indicatori].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+            errore = errore_matrice(matrice)
+            if errore is not None:
+                st.error(f"La matrice del foglio '{nome}' {errore}.")
+                matrici = []
+                break
+            matrici.append(matrice)
+        if matrici:
+            matrici = np.stack(matrici)
+            # Autovettori di tutti gli esperti in un'unica chiamata vettoriale
+            pesi_esperti, _, _, cr_esperti = valuta_matrici(matrici)
+            experts_df = pd.DataFrame(pesi_esperti, index=esperti, columns=indicatori)
+            experts_df["CR"] = cr_esperti
+            st.subheader("Pesi per esperto")
+            st.dataframe(experts_df)
+            
+            # Aggregazione per media geometrica dei giudizi
+            matrice_aggregata = aggrega_geometrica(matrici)
+            pesi_aggregati, _, _, cr_aggregato = calcola_ahp(matrice_aggregata)
+            st.write(f"**CR della matrice aggregata:** {cr_aggregato:.4f}")
+            
+            # Sensibilità Monte Carlo
+            col1, col2 = st.columns(2)
+            n_campioni = col1.number_input("Numero di perturbazioni", min_value=100, max_value=100000,
+                                           value=10000, step=1000)
+            sigma = col2.slider("Deviazione standard delle perturbazioni (scala logaritmica)",
+                                min_value=0.0, max_value=1.0, value=0.2, step=0.05)
+            media, inferiore, superiore, cr_medio, quota = sensibilita_monte_carlo(
+                matrice_aggregata, int(n_campioni), sigma)
+            aggregated_df = pd.DataFrame({
+                'Indicatore': indicatori,
+                'Peso Relativo': pesi_aggregati,
+                'Media Monte Carlo': media,
+                'IC 2.5%': inferiore,
+                'IC 97.5%': superiore
+            })
+            st.subheader("Pesi aggregati e intervalli di confidenza (95%)")
+            st.dataframe(aggregated_df)
+            st.write(f"CR medio delle perturbazioni: {cr_medio:.4f} — quota consistente (CR ≤ {SOGLIA_CR:.2f}): {quota:.1%}")
+            
+            output = io.BytesIO()
+            with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+                aggregated_df.to_excel(writer, index=False, sheet_name='AHP_Weights')
+                experts_df.to_excel(writer, sheet_name='Esperti')
+            st.download_button(
+                label="Scarica i pesi aggregati (Excel)",
+                data=output.getvalue(),
+                file_name="ahp_weights_esperti.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            )
@@ -1,7 +1,6 @@
 import streamlit as st
-import folium
-from streamlit_folium import st_folium
 import pandas as pd
+from mappe import hash_dataset, mappa_punti_html, mostra_html
 
 st.set_page_config(layout="wide", page_title="Mappa con Folium")
 
@@ -14,21 +13,16 @@ data = {
 }
 df = pd.DataFrame(data)
 
-# Crea la mappa centrata sulla media delle coordinate
-m = folium.Map(location=[df['lat'].mean(), df['lon'].mean()], zoom_start=13)
-
-# Aggiungi marker o cerchi per ogni parco
-for idx, row in df.iterrows():
-    folium.CircleMarker(
-        location=[row['lat'], row['lon']],
-        radius=row['Copertura Vegetale'] / 5,  # Puoi regolare il fattore di scala
-        popup=row['Nome Parco'],
-        color='blue',
-        fill=True,
-        fill_color='blue',
-        fill_opacity=0.6
-    ).add_to(m)
+# Mappa centrata sulla media delle coordinate, con tutti i parchi in un unico layer
+cluster = st.checkbox("Raggruppa i marker (clustering)", value=len(df) > 1000)
+html = mappa_punti_html(
+    hash_dataset(df), df, "lat", "lon",
+    popup_col="Nome Parco",
+    radius_col="Copertura Vegetale",
+    radius_scale=1 / 5,  # Puoi regolare il fattore di scala
+    cluster=cluster
+)
 
 # Visualizza la mappa in Streamlit
 st.subheader("Mappa dei Parchi con Folium")
-st_folium(m, width=700, height=500)
+mostra_html(html, height=500, width=700)
@@ -3,10 +3,17 @@ import pandas as pd
 import pydeck as pdk
 import io
 import altair as alt
+import numpy as np
+import hashlib
+from connettivita import coordinate_metriche, curva_connettivita
 
 # Definisci variabili globali per evitare NameError
 indicators = []
 weights_dict = {}
+scenarios_df = None
+
+# Numero massimo di parchi nel grafico a barre (gli altri restano nella tabella)
+MAX_CHART_PARKS = 50
 
 # ------------------------------
 # Funzioni di utilità
@@ -15,6 +22,35 @@ weights_dict = {}
 def load_excel(file) -> pd.DataFrame:
     return pd.read_excel(file)
 
+def data_key(*parts) -> str:
+    """
+    Chiave (hash) degli input di uno stadio della pipeline: i DataFrame sono
+    ridotti con pd.util.hash_pandas_object, gli altri oggetti con repr.
+    """
+    h = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, pd.DataFrame):
+            h.update(repr(list(part.columns)).encode())
+            h.update(pd.util.hash_pandas_object(part, index=True).to_numpy().tobytes())
+        elif isinstance(part, np.ndarray):
+            h.update(part.tobytes())
+        else:
+            h.update(repr(part).encode())
+    return h.hexdigest()
+
+def pipeline_stage(name: str, key: str, compute):
+    """
+    Memoizzazione per sessione di uno stadio della pipeline
+    parchi/AHP/assegnazione -> compositi -> analisi -> grafici.
+    Lo stadio viene ricalcolato solo se la chiave dei suoi input è cambiata;
+    restituisce il risultato (da non modificare sul posto).
+    """
+    cache = st.session_state.setdefault("pipeline_cache", {})
+    entry = cache.get(name)
+    if entry is None or entry[0] != key:
+        cache[name] = (key, compute())
+    return cache[name][1]
+
 def load_ahp_data(file) -> tuple:
     try:
         df = load_excel(file)
@@ -62,19 +98,67 @@ def create_assignment_table(df_parks: pd.DataFrame, inds: list) -> pd.DataFrame:
         df[ind] = 0.0
     return df
 
+def contributions_matrix(df_parks: pd.DataFrame, assignment_df: pd.DataFrame, inds: list, weights_dict: dict) -> np.ndarray:
+    """
+    Matrice (parchi × indicatori) dei contributi peso * valore, nell'ordine di df_parks.
+    """
+    merged = pd.merge(df_parks[["Nome Parco"]], assignment_df, on="Nome Parco", how="left")
+    values = merged.reindex(columns=inds, fill_value=0).to_numpy(dtype=float)
+    weights = np.array([weights_dict.get(ind, 0) for ind in inds], dtype=float)
+    return values * weights
+
 def calculate_composite_values(df_parks: pd.DataFrame, assignment_df: pd.DataFrame, inds: list, weights_dict: dict) -> pd.DataFrame:
-    merged = pd.merge(df_parks[["Nome Parco", "Copertura Vegetale"]], assignment_df, on="Nome Parco", how="left")
-    composite_values = []
-    for idx, row in merged.iterrows():
-        weighted_sum = sum(weights_dict.get(ind, 0) * row.get(ind, 0) for ind in inds)
-        composite = row["Copertura Vegetale"] * (1 + weighted_sum)
-        composite_values.append(composite)
-    if len(composite_values) == len(df_parks):
-        df_parks["Composite Value"] = composite_values
+    contributions = contributions_matrix(df_parks, assignment_df, inds, weights_dict)
+    if contributions.shape[0] == len(df_parks):
+        # Prodotto matrice-vettore: somma pesata degli indicatori per tutti i parchi
+        weighted_sum = contributions.sum(axis=1)
+        df_parks["Composite Value"] = df_parks["Copertura Vegetale"].to_numpy(dtype=float) * (1 + weighted_sum)
     else:
         st.error("Errore nel calcolo dei valori compositi.")
     return df_parks
 
+def load_scenarios_data(file) -> pd.DataFrame:
+    """
+    File degli scenari: colonna "Indicatore" più una colonna di pesi per ciascuno scenario.
+    Restituisce un DataFrame indicizzato per indicatore (una colonna per scenario).
+    """
+    try:
+        df = load_excel(file)
+        if "Indicatore" not in df.columns or df.shape[1] < 2:
+            st.error("Il file degli scenari deve contenere la colonna 'Indicatore' e almeno una colonna di pesi.")
+            return None
+        scenarios = df.set_index("Indicatore").apply(pd.to_numeric, errors="coerce").fillna(0.0)
+        scenarios.columns = [str(c) for c in scenarios.columns]
+        return scenarios
+    except Exception as e:
+        st.error(f"Errore nel caricamento del file degli scenari: {e}")
+        return None
+
+@st.cache_data(show_spinner=False)
+def scenario_composites(coverage: np.ndarray, values: np.ndarray, weights: np.ndarray) -> tuple:
+    """
+    Valori compositi di tutti i parchi sotto tutti gli scenari con un'unica
+    moltiplicazione matriciale: coverage * (1 + values @ weights).
+    values: (parchi × indicatori), weights: (indicatori × scenari).
+    Restituisce (compositi, ranghi) entrambi (parchi × scenari); rango 0 = migliore.
+    In cache sugli hash degli array, cioè per (dati dei parchi, pesi degli scenari).
+    """
+    composites = coverage[:, None] * (1 + values @ weights)
+    order = np.argsort(-composites, axis=0, kind="stable")
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(composites.shape[0])[:, None], axis=0)
+    return composites, ranks
+
+def rank_stability(park_names, ranks: np.ndarray, k: int) -> pd.DataFrame:
+    """Stabilità del ranking: frequenza nei primi k e statistiche del rango sugli scenari."""
+    return pd.DataFrame({
+        "Nome Parco": list(park_names),
+        f"Frequenza Top-{k}": (ranks < k).mean(axis=1),
+        "Rango Medio": ranks.mean(axis=1) + 1,
+        "Rango Min": ranks.min(axis=1) + 1,
+        "Rango Max": ranks.max(axis=1) + 1,
+    }).sort_values([f"Frequenza Top-{k}", "Rango Medio"], ascending=[False, True])
+
 def calculate_parameters(df_parks: pd.DataFrame, L: int) -> tuple:
     V = df_parks.shape[0]
     max_L = int(V * (V - 1) / 2)
@@ -90,16 +174,26 @@ def calculate_parameters(df_parks: pd.DataFrame, L: int) -> tuple:
     return V, max_L, k, rho, epsilon
 
 def prepare_analysis_data(df_parks: pd.DataFrame, assignment_df: pd.DataFrame, inds: list, weights_dict: dict) -> pd.DataFrame:
-    # Unisci i dati originali dei parchi con la tabella di assegnazione
-    merged = pd.merge(df_parks[["Nome Parco", "Copertura Vegetale"]], assignment_df, on="Nome Parco", how="left")
-    # Calcola il breakdown per ciascun parco
-    merged["Breakdown"] = merged.apply(
-        lambda row: ", ".join(f"{ind}: {weights_dict.get(ind,0)*row.get(ind, 0):.2f}" for ind in inds), axis=1
-    )
-    # Unisci con il valore composito già calcolato
-    analysis_df = pd.merge(merged, df_parks[["Nome Parco", "Composite Value"]], on="Nome Parco", how="left")
+    # Contributi numerici per indicatore (una colonna "Contributo <indicatore>" ciascuno)
+    analysis_df = df_parks[["Nome Parco", "Copertura Vegetale", "Composite Value"]].reset_index(drop=True)
+    contributions = contributions_matrix(df_parks, assignment_df, inds, weights_dict)
+    if contributions.shape[0] == len(analysis_df):
+        contrib_df = pd.DataFrame(contributions, columns=[f"Contributo {ind}" for ind in inds])
+        analysis_df = pd.concat([analysis_df, contrib_df], axis=1)
     return analysis_df
 
+def add_breakdown(analysis_df: pd.DataFrame, inds: list) -> pd.DataFrame:
+    """
+    Aggiunge la colonna testuale "Breakdown" solo alle righe passate
+    (quelle effettivamente mostrate), a partire dai contributi numerici.
+    """
+    df = analysis_df.copy()
+    cols = [f"Contributo {ind}" for ind in inds if f"Contributo {ind}" in df.columns]
+    values = df[cols].to_numpy(dtype=float)
+    names = [c[len("Contributo "):] for c in cols]
+    df["Breakdown"] = [", ".join(f"{ind}: {v:.2f}" for ind, v in zip(names, row)) for row in values]
+    return df
+
 def display_maps(df_parks: pd.DataFrame):
     df_map = df_parks.copy().rename(columns={"Coordinata X": "lon", "Coordinata Y": "lat"})
     df_map["radius_composite"] = df_map["Composite Value"] * 10
@@ -160,6 +254,24 @@ def display_maps(df_parks: pd.DataFrame):
     col_right.subheader("Mappa: Copertura Vegetale")
     col_right.pydeck_chart(right_deck)
 
+def park_deck(df_map: pd.DataFrame, radius_col: str, fill_color: str, tooltip_text: str) -> pdk.Deck:
+    layer = pdk.Layer(
+        "ScatterplotLayer",
+        data=df_map,
+        get_position='[lon, lat]',
+        get_fill_color=fill_color,
+        get_radius=radius_col,
+        pickable=True,
+        auto_highlight=True,
+    )
+    view_state = pdk.ViewState(
+        latitude=df_map["lat"].mean(),
+        longitude=df_map["lon"].mean(),
+        zoom=12,
+        pitch=0,
+    )
+    return pdk.Deck(layers=[layer], initial_view_state=view_state, tooltip={"text": tooltip_text})
+
 def display_analysis(analysis_df: pd.DataFrame):
     st.markdown("### Analisi Comparativa per Parco")
     # Prepara i dati per il grafico a barre: per ogni parco, mettiamo due valori (originale e composito)
@@ -196,6 +308,9 @@ with tabs[0]:
     ahp_file = st.file_uploader("File AHP", type=["xlsx"], key="ahp_tab1")
     if ahp_file is not None:
         indicators, weights_dict = load_ahp_data(ahp_file)
+    scenarios_file = st.file_uploader("File degli scenari AHP (opzionale): colonna 'Indicatore' e una colonna di pesi per scenario", type=["xlsx"], key="scenarios_tab1")
+    if scenarios_file is not None:
+        scenarios_df = load_scenarios_data(scenarios_file)
     parks_file = st.file_uploader("File dei Parchi (opzionale)", type=["xlsx"], key="parks_tab1")
     if parks_file is not None:
         df_parks = load_parks_data(parks_file)
@@ -211,7 +326,10 @@ with tabs[1]:
         st.info("Carica il file AHP nella scheda 'Dati' per procedere con l'assegnazione degli indici.")
     else:
         st.write("Modifica la tabella per assegnare un valore (tra 0 e 1) agli indici per ciascun parco.")
-        assignment_df = create_assignment_table(df_parks, indicators)
+        parks_key = data_key(df_parks)
+        ahp_key = data_key(indicators, weights_dict)
+        assignment_df = pipeline_stage("assignment_table", data_key(parks_key, indicators),
+                                       lambda: create_assignment_table(df_parks, indicators))
         if hasattr(st, "experimental_data_editor"):
             edited_assignment_df = st.experimental_data_editor(assignment_df, num_rows="dynamic", use_container_width=True)
         elif hasattr(st, "data_editor"):
@@ -230,10 +348,36 @@ with tabs[1]:
                 edited_assignment_df[ind] = edited_assignment_df[ind].clip(lower=0, upper=1)
         st.subheader("Tabella di Assegnazione (modificata)")
         st.dataframe(edited_assignment_df, use_container_width=True)
-        df_parks = calculate_composite_values(df_parks.copy(), edited_assignment_df, indicators, weights_dict)
+        assignment_key = data_key(edited_assignment_df)
+        composite_key = data_key(parks_key, assignment_key, ahp_key)
+        df_parks = pipeline_stage("composite", composite_key,
+                                  lambda: calculate_composite_values(df_parks.copy(), edited_assignment_df, indicators, weights_dict))
         st.subheader("Dati dei Parchi con Valore Composito")
         st.dataframe(df_parks, use_container_width=True)
-        L_val = st.slider("Seleziona L (numero di coppie di parchi)", min_value=0, max_value=int(df_parks.shape[0]*(df_parks.shape[0]-1)/2), value=0)
+        l_mode = st.radio("Calcolo di L", ("Da coordinate (soglia di distanza)", "Manuale"), horizontal=True)
+        if l_mode == "Manuale":
+            L_val = st.slider("Seleziona L (numero di coppie di parchi)", min_value=0, max_value=int(df_parks.shape[0]*(df_parks.shape[0]-1)/2), value=0)
+        else:
+            # Grafo di prossimità reale: due parchi sono collegati se distano al più la soglia
+            max_threshold = st.slider("Distanza massima per la curva (metri)", min_value=100, max_value=10000, value=3000, step=100)
+            threshold = st.slider("Soglia di distanza per collegare due parchi (metri)", min_value=0, max_value=max_threshold,
+                                  value=min(1000, max_threshold), step=10)
+            coords = coordinate_metriche(df_parks["Coordinata X"], df_parks["Coordinata Y"])
+            thresholds = np.unique(np.append(np.linspace(0, max_threshold, 201), threshold))
+            curve = curva_connettivita(coords, thresholds)
+            pos = int(np.searchsorted(curve["soglia"], threshold))
+            L_val = int(curve["L"][pos])
+            st.write(f"**Componenti connesse:** {int(curve['componenti'][pos])} — "
+                     f"**Alpha:** {curve['alpha'][pos]:.3f} — **Beta:** {curve['beta'][pos]:.3f} — **Gamma:** {curve['gamma'][pos]:.3f}")
+            curve_df = pd.DataFrame({name: curve[name] for name in ("soglia", "L", "componenti", "k", "rho", "epsilon")})
+            curve_chart = alt.Chart(curve_df.melt(id_vars=["soglia"], value_vars=["k", "rho", "epsilon"],
+                                                  var_name="Parametro", value_name="Valore")).mark_line().encode(
+                x=alt.X("soglia:Q", title="Soglia (m)"),
+                y=alt.Y("Valore:Q"),
+                color="Parametro:N",
+                tooltip=["soglia", "Parametro", "Valore"]
+            ).properties(title="Parametri al variare della soglia")
+            st.altair_chart(curve_chart, use_container_width=True)
         V, max_L, k, rho, epsilon = calculate_parameters(df_parks, L_val)
         if k is not None and rho is not None:
             st.markdown("#### Parametri")
@@ -242,9 +386,31 @@ with tabs[1]:
             st.write(f"**Connettività (k):** {k}")
             st.write(f"**Resilienza (ρ):** {rho}")
             st.write(f"**Epsilon (k+ρ):** {epsilon}")
+        # Scenari: valori compositi per tutti gli insiemi di pesi in un'unica moltiplicazione
+        if scenarios_df is not None:
+            st.markdown("#### Scenari AHP e stabilità del ranking")
+            merged = pd.merge(df_parks[["Nome Parco"]], edited_assignment_df, on="Nome Parco", how="left")
+            values = merged.reindex(columns=list(scenarios_df.index), fill_value=0).to_numpy(dtype=float)
+            if values.shape[0] != len(df_parks):
+                st.error("Errore nel calcolo degli scenari: nomi dei parchi duplicati nella tabella di assegnazione.")
+            else:
+                composites, ranks = scenario_composites(
+                    df_parks["Copertura Vegetale"].to_numpy(dtype=float),
+                    values,
+                    scenarios_df.to_numpy(dtype=float)
+                )
+                top_k = st.slider("k (primi k parchi)", min_value=1, max_value=int(len(df_parks)),
+                                  value=min(5, int(len(df_parks))))
+                st.write(f"**Scenari:** {composites.shape[1]}")
+                st.dataframe(rank_stability(df_parks["Nome Parco"], ranks, top_k), use_container_width=True)
+                st.session_state.scenario_results = (list(scenarios_df.columns), composites)
+        else:
+            st.session_state.pop("scenario_results", None)
         # Salva dati in session_state per le altre schede
         st.session_state.df_parks = df_parks
         st.session_state.edited_assignment_df = edited_assignment_df
+        st.session_state.composite_key = composite_key
+        st.session_state.assignment_key = assignment_key
 
 # --- Tab 3: Mappe ---
 with tabs[2]:
@@ -252,21 +418,31 @@ with tabs[2]:
     if "df_parks" not in st.session_state:
         st.error("Prima calcola i valori compositi nella scheda 'Assegnazione e Calcoli'.")
     else:
-        # Copia del dataframe e rinomina per Pydeck
-        df_map = st.session_state.df_parks.copy().rename(columns={"Coordinata X": "lon", "Coordinata Y": "lat"})
+        # Scelta dello scenario: i valori compositi sono già calcolati (e in cache) per tutti gli scenari
+        scenario = "AHP corrente"
+        scenario_values = None
+        if "scenario_results" in st.session_state:
+            scenario_names, composites = st.session_state.scenario_results
+            scenario = st.selectbox("Scenario", ["AHP corrente"] + scenario_names)
+            if scenario != "AHP corrente":
+                scenario_values = composites[:, scenario_names.index(scenario)]
         
         # Slider per regolare il fattore di scala dei marker
         scale_factor = st.slider("Regola il fattore di scala dei marker", min_value=5, max_value=20, value=10)
-        df_map["radius_composite"] = df_map["Composite Value"] * scale_factor
-        df_map["radius_veg"] = df_map["Copertura Vegetale"] * scale_factor
         
-        # Stato iniziale della vista
-        view_state = pdk.ViewState(
-            latitude=df_map["lat"].mean(),
-            longitude=df_map["lon"].mean(),
-            zoom=12,
-            pitch=0,
-        )
+        def build_map_data():
+            # Copia del dataframe e rinomina per Pydeck
+            df_map = st.session_state.df_parks.copy().rename(columns={"Coordinata X": "lon", "Coordinata Y": "lat"})
+            if scenario_values is not None and len(scenario_values) == len(df_map):
+                df_map["Composite Value"] = scenario_values
+            df_map["radius_composite"] = df_map["Composite Value"] * scale_factor
+            df_map["radius_veg"] = df_map["Copertura Vegetale"] * scale_factor
+            return df_map
+        
+        # I valori dello scenario entrano nella chiave: un altro file di scenari con gli
+        # stessi nomi ma pesi diversi non deve riusare mappe già calcolate
+        map_key = data_key(st.session_state.composite_key, scenario, scenario_values, scale_factor)
+        df_map = pipeline_stage("map_data", map_key, build_map_data)
         
         # Possibilità di scegliere quale mappa visualizzare
         map_option = st.radio(
@@ -276,37 +452,17 @@ with tabs[2]:
         
         if map_option in ("Mappa Composite", "Visualizza Entrambe"):
             st.subheader("Mappa: Copertura Vegetale × (1 + AHP)")
-            composite_layer = pdk.Layer(
-                "ScatterplotLayer",
-                data=df_map,
-                get_position='[lon, lat]',
-                get_fill_color='[200,50,80,180]',
-                get_radius="radius_composite",
-                pickable=True,
-                auto_highlight=True,
-            )
-            composite_deck = pdk.Deck(
-                layers=[composite_layer],
-                initial_view_state=view_state,
-                tooltip={"text": "{Nome Parco}\nComposite: {Composite Value}"}
+            composite_deck = pipeline_stage(
+                "composite_deck", map_key,
+                lambda: park_deck(df_map, "radius_composite", '[200,50,80,180]', "{Nome Parco}\nComposite: {Composite Value}")
             )
             st.pydeck_chart(composite_deck)
         
         if map_option in ("Mappa Vegetazione", "Visualizza Entrambe"):
             st.subheader("Mappa: Copertura Vegetale")
-            veg_layer = pdk.Layer(
-                "ScatterplotLayer",
-                data=df_map,
-                get_position='[lon, lat]',
-                get_fill_color='[50,150,200,180]',
-                get_radius="radius_veg",
-                pickable=True,
-                auto_highlight=True,
-            )
-            veg_deck = pdk.Deck(
-                layers=[veg_layer],
-                initial_view_state=view_state,
-                tooltip={"text": "{Nome Parco}\nCopertura: {Copertura Vegetale}"}
+            veg_deck = pipeline_stage(
+                "veg_deck", map_key,
+                lambda: park_deck(df_map, "radius_veg", '[50,150,200,180]', "{Nome Parco}\nCopertura: {Copertura Vegetale}")
             )
             st.pydeck_chart(veg_deck)
 
@@ -317,42 +473,48 @@ with tabs[3]:
         st.error("Prima calcola i valori compositi nella scheda 'Assegnazione e Calcoli'.")
     else:
         # Prepara il dataframe di analisi con un breakdown dei contributi
-        analysis_df = prepare_analysis_data(
+        analysis_key = data_key(st.session_state.composite_key, st.session_state.assignment_key, indicators, weights_dict)
+        analysis_df = pipeline_stage("analysis", analysis_key, lambda: prepare_analysis_data(
             st.session_state.df_parks,
             st.session_state.edited_assignment_df,
             indicators,
             weights_dict
-        )
+        ))
         
         st.markdown("#### Confronto per Parco: Valore Originale vs. Modificato")
-        st.dataframe(
-            analysis_df[["Nome Parco", "Copertura Vegetale", "Composite Value", "Breakdown"]],
-            use_container_width=True
-        )
+        st.dataframe(analysis_df, use_container_width=True)
         
-        # Grafico interattivo con Altair: confronto dei due valori per ciascun parco
-        chart_data = analysis_df.melt(
-            id_vars=["Nome Parco", "Copertura Vegetale", "Composite Value", "Breakdown"],
-            value_vars=["Copertura Vegetale", "Composite Value"],
-            var_name="Tipo Valore",
-            value_name="Valore"
-        )
-        chart = alt.Chart(chart_data).mark_bar().encode(
-            x=alt.X("Nome Parco:N", title="Parco", axis=alt.Axis(labelAngle=-45)),
-            y=alt.Y("Valore:Q", title="Valore"),
-            color=alt.Color(
-                "Tipo Valore:N",
-                scale=alt.Scale(
-                    domain=["Copertura Vegetale", "Composite Value"],
-                    range=["#1f77b4", "#d62728"]
-                )
-            ),
-            tooltip=["Nome Parco", "Copertura Vegetale", "Composite Value", "Breakdown"]
-        ).properties(
-            width=700,
-            height=400,
-            title="Confronto per Parco: Valore Originale vs. Modificato"
-        ).interactive()
+        # Grafico interattivo con Altair: confronto dei due valori per i parchi con valore composito più alto
+        if len(analysis_df) > MAX_CHART_PARKS:
+            st.caption(f"Nel grafico sono mostrati i {MAX_CHART_PARKS} parchi con valore composito più alto.")
+        
+        def build_chart():
+            chart_df = add_breakdown(analysis_df.nlargest(MAX_CHART_PARKS, "Composite Value"), indicators)
+            chart_data = chart_df.melt(
+                id_vars=["Nome Parco", "Copertura Vegetale", "Composite Value", "Breakdown"],
+                value_vars=["Copertura Vegetale", "Composite Value"],
+                var_name="Tipo Valore",
+                value_name="Valore"
+            )
+            chart = alt.Chart(chart_data).mark_bar().encode(
+                x=alt.X("Nome Parco:N", title="Parco", axis=alt.Axis(labelAngle=-45)),
+                y=alt.Y("Valore:Q", title="Valore"),
+                color=alt.Color(
+                    "Tipo Valore:N",
+                    scale=alt.Scale(
+                        domain=["Copertura Vegetale", "Composite Value"],
+                        range=["#1f77b4", "#d62728"]
+                    )
+                ),
+                tooltip=["Nome Parco", "Copertura Vegetale", "Composite Value", "Breakdown"]
+            ).properties(
+                width=700,
+                height=400,
+                title="Confronto per Parco: Valore Originale vs. Modificato"
+            ).interactive()
+            return chart
+        
+        chart = pipeline_stage("chart", analysis_key, build_chart)
         st.altair_chart(chart, use_container_width=True)
         
         # Selezione manuale del parco per vedere il dettaglio del breakdown
@@ -360,14 +522,15 @@ with tabs[3]:
             "Seleziona un parco per visualizzare il dettaglio del breakdown",
             analysis_df["Nome Parco"].unique()
         )
-        breakdown_info = analysis_df.loc[analysis_df["Nome Parco"] == park_selected, "Breakdown"].iloc[0]
+        selected_rows = analysis_df[analysis_df["Nome Parco"] == park_selected].head(1)
+        breakdown_info = add_breakdown(selected_rows, indicators)["Breakdown"].iloc[0]
         st.markdown(f"**Breakdown per {park_selected}:** {breakdown_info}")
         
         # Download della tabella di analisi in Excel
         if st.button("Scarica tabella di analisi in Excel"):
             output = io.BytesIO()
             with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-                analysis_df.to_excel(writer, index=False, sheet_name="Analisi")
+                add_breakdown(analysis_df, indicators).to_excel(writer, index=False, sheet_name="Analisi")
             st.download_button(
                 label="Download Excel",
                 data=output.getvalue(),
@@ -1,27 +1,37 @@
 import streamlit as st
 import geopandas as gpd
 import networkx as nx
+import numpy as np
 import matplotlib.pyplot as plt
-import folium
-from streamlit_folium import folium_static
+from connettivita import archi_prossimita, archi_poligoni
+from mappe import hash_dataset, mappa_poligoni_html, mostra_html
+from centralita import grafo_csr, betweenness_campionata, classifica_colli
 
 # Funzione per calcolare i centroidi delle aree verdi e costruire la rete
 def create_graph(gdf):
     G = nx.Graph()
     
+    # Centroidi e aree calcolati una sola volta, come array
+    centroids = gdf.geometry.centroid
+    coords = np.column_stack([centroids.x.to_numpy(), centroids.y.to_numpy()])
+    areas = gdf.geometry.area.to_numpy()
+    labels = gdf.index.to_list()
+    
     # Aggiungere i nodi con peso basato sull'area
-    for idx, row in gdf.iterrows():
-        centroid = row.geometry.centroid
-        G.add_node(idx, pos=(centroid.x, centroid.y), area=row.geometry.area)
+    G.add_nodes_from((idx, {"pos": (x, y), "area": area})
+                     for idx, (x, y), area in zip(labels, coords.tolist(), areas.tolist()))
 
-    # Creare connessioni basate sulla distanza tra centroidi (puoi personalizzarlo)
+    # Creare connessioni basate sulla distanza tra centroidi o tra i bordi dei poligoni
     threshold = st.slider("Distanza massima tra nodi per connetterli (metri)", 50, 1000, 500)
-    for i, row1 in gdf.iterrows():
-        for j, row2 in gdf.iterrows():
-            if i < j:
-                dist = row1.geometry.centroid.distance(row2.geometry.centroid)
-                if dist < threshold:
-                    G.add_edge(i, j, weight=1/dist)  # Ponderazione con distanza inversa
+    mode = st.radio("Distanza tra aree", ("Centroidi", "Bordi dei poligoni"), horizontal=True,
+                    help="'Bordi dei poligoni' usa la distanza reale tra i margini delle aree (0 se si toccano).")
+    if mode == "Centroidi":
+        # Ricerca per raggio su KD-tree
+        i, j, weights = archi_prossimita(coords, threshold)  # Ponderazione con distanza inversa
+    else:
+        # Candidati da STRtree, distanze esatte solo sulle coppie vicine (minimo 1 m per il peso 1/dist)
+        i, j, weights, _ = archi_poligoni(gdf.geometry.values, threshold)
+    G.add_weighted_edges_from(zip([labels[k] for k in i], [labels[k] for k in j], weights.tolist()))
 
     return G
 
@@ -54,10 +64,10 @@ def plot_graph(G):
 
 # Funzione per visualizzare le aree verdi su una mappa interattiva
 def plot_map(gdf):
-    m = folium.Map(location=[gdf.geometry.centroid.y.mean(), gdf.geometry.centroid.x.mean()], zoom_start=13)
-    for _, row in gdf.iterrows():
-        folium.GeoJson(row.geometry, style_function=lambda x: {"fillColor": "green", "color": "black", "weight": 1}).add_to(m)
-    folium_static(m)
+    # Un unico layer GeoJSON, geometrie semplificate allo zoom iniziale, HTML in cache per dataset
+    simplify = st.checkbox("Semplifica le geometrie per la mappa", value=True)
+    html = mappa_poligoni_html(hash_dataset(gdf), gdf, zoom_start=13, semplifica=simplify)
+    mostra_html(html)
 
 # Streamlit UI
 st.title("🌿 Analisi della Connettività delle Aree Verdi")
@@ -85,4 +95,19 @@ if uploaded_file:
     st.subheader("📊 Indicatori di Connettività")
     st.write(f"**Alpha (Circuitazione)**: {alpha:.3f}")
     st.write(f"**Beta (Densità di Connessioni)**: {beta:.3f}")
-    st.write(f"**Gamma (Connettività Relativa)**: {gamma:.3f}")
\ No newline at end of file
+    st.write(f"**Gamma (Connettività Relativa)**: {gamma:.3f}")
+
+    # Aree critiche: betweenness stimata su un campione di sorgenti (lunghezza dell'arco = distanza)
+    st.subheader("🚧 Aree critiche per la connettività")
+    if st.checkbox("Calcola la betweenness campionata delle aree"):
+        k_campioni = st.number_input("Aree campionate come sorgenti", min_value=2,
+                                     value=min(100, max(2, G.number_of_nodes())), step=10)
+        budget = st.number_input("Budget di tempo (s)", min_value=1.0, value=30.0, step=5.0)
+        nodi, indptr, indici, pesi = grafo_csr(G, inverso=True)
+        risultato = betweenness_campionata(indptr, indici, pesi, k=int(k_campioni), budget=float(budget),
+                                           non_orientato=not G.is_directed())
+        st.write(f"Sorgenti elaborate: {risultato['campioni']} su {risultato['sorgenti']} "
+                 f"in {risultato['tempo']:.1f} s")
+        if not risultato["completa"]:
+            st.warning("Budget di tempo esaurito prima di tutte le sorgenti campionate: stima parziale, non salvata in cache.")
+        st.dataframe(classifica_colli(nodi, risultato))
\ No newline at end of file
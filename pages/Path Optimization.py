@@ -5,66 +5,10 @@ import math
 import itertools
 import matplotlib.pyplot as plt
 import io
+from percorsi import prepara_rete, grafi_da_rete
 
-def is_valid_direction(current_pos, candidate_pos, direction):
-    """
-    Verifica se il candidato (x2, y2) rispetta la condizione direzionale
-    rispetto al punto corrente (x1, y1) in base alla direzione fornita.
-    """
-    x1, y1 = current_pos
-    x2, y2 = candidate_pos
-    dist_x = abs(x1 - x2)
-    dist_y = abs(y1 - y2)
-    x = False
-    
-    if not isinstance(direction, str):
-        direction = str(direction)
-    if direction == "verticale":      
-        if dist_y>dist_x: 
-            x=True 
-        else: 
-            x=False 
-    elif direction == "orizzontale":
-        if dist_y<dist_x:   x=True  
-        else: x=False
-    else: x=True
-    return x
-
-def is_valid_direction_filter(entity_i,entity_j,current_pos, candidate_pos, direction,stream,stream_j):
-    x1, y1 = current_pos
-    x2, y2 = candidate_pos
-    dist_x = abs(x1 - x2)
-    dist_y = abs(y1 - y2)
-    x = False
-    
-    if not isinstance(direction, str):
-        direction = str(direction)    
-    if not isinstance(stream, str):
-        stream = str(stream)
-
-    if stream_j is not None and not isinstance(stream_j, str):  # Se il nodo di destinazione ha un vincolo
-        stream_j = str(stream_j)
-
-    # Le condizioni sono le seguenti:
-    
-
-    # Applicare la direzione del flusso (stream) come vincolo
-    if stream == "destro":   # Muoversi solo verso destra →
-        x = x2 > x1
-    elif stream == "sinistro":  # Muoversi solo verso sinistra ←
-        x = x2 < x1
-    elif stream == "alto":  # Muoversi solo verso l'alto ↑
-        x = y2 > y1
-    elif stream == "basso":  # Muoversi solo verso il basso ↓
-        x = y2 < y1
-    elif stream == "orizzontale":  # Preferire spostamenti orizzontali
-        x = dist_y < dist_x
-    elif direction == "verticale":  # Preferire spostamenti verticali
-        x = dist_y > dist_x
-    else:
-        x = True  # Se nessuna regola specifica, consentire tutte le connessioni
-    
-    return x
+# Valore massimo dello slider "Distanza massima per collegare i nodi"
+MAX_DISTANZA = 1.0
 
 def breakdown_path(path, pos):
     """
@@ -95,49 +39,11 @@ def display_graph(G, pos, corridors, machines):
     ax.axis("off")
     st.pyplot(fig)
 
-def Creazione_G(tipologia_grafo,df_all,max_distance):
-        G = nx.DiGraph()
-        for idx, row in df_all.iterrows():
-            G.add_node(idx, 
-                       x=row["X"], 
-                       y=row["Y"], 
-                       tag=row["Tag"], 
-                       entity_name=row["Entity Name"], 
-                       size=row["Size"],
-                       stream=row["URL"])
-        # 1. Connessione fra Corridoi:
-        corridor_nodes = [n for n, d in G.nodes(data=True) if d["tag"] == "Corridoio"] 
-        for i, j in itertools.permutations(corridor_nodes, 2):
-        #for i, j in itertools.combinations(corridor_nodes, 2):
-            entity_i=G.nodes[i]["entity_name"]
-            entity_j=G.nodes[j]["entity_name"]
-            pos_i = (G.nodes[i]["x"], G.nodes[i]["y"])
-            pos_j = (G.nodes[j]["x"], G.nodes[j]["y"])
-            stream_j=(G.nodes[j]["stream"])
-            dist = abs(pos_j[0] - pos_i[0]) + abs(pos_j[1] - pos_i[1])
-            if dist <= max_distance:
-                if tipologia_grafo=="STD":
-                    if is_valid_direction(pos_i, pos_j, G.nodes[i]["size"]):
-                        G.add_edge(i, j, weight=dist)
-                else:
-                    if is_valid_direction_filter(entity_i, entity_j,pos_i, pos_j, G.nodes[i]["size"], G.nodes[i]["stream"],stream_j):
-                        G.add_edge(i, j, weight=dist)
-        # 2. Connessione Macchina -> Corridoio:
-        machine_nodes = [n for n, d in G.nodes(data=True) if d["tag"] == "Macchina"]
-        for machine in machine_nodes:
-            machine_pos = (G.nodes[machine]["x"], G.nodes[machine]["y"])
-            best_corridor = None
-            best_dist = float('inf')
-            for corridor in corridor_nodes:
-                corridor_pos = (G.nodes[corridor]["x"], G.nodes[corridor]["y"])
-                dist = math.dist(machine_pos, corridor_pos)
-                if dist < best_dist:
-                    best_dist = dist
-                    best_corridor = corridor
-            if best_corridor is not None and best_dist <= max_distance:
-                G.add_edge(machine, best_corridor, weight=best_dist)
-                G.add_edge(best_corridor,machine, weight=best_dist)
-        return G
+def Creazione_G(df_all,max_distance):
+        # Distanza di Manhattan fra corridoi; grafo ottimale ("STD") e vincolato ("filter")
+        # in una sola passata sulle coppie candidate, in cache fino al massimo dello slider
+        rete = prepara_rete(df_all, metrica="manhattan", raggio_max=MAX_DISTANZA)
+        return grafi_da_rete(rete, max_distance)
 
 def main():
     st.title("Collegamento Macchine Tramite Corridoi – Calcolo di tutte le coppie")
@@ -189,12 +95,11 @@ def main():
     # 3. Costruzione del grafo
     st.subheader("Costruzione del grafo")
     max_distance = st.slider("Distanza massima per collegare i nodi", 
-                               min_value=0.0, max_value=1.0, value=0.5,
+                               min_value=0.0, max_value=MAX_DISTANZA, value=0.5,
                                help="Due nodi vengono collegati se la distanza euclidea è ≤ a questo valore.")
     
     # Crea un radio button per scegliere fra due valori
-    G=Creazione_G('STD',df_all,max_distance) 
-    G_filter=Creazione_G('filter',df_all,max_distance)
+    G, G_filter = Creazione_G(df_all,max_distance)
     
     st.subheader("Scegli la visualizzazione")
     scelta = st.radio("Scegli il valore:", ("Ottimale", "Corridoi vincolati"),index=0)
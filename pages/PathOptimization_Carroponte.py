@@ -1,55 +1,30 @@
 import streamlit as st
 import pandas as pd
-import networkx as nx
 import math
 import itertools
+import time
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
 import io
 import PIL.Image
 import numpy as np
+from disegno import (arrays_grafo, limiti_disegno, rasterizza_base, mostra_base,
+                     disegna_archi, disegna_nodi, disegna_etichette,
+                     layer_archi, layer_nodi, layer_percorsi, vista_webgl,
+                     disegna_carichi, layer_carichi, disegna_campo)
+from percorsi import (prepara_rete, grafi_da_rete, coppie_da_flussi, raggruppa_per_sorgente,
+                       alberi_per_sorgente, percorsi_da_alberi, matrice_flussi, distanze_sui_flussi,
+                       kpi_percorrenza, raggruppa_volumi, indice_archi, carichi_archi,
+                       nodi_sui_percorsi, ripara_alberi, accorpa_duplicati, contrai_catene,
+                       espandi_percorsi, espandi_carichi, archi_contratti_bloccati)
+from centralita import grafo_csr, betweenness_campionata, classifica_colli
+from griglia import (rettangoli, griglia_occupazione, celle_accesso, centri, estensione,
+                     a_stella, campo_distanze, campi_distanze, distanze_fra_accessi, mappa_campo, discesa)
 
-# --- FUNZIONI DI SUPPORTO ---
+# Valore massimo dello slider "Distanza massima per collegare i nodi"
+MAX_DISTANZA = 20.0
 
-def is_valid_direction(current_pos, candidate_pos, direction):
-    x1, y1 = current_pos
-    x2, y2 = candidate_pos
-    dist_x = abs(x1 - x2)
-    dist_y = abs(y1 - y2)
-    if not isinstance(direction, str):
-        direction = str(direction)
-    if direction == "verticale":
-        return dist_y > dist_x
-    elif direction == "orizzontale":
-        return dist_y < dist_x
-    else:
-        return True
-
-def is_valid_direction_filter(entity_i, entity_j, current_pos, candidate_pos, direction, stream, stream_j):
-    x1, y1 = current_pos
-    x2, y2 = candidate_pos
-    dist_x = abs(x1 - x2)
-    dist_y = abs(y1 - y2)
-    if not isinstance(direction, str):
-        direction = str(direction)
-    if not isinstance(stream, str):
-        stream = str(stream)
-    if stream_j is not None and not isinstance(stream_j, str):
-        stream_j = str(stream_j)
-    if stream == "destro":
-        return x2 > x1
-    elif stream == "sinistro":
-        return x2 < x1
-    elif stream == "alto":
-        return y2 > y1
-    elif stream == "basso":
-        return y2 < y1
-    elif stream == "orizzontale":
-        return dist_y < dist_x
-    elif direction == "verticale":
-        return dist_y > dist_x
-    else:
-        return True
+# --- FUNZIONI DI SUPPORTO ---
 
 def breakdown_path(path, pos):
     segments = []
@@ -61,60 +36,290 @@ def breakdown_path(path, pos):
     detail_str = " + ".join(f"{seg:.5f}" for seg in segments)
     return detail_str, total
 
-def display_graph(G, pos, corridors, machines):
+def display_graph(G, pos, corridors, machines, interattiva=False, carichi=None):
+    """
+    Grafo dei nodi; con `carichi` (un valore per arco, nell'ordine di G.edges())
+    gli archi attraversati dai flussi sono sovrapposti come mappa di calore.
+    """
+    nodi, _, coords, archi = arrays_grafo(G, pos)
+    corridor_set = set(corridors)
+    machine_set = set(machines)
+    colori = tuple("skyblue" if n in corridor_set else "lightgreen" if n in machine_set else "lightgray"
+                   for n in nodi)
+    if interattiva:
+        # Vista WebGL: il browser riceve solo le coordinate e gestisce pan/zoom
+        nomi = [f"{G.nodes[n]['entity_name']} (ID: {n})" for n in nodi]
+        layers = [layer_archi(coords, archi, "black", alpha=128)]
+        if carichi is not None:
+            layers.append(layer_carichi(coords, archi, carichi))
+        deck = vista_webgl(layers + [layer_nodi(coords, colori, nomi)], coords)
+        st.pydeck_chart(deck)
+        return
+    # Lo strato di base è rasterizzato una sola volta per grafo e riusato ai rerun
+    labels = tuple(f"{G.nodes[n]['entity_name']}\n(ID: {n})" for n in nodi)
+    limiti = limiti_disegno(coords)
+    raster = rasterizza_base(coords, archi, colori, limiti,
+                             etichette=labels,
+                             legenda=(("Corridoio", "skyblue"), ("Macchina", "lightgreen")),
+                             edge_color="black", edge_alpha=0.5, node_size=100)
+    if carichi is None:
+        st.image(raster, caption="Grafico dei Nodi", use_container_width=True)
+        return
     fig, ax = plt.subplots(figsize=(8, 6))
-    nx.draw_networkx_edges(G, pos, ax=ax, alpha=0.5)
-    nx.draw_networkx_nodes(G, pos, nodelist=corridors, node_color="skyblue", label="Corridoio", node_size=100, ax=ax)
-    nx.draw_networkx_nodes(G, pos, nodelist=machines, node_color="lightgreen", label="Macchina", node_size=100, ax=ax)
-    labels = {node: f"{G.nodes[node]['entity_name']}\n(ID: {node})" for node in G.nodes()}
-    nx.draw_networkx_labels(G, pos, labels, font_size=8, ax=ax)
-    ax.set_title("Grafico dei Nodi")
-    ax.legend()
+    mostra_base(ax, raster, limiti)
+    mappabile = disegna_carichi(ax, coords, archi, carichi)
+    fig.colorbar(mappabile, ax=ax, label="Carico")
+    ax.set_title("Carico sui corridoi")
+    ax.axis("off")
+    st.pyplot(fig)
+    plt.close(fig)
+
+def plot_routes(G_graph, pos, df_results, selected_collegamenti, percorso_type, bg_image_file, legend_kwargs,
+                interattiva=False, campo=None):
+    """
+    Disegna i percorsi selezionati sopra lo strato di base in cache
+    (grafo in grigio più l'eventuale immagine di sfondo), oppure nella vista WebGL.
+    `campo` = (valori, estensione, titolo) è una mappa di calore sovrapposta allo sfondo.
+    """
+    available_colors = ["red", "blue", "green", "orange", "purple", "brown", "pink", "gray", "cyan", "magenta"]
+    mapping = { data.get("entity_name", f"node_{node}"): node 
+                for node, data in G_graph.nodes(data=True) }
+    nodi, _, coords, archi = arrays_grafo(G_graph, pos)
+    
+    routes = []
+    for idx, coll in enumerate(selected_collegamenti):
+        filtered_rows = df_results[df_results["Collegamento Macchina"] == coll]
+        if filtered_rows.empty:
+            st.warning(f"Nessun record trovato per il collegamento {coll}.")
+            continue
+        row = filtered_rows.iloc[0]
+        if percorso_type == "Ottimale":
+            path_str = row["Percorso Ottimale Seguito"]
+        else:
+            path_str = row["Percorso Vincolato Seguito"]
+        if path_str == "Nessun percorso":
+            st.warning(f"Il collegamento {coll} non ha un percorso {percorso_type.lower()} disponibile.")
+            continue
+        route_names = [p.strip() for p in path_str.split("-->")]
+        route_node_ids = [mapping[n] for n in route_names if n in mapping]
+        color = available_colors[idx % len(available_colors)]
+        routes.append((coll, color, route_node_ids))
+    
+    if interattiva:
+        route_layer = layer_percorsi([[pos[nid] for nid in ids] for _, _, ids in routes],
+                                     [color for _, color, _ in routes],
+                                     [f"{coll} ({percorso_type})" for coll, _, _ in routes])
+        deck = vista_webgl([layer_archi(coords, archi), route_layer,
+                            layer_nodi(coords, ("lightgray",) * len(nodi),
+                                       [G_graph.nodes[n].get("entity_name", f"node_{n}") for n in nodi], raggio=3)],
+                           coords)
+        st.pydeck_chart(deck)
+        return
+    
+    sfondo_bytes = None
+    sfondo_extent = None
+    if bg_image_file:
+        sfondo_bytes = bg_image_file.getvalue()
+        # Estensione basata sulle coordinate dei nodi
+        x_min, y_min = coords.min(axis=0)
+        x_max, y_max = coords.max(axis=0)
+        sfondo_extent = (float(x_min), float(x_max), float(y_min), float(y_max))
+    limiti = limiti_disegno(coords, sfondo_extent)
+    raster = rasterizza_base(coords, archi, ("lightgray",) * len(nodi), limiti,
+                             sfondo_bytes=sfondo_bytes, sfondo_extent=sfondo_extent)
+    fig, ax = plt.subplots(figsize=(8,6))
+    mostra_base(ax, raster, limiti)
+    if campo is not None:
+        valori, estensione_campo, titolo_campo = campo
+        fig.colorbar(disegna_campo(ax, valori, estensione_campo), ax=ax, label=titolo_campo)
+    
+    legend_patches = []
+    for coll, color, route_node_ids in routes:
+        route_coords = np.array([pos[nid] for nid in route_node_ids], dtype=float).reshape(-1, 2)
+        route_edges = np.column_stack([np.arange(len(route_node_ids) - 1), np.arange(1, len(route_node_ids))])
+        disegna_archi(ax, route_coords, route_edges, colors=color, linewidths=2, zorder=2)
+        disegna_nodi(ax, route_coords, color, sizes=150, zorder=3)
+        labels = [G_graph.nodes[nid].get("entity_name", f"node_{nid}") for nid in route_node_ids]
+        disegna_etichette(ax, route_coords, labels, limiti, fontsize=9, zorder=4)
+        legend_patches.append(mpatches.Patch(color=color, label=f"{coll} ({percorso_type})"))
+    ax.set_title(f"Percorsi {percorso_type} Selezionati (inclusi i corridoi)")
     ax.axis("off")
+    if legend_patches:
+        unique_patches = {p.get_label(): p for p in legend_patches}
+        ax.legend(handles=list(unique_patches.values()), title="Legenda Percorsi", **legend_kwargs)
     st.pyplot(fig)
+    plt.close(fig)
+
+def carica_flussi():
+    """Uploader del file Flussi/Path/Sequenza; restituisce il DataFrame o None."""
+    flussi_file = st.file_uploader(
+        "Carica un file Excel o CSV con le colonne: Flussi, Path, Sequenza",
+        type=["xls", "xlsx", "csv"],
+        key="excel_flussi"
+    )
+    if flussi_file is None:
+        return None
+    if flussi_file.name.lower().endswith("csv"):
+        return pd.read_csv(flussi_file)
+    return pd.read_excel(flussi_file)
 
-def Creazione_G(tipologia_grafo, df_all, max_distance):
-    G = nx.DiGraph()
-    for idx, row in df_all.iterrows():
-        G.add_node(idx, 
-                   x=row["X"], 
-                   y=row["Y"], 
-                   tag=row["Tag"], 
-                   entity_name=row["Entity Name"], 
-                   size=row["Size"],
-                   stream=row["URL"])
-    # Connessione fra Corridoi
-    corridor_nodes = [n for n, d in G.nodes(data=True) if d["tag"] == "Corridoio"] 
-    for i, j in itertools.permutations(corridor_nodes, 2):
-        entity_i = G.nodes[i]["entity_name"]
-        entity_j = G.nodes[j]["entity_name"]
-        pos_i = (G.nodes[i]["x"], G.nodes[i]["y"])
-        pos_j = (G.nodes[j]["x"], G.nodes[j]["y"])
-        stream_j = G.nodes[j]["stream"]
-        dist = math.dist(pos_i, pos_j)
-        if dist <= max_distance:
-            if tipologia_grafo == "STD":
-                if is_valid_direction(pos_i, pos_j, G.nodes[i]["size"]):
-                    G.add_edge(i, j, weight=dist)
+def coppie_macchine_da_flussi(G, df_flussi, machine_nodes_sorted):
+    """
+    Coppie (sorgente, destinazione) di nodi macchina distinte presenti nella colonna
+    "Path" dei flussi, nell'ordine per nome usato per tutte le coppie.
+    """
+    nodo_macchina = {G.nodes[n]["entity_name"]: n for n in machine_nodes_sorted}
+    coppie_nomi = coppie_da_flussi(df_flussi)
+    coppie = [(nodo_macchina[a], nodo_macchina[b]) for a, b in coppie_nomi
+              if a in nodo_macchina and b in nodo_macchina and a != b]
+    ignorate = len(coppie_nomi) - len(coppie)
+    if ignorate:
+        st.warning(f"{ignorate} coppie dei flussi non corrispondono a due macchine distinte del grafo e sono state ignorate.")
+    return sorted(coppie, key=lambda c: (G.nodes[c[0]]["entity_name"], G.nodes[c[1]]["entity_name"]))
+
+def calcola_df_results(G, grafi_ricerca, pos, coppie, interni=({}, {})):
+    """
+    Percorso ottimale e vincolato per le coppie di macchine sui grafi di ricerca
+    (eventualmente semplificati, riespansi con `interni`): una sola ricerca per
+    macchina di partenza e per grafo. Restituisce anche gli alberi dei
+    predecessori delle ricerche, riusati per i carichi sugli archi.
+    """
+    gruppi = raggruppa_per_sorgente(coppie)
+    alberi = alberi_per_sorgente(grafi_ricerca, pos, gruppi)
+    percorsi = espandi_percorsi(percorsi_da_alberi(alberi, gruppi), interni)
+    return df_da_percorsi(G, pos, coppie, percorsi), alberi
+
+def df_da_percorsi(G, pos, coppie, percorsi):
+    """Tabella dei risultati (una riga per coppia) dai percorsi ottimale e vincolato."""
+    colonne = (("Percorso Ottimale Seguito", "Dettaglio Distanze Ottimale", "Lunghezza Totale Ottimale"),
+               ("Percorso Vincolato Seguito", "Dettaglio Distanze Vincolato", "Lunghezza Totale Vincolato"))
+    results = []
+    for source, target in coppie:
+        riga = {"Collegamento Macchina": f"{G.nodes[source]['entity_name']} --> {G.nodes[target]['entity_name']}"}
+        for (col_percorso, col_dettaglio, col_lunghezza), full_path in zip(colonne, percorsi[(source, target)]):
+            if full_path is None:
+                riga[col_percorso] = "Nessun percorso"
+                riga[col_dettaglio] = ""
+                riga[col_lunghezza] = None
             else:
-                if is_valid_direction_filter(entity_i, entity_j, pos_i, pos_j, G.nodes[i]["size"], G.nodes[i]["stream"], stream_j):
-                    G.add_edge(i, j, weight=dist)
-    # Connessione Macchina -> Corridoio
-    machine_nodes = [n for n, d in G.nodes(data=True) if d["tag"] == "Macchina"]
-    for machine in machine_nodes:
-        machine_pos = (G.nodes[machine]["x"], G.nodes[machine]["y"])
-        best_corridor = None
-        best_dist = float('inf')
-        for corridor in corridor_nodes:
-            corridor_pos = (G.nodes[corridor]["x"], G.nodes[corridor]["y"])
-            dist = math.dist(machine_pos, corridor_pos)
-            if dist < best_dist:
-                best_dist = dist
-                best_corridor = corridor
-        if best_corridor is not None and best_dist <= max_distance:
-            G.add_edge(machine, best_corridor, weight=best_dist)
-            G.add_edge(best_corridor, machine, weight=best_dist)
-    return G
+                riga[col_dettaglio], riga[col_lunghezza] = breakdown_path(full_path, pos)
+                riga[col_percorso] = " --> ".join(G.nodes[n]["entity_name"] for n in full_path)
+        results.append(riga)
+    return pd.DataFrame(results, columns=["Collegamento Macchina"] + [c for gruppo in colonne for c in gruppo])
+
+def calcola_what_if(G, grafi_ricerca, pos, coppie, alberi, df_results, nodi_bloccati, archi_bloccati,
+                    interni=({}, {})):
+    """
+    Percorsi con corridoi o tratti chiusi: si ricalcolano solo le sorgenti i cui
+    alberi attraversano gli elementi bloccati. Restituisce la tabella delle
+    differenze rispetto a df_results (solo le coppie che cambiano) e il numero
+    di sorgenti ricalcolate.
+    """
+    gruppi = raggruppa_per_sorgente(coppie)
+    nuovi, colpite = ripara_alberi(grafi_ricerca, pos, gruppi, alberi, nodi_bloccati, archi_bloccati,
+                                   [archi_contratti_bloccati(i, nodi_bloccati, archi_bloccati) for i in interni])
+    # Le righe di df_results sono nell'ordine delle coppie
+    posizioni = [p for p, (s, _) in enumerate(coppie) if s in colpite]
+    gruppi_colpiti = {s: gruppi[s] for s in colpite}
+    percorsi = espandi_percorsi(percorsi_da_alberi(nuovi, gruppi_colpiti), interni)
+    df_nuovo = df_da_percorsi(G, pos, [coppie[p] for p in posizioni], percorsi)
+    df_base = df_results.iloc[posizioni].reset_index(drop=True)
+    delta = pd.DataFrame({"Collegamento Macchina": df_nuovo["Collegamento Macchina"]})
+    cambiate = np.zeros(len(df_nuovo), dtype=bool)
+    for tipo in ("Ottimale", "Vincolato"):
+        base = pd.to_numeric(df_base[f"Lunghezza Totale {tipo}"], errors="coerce")
+        nuova = pd.to_numeric(df_nuovo[f"Lunghezza Totale {tipo}"], errors="coerce")
+        delta[f"Lunghezza {tipo} (base)"] = base
+        delta[f"Lunghezza {tipo} (what-if)"] = nuova
+        delta[f"Δ {tipo}"] = nuova - base
+        delta[f"Percorso {tipo} (what-if)"] = df_nuovo[f"Percorso {tipo} Seguito"]
+        cambiate |= (df_nuovo[f"Percorso {tipo} Seguito"] != df_base[f"Percorso {tipo} Seguito"]).to_numpy()
+    return delta[cambiate].reset_index(drop=True), len(colpite)
+
+def calcola_percorsi_griglia(G, griglia, coppie):
+    """
+    Lunghezze sulla griglia di occupazione fra le celle di accesso delle macchine.
+    Per una sola coppia basta A*. Altrimenti i campi delle distanze di tutte le
+    macchine coinvolte si calcolano una volta (a blocchi, in memmap) e ogni
+    lunghezza è una lettura dalla matrice fra gli accessi, senza ricostruire i
+    percorsi: le celle si ricavano con percorso_griglia solo per i collegamenti
+    da visualizzare. La lunghezza include i tratti macchina -> cella.
+    Restituisce (tabella, accessi): macchine, celle di accesso, campi (None con
+    A*) e percorsi già noti da A*.
+    """
+    macchine = list(dict.fromkeys(n for coppia in coppie for n in coppia))
+    celle, scarti = celle_accesso(griglia, [(G.nodes[n]["x"], G.nodes[n]["y"]) for n in macchine])
+    riga = {n: k for k, n in enumerate(macchine)}
+    accessi = {"macchine": macchine, "riga": riga, "celle": celle, "campi": None, "a_stella": {}}
+    if len(coppie) == 1:
+        s, d = coppie[0]
+        lunghezza, celle_percorso = a_stella(griglia, celle[riga[s]], celle[riga[d]])
+        if lunghezza is None:
+            lunghezze = np.array([np.nan])
+        else:
+            lunghezze = np.array([lunghezza * griglia["passo"] + scarti[riga[s]] + scarti[riga[d]]])
+            accessi["a_stella"][(s, d)] = celle_percorso
+    else:
+        accessi["campi"] = campi_distanze(griglia["chiave"], griglia, tuple(celle.tolist()))
+        distanze = distanze_fra_accessi(griglia, accessi["campi"], celle, scarti)
+        lunghezze = distanze[[riga[s] for s, _ in coppie], [riga[d] for _, d in coppie]]
+    df_griglia = pd.DataFrame({
+        "Collegamento Macchina": [f"{G.nodes[s]['entity_name']} --> {G.nodes[d]['entity_name']}" for s, d in coppie],
+        "Lunghezza su griglia": np.where(np.isfinite(lunghezze), lunghezze, np.nan),
+    })
+    return df_griglia, accessi
+
+def percorso_griglia(G, griglia, accessi, s, d):
+    """Coordinate del percorso su griglia da s a d (macchina, centri delle celle, macchina); None se irraggiungibile."""
+    celle_percorso = accessi["a_stella"].get((s, d))
+    if celle_percorso is None and accessi["campi"] is not None:
+        riga = accessi["riga"]
+        celle_percorso = discesa(griglia, accessi["campi"][riga[d]], accessi["celle"][riga[s]])
+    if celle_percorso is None:
+        return None
+    return np.vstack([[G.nodes[s]["x"], G.nodes[s]["y"]], centri(griglia, celle_percorso),
+                      [G.nodes[d]["x"], G.nodes[d]["y"]]])
+
+def mostra_kpi_flussi(df_flussi, df_results, coppie, machine_nodes_sorted, nomi_macchine):
+    """
+    Percorrenza pesata (volume x lunghezza del percorso) totale e per macchina,
+    per il grafo ottimale e per quello vincolato; `coppie` sono le coppie di nodi
+    macchina delle righe di df_results. Restituisce la matrice dei flussi.
+    """
+    if df_results.empty:
+        st.info("Nessun percorso calcolato: KPI di movimentazione non disponibili.")
+        return None
+    colonne_volume = [c for c in df_flussi.columns
+                      if c not in ("Flussi", "Path", "Sequenza") and pd.api.types.is_numeric_dtype(df_flussi[c])]
+    scelta = st.selectbox("Colonna dei volumi:", ["(una unità per riga)"] + colonne_volume, key="colonna_volume")
+    F, ignorato = matrice_flussi(df_flussi, nomi_macchine, None if scelta == "(una unità per riga)" else scelta)
+    if ignorato:
+        st.warning(f"Volume {ignorato:g} su coppie che non corrispondono a due macchine distinte del grafo: escluso.")
+
+    indice = {n: k for k, n in enumerate(machine_nodes_sorted)}
+    coppie = [(indice[s], indice[t]) for s, t in coppie]
+    riepiloghi = {}
+    df_macchine = pd.DataFrame({
+        "Macchina": nomi_macchine,
+        "Volume in uscita": np.asarray(F.sum(axis=1)).ravel(),
+        "Volume in ingresso": np.asarray(F.sum(axis=0)).ravel(),
+    })
+    for tipo in ("Ottimale", "Vincolato"):
+        distanza = dict(zip(coppie, df_results[f"Lunghezza Totale {tipo}"]))
+        riepilogo, uscita, ingresso = kpi_percorrenza(F, distanze_sui_flussi(F, distanza))
+        riepiloghi[tipo] = riepilogo
+        df_macchine[f"Percorrenza in uscita ({tipo})"] = uscita
+        df_macchine[f"Percorrenza in ingresso ({tipo})"] = ingresso
+    st.dataframe(pd.DataFrame(riepiloghi))
+    st.write("Percorrenza pesata per macchina:")
+    st.dataframe(df_macchine[(df_macchine["Volume in uscita"] > 0) | (df_macchine["Volume in ingresso"] > 0)])
+    return F
+
+def Creazione_G(df_all, max_distance):
+    # Grafo ottimale ("STD") e vincolato ("filter") in una sola passata sulle coppie
+    # candidate, che sono in cache fino al massimo dello slider: la soglia è uno slice
+    rete = prepara_rete(df_all, metrica="euclidea", raggio_max=MAX_DISTANZA)
+    return grafi_da_rete(rete, max_distance)
 
 # --- PARTE PRINCIPALE ---
 
@@ -187,12 +392,33 @@ def main():
 
     st.subheader("Costruzione del grafo")
     max_distance = st.slider("Distanza massima per collegare i nodi", 
-                             min_value=0.0, max_value=20.0, value=5.0,
+                             min_value=0.0, max_value=MAX_DISTANZA, value=5.0,
                              help="Due nodi vengono collegati se la distanza euclidea è ≤ a questo valore.")
     
+    # Semplificazione opzionale per i layout da CAD con punti molto fitti
+    semplifica = st.checkbox("Semplifica la rete dei corridoi", key="semplifica_rete",
+                             help="Accorpa i corridoi quasi coincidenti e contrae le catene di corridoi "
+                                  "allineati con gli stessi Size/URL: le distanze non cambiano e i percorsi "
+                                  "vengono riespansi su tutti i punti.")
+    if semplifica:
+        tolleranza = st.number_input("Tolleranza di accorpamento e allineamento", min_value=0.0, value=0.01,
+                                     format="%.4f", key="tolleranza_semplifica")
+        df_all, rimossi = accorpa_duplicati(df_all, tolleranza)
+        if rimossi:
+            st.write(f"Corridoi quasi coincidenti accorpati: {rimossi}")
+
     # Costruzione di entrambi i grafi: "ottimale" e "vincolato"
-    G = Creazione_G('STD', df_all, max_distance) 
-    G_filter = Creazione_G('filter', df_all, max_distance)
+    G, G_filter = Creazione_G(df_all, max_distance)
+    # Grafi su cui si eseguono le ricerche: con la semplificazione, le catene sono archi contratti
+    grafi_ricerca = (G, G_filter)
+    interni = ({}, {})
+    if semplifica:
+        (G_s, interni_G), (G_filter_s, interni_filter) = (contrai_catene(G, tolleranza),
+                                                          contrai_catene(G_filter, tolleranza))
+        grafi_ricerca = (G_s, G_filter_s)
+        interni = (interni_G, interni_filter)
+        st.write(f"Nodi nei grafi di ricerca: {G_s.number_of_nodes()} (ottimale), "
+                 f"{G_filter_s.number_of_nodes()} (vincolato), su {G.number_of_nodes()}")
     
     st.subheader("Scegli la visualizzazione")
     scelta = st.radio("Scegli il valore:", ("Ottimale", "Corridoi vincolati"), index=0)
@@ -212,68 +438,39 @@ def main():
     machines = [n for n, d in G_graph.nodes(data=True) if d["tag"] == "Macchina"]
     
     st.subheader("Grafico dei Nodi")
-    display_graph(G_graph, pos, corridors, machines)
+    modalita_grafico = st.radio("Tipo di grafico:", ("Immagine statica", "Interattivo (WebGL)"), index=0,
+                                horizontal=True, key="modalita_grafico",
+                                help="La vista WebGL invia al browser solo le coordinate: adatta a grafi molto grandi.")
+    interattiva = modalita_grafico == "Interattivo (WebGL)"
+    display_graph(G_graph, pos, corridors, machines, interattiva)
     
     # Calcolo percorsi per coppie di macchine (df_results)
-    st.subheader("Calcolo dei percorsi per tutte le coppie di macchine")
-    results = []
+    st.subheader("Calcolo dei percorsi per le coppie di macchine")
+    modalita_calcolo = st.radio(
+        "Coppie da calcolare:",
+        ("Tutte le coppie di macchine", "Solo le coppie presenti nei flussi (Excel)"),
+        index=0, key="modalita_calcolo",
+        help="Con i flussi si calcolano solo le coppie del file Flussi/Path/Sequenza, "
+             "con una ricerca per macchina di partenza."
+    )
     machine_nodes_sorted = sorted(
         [n for n, d in G.nodes(data=True) if d["tag"] == "Macchina"],
         key=lambda n: G.nodes[n]["entity_name"]
     )
-    for source, target in itertools.permutations(machine_nodes_sorted, 2):
-        source_name = G.nodes[source]["entity_name"]
-        target_name = G.nodes[target]["entity_name"]
-        collegamento = f"{source_name} --> {target_name}"
-        
-        # PERCORSO OTTIMALE
-        corridor_neighbors = [n for n in G.neighbors(source) if G.nodes[n]["tag"] == "Corridoio"]
-        if corridor_neighbors:
-            nearest_corridor = min(corridor_neighbors, key=lambda n: math.dist(pos[source], pos[n]))
-            if nx.has_path(G, nearest_corridor, target):
-                sub_path = nx.shortest_path(G, source=nearest_corridor, target=target, weight="weight")
-                full_path = [source] + sub_path
-                dettaglio_ottimale, total_ottimale = breakdown_path(full_path, pos)
-                percorso_ottimale = " --> ".join(G.nodes[n]["entity_name"] for n in full_path)
-                length_euclid = total_ottimale
-            else:
-                percorso_ottimale = "Nessun percorso"
-                dettaglio_ottimale = ""
-                length_euclid = None
-        else:
-            percorso_ottimale = "Nessun percorso"
-            dettaglio_ottimale = ""
-            length_euclid = None
-        
-        # PERCORSO VINCOLATO
-        if corridor_neighbors:
-            nearest_corridor = min(corridor_neighbors, key=lambda n: math.dist(pos[source], pos[n]))
-            if nx.has_path(G_filter, nearest_corridor, target):
-                sub_path = nx.shortest_path(G_filter, source=nearest_corridor, target=target, weight="weight")
-                full_path_greedy = [source] + sub_path
-                dettaglio_greedy, total_greedy = breakdown_path(full_path_greedy, pos)
-                percorso_greedy = " --> ".join(G_filter.nodes[n]["entity_name"] for n in full_path_greedy)
-                length_greedy = total_greedy
-            else:
-                percorso_greedy = "Nessun percorso"
-                dettaglio_greedy = ""
-                length_greedy = None
-        else:
-            percorso_greedy = "Nessun percorso"
-            dettaglio_greedy = ""
-            length_greedy = None
-        
-        results.append({
-            "Collegamento Macchina": collegamento,
-            "Percorso Ottimale Seguito": percorso_ottimale,
-            "Dettaglio Distanze Ottimale": dettaglio_ottimale,
-            "Lunghezza Totale Ottimale": length_euclid,
-            "Percorso Vincolato Seguito": percorso_greedy,
-            "Dettaglio Distanze Vincolato": dettaglio_greedy,
-            "Lunghezza Totale Vincolato": length_greedy
-        })
-    df_results = pd.DataFrame(results)
-    st.subheader("Risultati per tutte le coppie di macchine")
+    df_flussi_excel = None
+    if modalita_calcolo == "Tutte le coppie di macchine":
+        coppie = list(itertools.permutations(machine_nodes_sorted, 2))
+    else:
+        df_flussi_excel = carica_flussi()
+        if df_flussi_excel is None:
+            st.info("Carica il file dei flussi per calcolare i percorsi.")
+            return
+        coppie = coppie_macchine_da_flussi(G, df_flussi_excel, machine_nodes_sorted)
+        n_macchine = len(machine_nodes_sorted)
+        st.write(f"Coppie distinte nei flussi: {len(coppie)} su {n_macchine * (n_macchine - 1)} possibili, "
+                 f"{len({s for s, _ in coppie})} macchine di partenza.")
+    df_results, alberi = calcola_df_results(G, grafi_ricerca, pos, coppie, interni)
+    st.subheader("Risultati per le coppie di macchine")
     st.dataframe(df_results)
     
     towrite = io.BytesIO()
@@ -286,6 +483,147 @@ def main():
         file_name="risultati_percorsi.xlsx",
         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
     )
+    # KPI di movimentazione: volumi del file Flussi per le distanze dei percorsi
+    st.subheader("KPI di movimentazione (volumi x distanze)")
+    if df_flussi_excel is None:
+        df_flussi_excel = carica_flussi()
+    F = None
+    if df_flussi_excel is None:
+        st.info("Carica il file dei flussi per calcolare la percorrenza pesata.")
+    else:
+        F = mostra_kpi_flussi(df_flussi_excel, df_results, coppie, machine_nodes_sorted,
+                              [G.nodes[n]["entity_name"] for n in machine_nodes_sorted])
+
+    # Carico sui corridoi: volumi dei flussi (o un'unità per coppia calcolata)
+    # accumulati lungo gli alberi dei predecessori del grafo scelto
+    st.subheader(f"Carico sui corridoi ({scelta})")
+    if F is not None:
+        coo = F.tocoo()
+        volumi = {}
+        for i, j, v in zip(coo.row.tolist(), coo.col.tolist(), coo.data.tolist()):
+            volumi.setdefault(machine_nodes_sorted[i], {})[machine_nodes_sorted[j]] = v
+        st.write("Carico pesato con i volumi del file dei flussi.")
+    else:
+        volumi = raggruppa_volumi(coppie)
+        st.write("Carico con un'unità per ogni coppia calcolata.")
+    k_grafo = 0 if scelta == "Ottimale" else 1
+    indici_ricerca = indice_archi(grafi_ricerca[k_grafo])
+    carichi = espandi_carichi(carichi_archi(alberi, k_grafo, volumi, indici_ricerca), indici_ricerca,
+                              interni[k_grafo], indice_archi(G_graph))
+    display_graph(G_graph, pos, corridors, machines, interattiva, carichi=carichi)
+    archi_grafo = list(G_graph.edges())
+    piu_carichi = np.argsort(carichi)[::-1][:20]
+    piu_carichi = piu_carichi[carichi[piu_carichi] > 0]
+    st.write("Tratti più carichi:")
+    st.dataframe(pd.DataFrame({
+        "Da": [G_graph.nodes[archi_grafo[k][0]]["entity_name"] for k in piu_carichi],
+        "A": [G_graph.nodes[archi_grafo[k][1]]["entity_name"] for k in piu_carichi],
+        "Carico": carichi[piu_carichi],
+    }))
+
+    # Colli di bottiglia: betweenness stimata con sorgenti campionate fra le macchine
+    # e solo i cammini verso le macchine, in parallelo e con un budget di tempo
+    st.subheader(f"Colli di bottiglia ({scelta})")
+    if st.checkbox("Calcola la betweenness campionata dei corridoi", key="colli_bottiglia"):
+        col_k, col_budget = st.columns(2)
+        k_campioni = col_k.number_input("Macchine campionate come sorgenti", min_value=2, value=100, step=10)
+        budget = col_budget.number_input("Budget di tempo (s)", min_value=1.0, value=30.0, step=5.0)
+        nodi, indptr, indici, pesi = grafo_csr(G_graph)
+        tag = [G_graph.nodes[n]["tag"] for n in nodi]
+        pos_macchine = [p for p, t in enumerate(tag) if t == "Macchina"]
+        with st.spinner("Calcolo della betweenness..."):
+            risultato = betweenness_campionata(indptr, indici, pesi, pos_macchine, pos_macchine,
+                                               k=int(k_campioni), budget=float(budget))
+        st.write(f"Sorgenti elaborate: {risultato['campioni']} su {risultato['sorgenti']} "
+                 f"in {risultato['tempo']:.1f} s")
+        if not risultato["completa"]:
+            st.warning("Budget di tempo esaurito prima di tutte le sorgenti campionate: stima parziale, non salvata in cache.")
+        st.dataframe(classifica_colli([G_graph.nodes[n]["entity_name"] for n in nodi], risultato,
+                                      [p for p, t in enumerate(tag) if t == "Corridoio"]))
+
+    # What-if: corridoi o tratti chiusi per manutenzione. Solo gli elementi attraversati
+    # dai percorsi calcolati possono cambiare un risultato, per cui sono gli unici proposti.
+    st.subheader("What-if: corridoi chiusi")
+    gruppi = raggruppa_per_sorgente(coppie)
+    usati = set()
+    archi_usati = set()
+    for sorgente, (partenza, ricerche) in alberi.items():
+        for (_, pred), interni_k in zip(ricerche, interni):
+            for n in nodi_sui_percorsi(pred, gruppi[sorgente]):
+                if pred[n] is None:
+                    continue
+                # Un arco contratto si riespande nei tratti del grafo completo
+                tratto = [pred[n]] + list(interni_k.get((pred[n], n), ())) + [n]
+                for a, b in zip(tratto, tratto[1:]):
+                    if G.nodes[a]["tag"] == "Corridoio" and G.nodes[b]["tag"] == "Corridoio":
+                        usati.update((a, b))
+                        archi_usati.add(tuple(sorted((a, b), key=str)))
+    nomi_nodi = {n: f"{G.nodes[n]['entity_name']} (ID: {n})" for n in usati}
+    nodi_chiusi = st.multiselect("Corridoi chiusi:", sorted(usati, key=nomi_nodi.get),
+                                 format_func=nomi_nodi.get, key="whatif_nodi")
+    archi_chiusi = st.multiselect("Tratti chiusi (nei due versi):", sorted(archi_usati, key=str),
+                                  format_func=lambda a: f"{nomi_nodi[a[0]]} — {nomi_nodi[a[1]]}",
+                                  key="whatif_archi")
+    if nodi_chiusi or archi_chiusi:
+        inizio = time.perf_counter()
+        df_delta, n_ricalcolate = calcola_what_if(
+            G, grafi_ricerca, pos, coppie, alberi, df_results, nodi_chiusi,
+            [a for u, v in archi_chiusi for a in ((u, v), (v, u))], interni)
+        st.write(f"Sorgenti ricalcolate: {n_ricalcolate} su {len(gruppi)} "
+                 f"({time.perf_counter() - inizio:.2f} s); coppie con percorso modificato: {len(df_delta)}.")
+        st.dataframe(df_delta)
+
+    # Percorsi su griglia: aree corridoio meno ingombri delle macchine, senza
+    # dipendere dai punti di corridoio disegnati a mano
+    st.subheader("Percorsi su griglia (aree corridoio meno ingombri)")
+    campo_sfondo = None
+    if df_aree_corridor.empty:
+        st.info("Nessuna riga 'Area Corridoio' nel file: la griglia di occupazione non è disponibile.")
+    elif st.checkbox("Calcola i percorsi sulla griglia di occupazione", key="percorsi_griglia"):
+        aree = rettangoli(df_aree_corridor)
+        lato = float(max(aree[:, 2].max() - aree[:, 0].min(), aree[:, 3].max() - aree[:, 1].min()))
+        passo = st.number_input("Passo della griglia", min_value=lato / 5000, value=lato / 400,
+                                format="%.4f", key="passo_griglia")
+        griglia = griglia_occupazione(aree, rettangoli(df_machine_square), passo)
+        st.write(f"Griglia {griglia['libero'].shape[1]} x {griglia['libero'].shape[0]}, "
+                 f"celle percorribili: {int(griglia['libero'].sum())}")
+        df_griglia, accessi = calcola_percorsi_griglia(G, griglia, coppie)
+        df_griglia["Lunghezza sul grafo"] = df_results["Lunghezza Totale Ottimale"].to_numpy()
+        st.dataframe(df_griglia)
+        # Le celle dei percorsi si ricostruiscono solo per i collegamenti selezionati
+        raggiungibili = df_griglia["Lunghezza su griglia"].notna().to_numpy()
+        coppia_di = dict(zip(df_griglia["Collegamento Macchina"][raggiungibili],
+                             itertools.compress(coppie, raggiungibili)))
+        selezionati = st.multiselect("Percorsi su griglia da visualizzare:", list(coppia_di),
+                                     default=list(coppia_di)[:1], key="selezionati_griglia")
+        # Il campo di una macchina è anche una mappa delle distanze, riusata sullo sfondo dei percorsi
+        nomi_campi = [G.nodes[n]["entity_name"] for n in accessi["macchine"]]
+        scelta_campo = st.selectbox("Mappa delle distanze dalla macchina:", ["(nessuna)"] + nomi_campi,
+                                    key="campo_griglia")
+        if scelta_campo != "(nessuna)":
+            k_campo = nomi_campi.index(scelta_campo)
+            if accessi["campi"] is None:
+                # Con A* non ci sono campi impilati: campo della sola macchina scelta
+                campo = campo_distanze(griglia, accessi["celle"][k_campo])
+            else:
+                campo = accessi["campi"][k_campo]
+            campo_sfondo = (mappa_campo(griglia, campo), estensione(griglia), f"Distanza da {scelta_campo}")
+        fig, ax = plt.subplots(figsize=(8, 6))
+        ax.imshow(griglia["libero"], origin="lower", extent=estensione(griglia), cmap="Greys_r",
+                  vmin=0, vmax=1, interpolation="nearest")
+        if campo_sfondo is not None:
+            fig.colorbar(disegna_campo(ax, *campo_sfondo[:2]), ax=ax, label=campo_sfondo[2])
+        colori = ["red", "blue", "green", "orange", "purple", "brown", "pink", "gray", "cyan", "magenta"]
+        for k, collegamento in enumerate(selezionati):
+            tratto = percorso_griglia(G, griglia, accessi, *coppia_di[collegamento])
+            ax.plot(tratto[:, 0], tratto[:, 1], color=colori[k % len(colori)], linewidth=2, label=collegamento)
+        if selezionati:
+            ax.legend(loc="upper left", fontsize=8)
+        ax.set_title("Percorsi sulla griglia di occupazione")
+        ax.axis("off")
+        st.pyplot(fig)
+        plt.close(fig)
+
     #############################################################################################################################################################################################
     ############################################################################################################################################################################################
 
@@ -324,66 +662,15 @@ def main():
             key="selected_collegamenti"
         )
         if selected_collegamenti:
-            available_colors = ["red", "blue", "green", "orange", "purple", "brown", "pink", "gray", "cyan", "magenta"]
-            mapping = { data.get("entity_name", f"node_{node}"): node 
-                        for node, data in G_graph.nodes(data=True) }
-            fig, ax = plt.subplots(figsize=(8,6))
-            # Se è stata caricata un'immagine di sfondo, disegnala per prima
-            if bg_image_file:
-                from PIL import Image
-                import numpy as np
-                bg_image_file.seek(0)  # Riposiziona il puntatore del file
-                bg_image = Image.open(bg_image_file).convert("RGB")
-                bg_image_array = np.array(bg_image)
-                # Calcola l'estensione basandosi sulle coordinate dei nodi
-                x_coords = [coord[0] for coord in pos.values()]
-                y_coords = [coord[1] for coord in pos.values()]
-                x_min, x_max = min(x_coords), max(x_coords)
-                y_min, y_max = min(y_coords), max(y_coords)
-                ax.imshow(bg_image_array, extent=(x_min, x_max, y_min, y_max))
-            # Disegna nodi e archi di base
-            nx.draw_networkx_nodes(G_graph, pos, node_size=50, node_color="lightgray", ax=ax)
-            nx.draw_networkx_edges(G_graph, pos, edge_color="lightgray", ax=ax, arrows=False, alpha=0.4)
-            
-            legend_patches = []
-            for idx, coll in enumerate(selected_collegamenti):
-                # Recupera il percorso dal df_results
-                row = df_results[df_results["Collegamento Macchina"] == coll].iloc[0]
-                if percorso_type == "Ottimale":
-                    path_str = row["Percorso Ottimale Seguito"]
-                else:
-                    path_str = row["Percorso Vincolato Seguito"]
-                if path_str == "Nessun percorso":
-                    st.warning(f"Il collegamento {coll} non ha un percorso {percorso_type.lower()} disponibile.")
-                    continue
-                route_names = [p.strip() for p in path_str.split("-->")]
-                route_node_ids = [mapping[n] for n in route_names if n in mapping]
-                route_edges = [(route_node_ids[i], route_node_ids[i+1]) for i in range(len(route_node_ids)-1)]
-                color = available_colors[idx % len(available_colors)]
-                nx.draw_networkx_edges(G_graph, pos, edgelist=route_edges, width=2, edge_color=color, ax=ax, arrows=False)
-                nx.draw_networkx_nodes(G_graph, pos, nodelist=route_node_ids, node_color=color, node_size=150, ax=ax)
-                labels = {nid: G_graph.nodes[nid].get("entity_name", f"node_{nid}") for nid in route_node_ids}
-                nx.draw_networkx_labels(G_graph, pos, labels, font_color="black", font_size=9, ax=ax)
-                legend_patches.append(mpatches.Patch(color=color, label=f"{coll} ({percorso_type})"))
-            ax.set_title(f"Percorsi {percorso_type} Selezionati (inclusi i corridoi)")
-            ax.axis("off")
-            if legend_patches:
-                unique_patches = {p.get_label(): p for p in legend_patches}
-                ax.legend(handles=list(unique_patches.values()), loc="upper left", title="Legenda Percorsi")
-            st.pyplot(fig)
+            plot_routes(G_graph, pos, df_results, selected_collegamenti, percorso_type,
+                        bg_image_file, {"loc": "upper left"}, interattiva, campo_sfondo)
     
     else:
         st.subheader("Visualizzazione dei percorsi dal file Excel")
-        flussi_file = st.file_uploader(
-            "Carica un file Excel o CSV con le colonne: Flussi, Path, Sequenza (per visualizzazione)",
-            type=["xls", "xlsx", "csv"],
-            key="excel_flussi"
-        )
-        if flussi_file is not None:
-            if flussi_file.name.lower().endswith("csv"):
-                df_flussi_excel = pd.read_csv(flussi_file)
-            else:
-                df_flussi_excel = pd.read_excel(flussi_file)
+        # Il file dei flussi è quello caricato per il calcolo o per i KPI
+        if df_flussi_excel is None:
+            st.info("Carica il file dei flussi nella sezione dei KPI di movimentazione.")
+        else:
             st.write("Anteprima dei flussi (Excel):")
             st.dataframe(df_flussi_excel)
             
@@ -406,53 +693,9 @@ def main():
             df_filtered_excel = df_filtered_excel[df_filtered_excel["Path"].isin(selected_collegamenti)]
         
             if selected_collegamenti:
-                available_colors = ["red", "blue", "green", "orange", "purple", "brown", "pink", "gray", "cyan", "magenta"]
-                mapping = { data.get("entity_name", f"node_{node}"): node 
-                            for node, data in G_graph.nodes(data=True) }
-                fig, ax = plt.subplots(figsize=(8,6))
-                if bg_image_file:
-                    from PIL import Image
-                    import numpy as np
-                    bg_image_file.seek(0)
-                    bg_image = Image.open(bg_image_file).convert("RGB")
-                    bg_image_array = np.array(bg_image)
-                    x_coords = [coord[0] for coord in pos.values()]
-                    y_coords = [coord[1] for coord in pos.values()]
-                    x_min, x_max = min(x_coords), max(x_coords)
-                    y_min, y_max = min(y_coords), max(y_coords)
-                    ax.imshow(bg_image_array, extent=(x_min, x_max, y_min, y_max))
-                nx.draw_networkx_nodes(G_graph, pos, node_size=50, node_color="lightgray", ax=ax)
-                nx.draw_networkx_edges(G_graph, pos, edge_color="lightgray", ax=ax, arrows=False, alpha=0.4)
-                
-                legend_patches = []
-                for idx, coll in enumerate(selected_collegamenti):
-                    filtered_rows = df_results[df_results["Collegamento Macchina"] == coll]
-                    if filtered_rows.empty:
-                        st.warning(f"Nessun record trovato per il collegamento {coll}.")
-                        continue
-                    row = filtered_rows.iloc[0]
-                    if percorso_type == "Ottimale":
-                        path_str = row["Percorso Ottimale Seguito"]
-                    else:
-                        path_str = row["Percorso Vincolato Seguito"]
-                    if path_str == "Nessun percorso":
-                        st.warning(f"Il collegamento {coll} non ha un percorso {percorso_type.lower()} disponibile.")
-                        continue
-                    route_names = [p.strip() for p in path_str.split("-->")]
-                    route_node_ids = [mapping[n] for n in route_names if n in mapping]
-                    route_edges = [(route_node_ids[i], route_node_ids[i+1]) for i in range(len(route_node_ids)-1)]
-                    color = available_colors[idx % len(available_colors)]
-                    nx.draw_networkx_edges(G_graph, pos, edgelist=route_edges, width=2, edge_color=color, ax=ax, arrows=False)
-                    nx.draw_networkx_nodes(G_graph, pos, nodelist=route_node_ids, node_color=color, node_size=150, ax=ax)
-                    labels = {nid: G_graph.nodes[nid].get("entity_name", f"node_{nid}") for nid in route_node_ids}
-                    nx.draw_networkx_labels(G_graph, pos, labels, font_color="black", font_size=9, ax=ax)
-                    legend_patches.append(mpatches.Patch(color=color, label=f"{coll} ({percorso_type})"))
-                ax.set_title(f"Percorsi {percorso_type} Selezionati (inclusi i corridoi)")
-                ax.axis("off")
-                if legend_patches:
-                    unique_patches = {p.get_label(): p for p in legend_patches}
-                    ax.legend(handles=list(unique_patches.values()), loc="upper left",bbox_to_anchor=(1, 1), title="Legenda Percorsi")
-                st.pyplot(fig)
+                plot_routes(G_graph, pos, df_results, selected_collegamenti, percorso_type,
+                            bg_image_file, {"loc": "upper left", "bbox_to_anchor": (1, 1)}, interattiva,
+                            campo_sfondo)
 
                 
 if __name__ == "__main__":
@@ -0,0 +1,616 @@
+import heapq
+import itertools
+import math
+
+import numpy as np
+import pandas as pd
+import networkx as nx
+import streamlit as st
+from scipy.spatial import cKDTree
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+"""
+======================================
+MOTORE DEI GRAFI DI PERCORSO (CORRIDOI E MACCHINE)
+======================================
+
+- Coppie candidate di corridoi calcolate una sola volta fino alla distanza
+  massima dello slider (KD-tree), ordinate per distanza e con le maschere di
+  direzione già valutate: i collegamenti per una qualsiasi `max_distance`
+  sono una ricerca binaria più uno slice.
+- Aggancio di ogni macchina al corridoio più vicino in blocco (KD-tree).
+- I grafi ottimale e vincolato si costruiscono insieme: un solo slice delle
+  coppie candidate su cui si leggono entrambe le maschere, e un solo elenco di
+  nodi e di archi delle macchine condiviso dai due grafi.
+- Percorsi solo per le coppie richieste (ad es. quelle del file Flussi),
+  raggruppate per sorgente: una ricerca di Dijkstra per sorgente e per grafo,
+  interrotta quando tutte le destinazioni del gruppo sono state raggiunte.
+- What-if con corridoi chiusi: dagli alberi dei predecessori in memoria si
+  individuano le sorgenti i cui percorsi attraversano nodi o archi bloccati,
+  e solo quelle vengono ricalcolate, saltando gli elementi bloccati durante
+  la ricerca (senza copiare il grafo).
+- Carico sugli archi: volumi dei flussi accumulati lungo gli alberi dei
+  predecessori delle ricerche (un array indicizzato per id di arco).
+- KPI di movimentazione: matrice from-to sparsa dei volumi per la distanza
+  dei percorsi, valutata solo sulle coppie con flusso (senza matrici dense).
+- Semplificazione opzionale: corridoi quasi coincidenti accorpati (coppie
+  entro la tolleranza dal KD-tree, gruppi come componenti connesse) e catene
+  di corridoi di grado 2 allineati (stessi Size/URL) contratte in archi con la
+  somma dei pesi; i percorsi e i carichi si riespandono sul grafo completo.
+- Le maschere riproducono is_valid_direction (grafo "STD", ottimale) e
+  is_valid_direction_filter (grafo "filter", vincolato) delle pagine.
+"""
+
+# Esponente della distanza di Minkowski per la metrica dei collegamenti fra corridoi
+METRICHE = {"euclidea": 2, "manhattan": 1}
+
+###############################
+# 1. Nodi
+###############################
+
+# Attributi dei nodi del grafo e colonne del DataFrame da cui provengono
+ATTRIBUTI_NODO = {"x": "X", "y": "Y", "tag": "Tag", "entity_name": "Entity Name", "size": "Size", "stream": "URL"}
+
+def nodi_da_dataframe(df_all):
+    """Lista (id, attributi) dei nodi nell'ordine di df_all, letta per colonne invece che con iterrows."""
+    colonne = {attr: df_all[col].tolist() for attr, col in ATTRIBUTI_NODO.items()}
+    return [(idx, {attr: valori[p] for attr, valori in colonne.items()})
+            for p, idx in enumerate(df_all.index.tolist())]
+
+def come_testo(valori):
+    """
+    Conversione a stringa come nelle funzioni di direzione (str() sui valori non
+    testuali). L'array è di tipo stringa e non object: st.cache_data lo hasha per
+    contenuto, mentre per un array object userebbe i puntatori agli oggetti.
+    """
+    return np.array([v if isinstance(v, str) else str(v) for v in valori], dtype=str)
+
+###############################
+# 2. Maschere di direzione
+###############################
+
+def maschera_direzione(xi, yi, xj, yj, direzione):
+    """Versione vettoriale di is_valid_direction sulle coppie (i -> j)."""
+    dist_x = np.abs(xi - xj)
+    dist_y = np.abs(yi - yj)
+    return np.where(direzione == "verticale", dist_y > dist_x,
+                    np.where(direzione == "orizzontale", dist_y < dist_x, True))
+
+def maschera_direzione_filtro(xi, yi, xj, yj, direzione, stream):
+    """Versione vettoriale di is_valid_direction_filter sulle coppie (i -> j)."""
+    dist_x = np.abs(xi - xj)
+    dist_y = np.abs(yi - yj)
+    condizioni = [stream == "destro", stream == "sinistro", stream == "alto", stream == "basso",
+                  stream == "orizzontale", direzione == "verticale"]
+    scelte = [xj > xi, xj < xi, yj > yi, yj < yi, dist_y < dist_x, dist_y > dist_x]
+    return np.select(condizioni, scelte, default=True)
+
+###############################
+# 3. Coppie candidate e aggancio delle macchine
+###############################
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def coppie_candidate(coords, direzione, stream, metrica, raggio_max):
+    """
+    Tutte le coppie ordinate (i, j) di corridoi a distanza <= raggio_max,
+    ordinate per distanza crescente, con le maschere "std" e "filtro".
+    Gli indici sono posizioni in `coords`.
+    """
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    p = METRICHE[metrica]
+    if len(coords) < 2:
+        vuoto = np.empty(0, dtype=np.int64)
+        return {"i": vuoto, "j": vuoto, "dist": np.empty(0),
+                "std": np.empty(0, dtype=bool), "filtro": np.empty(0, dtype=bool)}
+    # Raggio leggermente allargato: la distanza esatta viene ricalcolata e filtrata sotto
+    coppie = cKDTree(coords).query_pairs(r=raggio_max * (1 + 1e-9), p=p, output_type="ndarray")
+    i = np.concatenate([coppie[:, 0], coppie[:, 1]]).astype(np.int64)
+    j = np.concatenate([coppie[:, 1], coppie[:, 0]]).astype(np.int64)
+    delta = coords[j] - coords[i]
+    dist = np.hypot(delta[:, 0], delta[:, 1]) if p == 2 else np.abs(delta).sum(axis=1)
+    ordine = np.lexsort((j, i, dist))
+    ordine = ordine[dist[ordine] <= raggio_max]
+    i, j, dist = i[ordine], j[ordine], dist[ordine]
+    xi, yi = coords[i, 0], coords[i, 1]
+    xj, yj = coords[j, 0], coords[j, 1]
+    return {
+        "i": i, "j": j, "dist": dist,
+        "std": maschera_direzione(xi, yi, xj, yj, direzione[i]),
+        "filtro": maschera_direzione_filtro(xi, yi, xj, yj, direzione[i], stream[i]),
+    }
+
+def archi_entro(candidate, max_distance):
+    """
+    Archi fra corridoi per una soglia: ricerca binaria sulle distanze ordinate e
+    slice, con le coppie riportate nell'ordine delle permutazioni (i, j) come nel
+    ciclo originale. Restituisce (i, j, dist, std, filtro): le maschere sono
+    valutate insieme sullo stesso slice.
+    """
+    k = np.searchsorted(candidate["dist"], max_distance, side="right")
+    i, j = candidate["i"][:k], candidate["j"][:k]
+    ordine = np.lexsort((j, i))
+    return (i[ordine], j[ordine], candidate["dist"][:k][ordine],
+            candidate["std"][:k][ordine], candidate["filtro"][:k][ordine])
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def aggancio_macchine(coords_macchine, coords_corridoi):
+    """Corridoio più vicino (posizione) e distanza euclidea per ogni macchina."""
+    coords_macchine = np.asarray(coords_macchine, dtype=float).reshape(-1, 2)
+    if len(coords_macchine) == 0 or len(coords_corridoi) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    coords_corridoi = np.asarray(coords_corridoi, dtype=float).reshape(-1, 2)
+    albero = cKDTree(coords_corridoi)
+    dist, _ = albero.query(coords_macchine)
+    # Tutti i corridoi alla distanza minima (con un margine per l'arrotondamento):
+    # a parità vince il primo, come nel ciclo originale (confronto stretto)
+    vicini = albero.query_ball_point(coords_macchine, dist * (1 + 1e-9) + 1e-12)
+    macchina = np.repeat(np.arange(len(coords_macchine)), [len(v) for v in vicini])
+    corridoio = np.concatenate([np.asarray(v, dtype=np.int64) for v in vicini])
+    delta = coords_corridoi[corridoio] - coords_macchine[macchina]
+    esatta = np.hypot(delta[:, 0], delta[:, 1])
+    ordine = np.lexsort((corridoio, esatta, macchina))
+    primi = ordine[np.unique(macchina[ordine], return_index=True)[1]]
+    return corridoio[primi], esatta[primi]
+
+###############################
+# 4. Rete e grafo
+###############################
+
+def prepara_rete(df_all, metrica="euclidea", raggio_max=20.0):
+    """
+    Struttura comune ai grafi: nodi, posizioni di corridoi e macchine, coppie
+    candidate (in cache) fino a `raggio_max` e aggancio delle macchine (in cache).
+    """
+    ids = np.asarray(df_all.index.tolist(), dtype=object)
+    tag = df_all["Tag"].to_numpy()
+    coords = df_all[["X", "Y"]].to_numpy(dtype=float)
+    corridoi = np.flatnonzero(tag == "Corridoio")
+    macchine = np.flatnonzero(tag == "Macchina")
+    candidate = coppie_candidate(coords[corridoi], come_testo(df_all["Size"].to_numpy()[corridoi]),
+                                 come_testo(df_all["URL"].to_numpy()[corridoi]), metrica, raggio_max)
+    vicino, dist_vicino = aggancio_macchine(coords[macchine], coords[corridoi])
+    return {
+        "nodi": nodi_da_dataframe(df_all),
+        "ids": ids,
+        "corridoi": corridoi,
+        "macchine": macchine,
+        "candidate": candidate,
+        "aggancio": (vicino, dist_vicino),
+        "raggio_max": raggio_max,
+    }
+
+def archi_macchine(rete, max_distance):
+    """Coppie di archi macchina -> corridoio e corridoio -> macchina entro la soglia, per macchina."""
+    vicino, dist = rete["aggancio"]
+    entro = dist <= max_distance
+    macchine = rete["ids"][rete["macchine"][entro]].tolist()
+    corridoi = rete["ids"][rete["corridoi"][vicino[entro]]].tolist()
+    archi = []
+    for m, c, d in zip(macchine, corridoi, dist[entro].tolist()):
+        archi.append((m, c, d))
+        archi.append((c, m, d))
+    return archi
+
+def _controlla_soglia(rete, max_distance):
+    if max_distance > rete["raggio_max"]:
+        raise ValueError(f"max_distance ({max_distance}) oltre il raggio delle coppie candidate ({rete['raggio_max']})")
+
+def grafi_da_rete(rete, max_distance):
+    """
+    Grafo ottimale (maschera "std") e vincolato (maschera "filtro") con una sola
+    passata: lo slice delle coppie candidate, la conversione degli id e gli archi
+    delle macchine sono calcolati una volta. I due grafi condividono gli stessi
+    dizionari degli attributi dei nodi (da rete["nodi"]): modificarli in uno
+    li modifica anche nell'altro.
+    """
+    _controlla_soglia(rete, max_distance)
+    ids_corridoi = rete["ids"][rete["corridoi"]]
+    i, j, dist, std, filtro = archi_entro(rete["candidate"], max_distance)
+    archi = list(zip(ids_corridoi[i].tolist(), ids_corridoi[j].tolist(), dist.tolist()))
+    archi_m = archi_macchine(rete, max_distance)
+    grafi = []
+    for maschera in (std, filtro):
+        G = nx.DiGraph()
+        if grafi:
+            # add_nodes_from copierebbe ogni dizionario: il secondo grafo riusa quelli del primo
+            G.add_nodes_from(grafi[0])
+            G._node.update(grafi[0]._node)
+        else:
+            G.add_nodes_from(rete["nodi"])
+        G.add_weighted_edges_from(itertools.compress(archi, maschera.tolist()))
+        G.add_weighted_edges_from(archi_m)
+        grafi.append(G)
+    return tuple(grafi)
+
+###############################
+# 5. Ricerche di percorso per coppie (sorgente, destinazione)
+###############################
+
+def coppie_da_flussi(df_flussi, colonna="Path"):
+    """
+    Coppie (sorgente, destinazione) distinte, per nome, lette dalla colonna dei
+    percorsi "A --> B" del file Flussi: un percorso con più tappe dà le coppie
+    consecutive. L'ordine è quello di prima comparsa.
+    """
+    coppie = {}
+    for percorso in df_flussi[colonna].dropna().astype(str):
+        nomi = [n.strip() for n in percorso.split("-->") if n.strip()]
+        for coppia in zip(nomi, nomi[1:]):
+            coppie.setdefault(coppia, None)
+    return list(coppie)
+
+def raggruppa_per_sorgente(coppie):
+    """Dizionario sorgente -> destinazioni (nell'ordine delle coppie)."""
+    gruppi = {}
+    for sorgente, destinazione in coppie:
+        gruppi.setdefault(sorgente, []).append(destinazione)
+    return gruppi
+
+def raggruppa_volumi(coppie, volume=1.0):
+    """Dizionario sorgente -> {destinazione: volume} con lo stesso volume per ogni coppia."""
+    volumi = {}
+    for sorgente, destinazione in coppie:
+        volumi.setdefault(sorgente, {})[destinazione] = volume
+    return volumi
+
+def dijkstra_verso(G, sorgente, destinazioni, weight="weight", nodi_esclusi=frozenset(), archi_esclusi=frozenset()):
+    """
+    Dijkstra da `sorgente` che si ferma appena tutte le `destinazioni` sono
+    state raggiunte, ignorando i nodi e gli archi esclusi (insiemi).
+    Restituisce (distanze, predecessori) dei nodi visitati.
+    """
+    dist = {}
+    pred = {sorgente: None}
+    visti = {sorgente: 0.0}
+    conta = itertools.count()
+    frangia = [(0.0, next(conta), sorgente)]
+    mancanti = set(destinazioni)
+    while frangia and mancanti:
+        d, _, v = heapq.heappop(frangia)
+        if v in dist:
+            continue
+        dist[v] = d
+        mancanti.discard(v)
+        for u, attr in G.adj[v].items():
+            if u in nodi_esclusi or (archi_esclusi and (v, u) in archi_esclusi):
+                continue
+            du = d + attr[weight]
+            if u not in dist and (u not in visti or du < visti[u]):
+                visti[u] = du
+                pred[u] = v
+                heapq.heappush(frangia, (du, next(conta), u))
+    return dist, pred
+
+def ricostruisci_percorso(pred, nodo):
+    """Percorso dalla sorgente a `nodo` seguendo i predecessori."""
+    percorso = []
+    while nodo is not None:
+        percorso.append(nodo)
+        nodo = pred[nodo]
+    return percorso[::-1]
+
+def corridoio_di_partenza(G, pos, macchina):
+    """Corridoio più vicino tra i vicini della macchina (None se non è collegata)."""
+    vicini = [n for n in G.neighbors(macchina) if G.nodes[n]["tag"] == "Corridoio"]
+    if not vicini:
+        return None
+    return min(vicini, key=lambda n: math.dist(pos[macchina], pos[n]))
+
+def alberi_per_sorgente(grafi, pos, gruppi):
+    """
+    Alberi dei cammini minimi per ogni gruppo {sorgente: [destinazioni]}: una sola
+    ricerca per sorgente e per grafo a partire dal corridoio di partenza, scelto
+    sul primo grafo come nel calcolo originale.
+    Restituisce {sorgente: (partenza, [(distanze, predecessori) per grafo])}, con
+    partenza None se la macchina non è collegata. Le distanze sono in ordine di visita.
+    """
+    alberi = {}
+    for sorgente, destinazioni in gruppi.items():
+        partenza = corridoio_di_partenza(grafi[0], pos, sorgente)
+        if partenza is None:
+            alberi[sorgente] = (None, [({}, {})] * len(grafi))
+        else:
+            alberi[sorgente] = (partenza, [dijkstra_verso(G, partenza, destinazioni) for G in grafi])
+    return alberi
+
+def percorsi_da_alberi(alberi, gruppi):
+    """
+    Percorsi completi macchina -> corridoio -> ... -> destinazione per ogni coppia
+    dei gruppi. Restituisce {(sorgente, destinazione): [percorso o None per grafo]}.
+    """
+    risultati = {}
+    for sorgente, destinazioni in gruppi.items():
+        partenza, ricerche = alberi[sorgente]
+        for d in destinazioni:
+            # Il predecessore esiste solo per i nodi raggiunti (la distanza finale è già fissata)
+            risultati[(sorgente, d)] = [[sorgente] + ricostruisci_percorso(pred, d)
+                                        if partenza is not None and d in pred else None
+                                        for _, pred in ricerche]
+    return risultati
+
+def nodi_sui_percorsi(pred, destinazioni):
+    """
+    Nodi dei cammini minimi verso le destinazioni raggiunte, risalendo l'albero
+    dei predecessori una volta sola per ramo (la radice è il corridoio di partenza).
+    """
+    usati = set()
+    for nodo in destinazioni:
+        if nodo not in pred:
+            continue
+        while nodo is not None and nodo not in usati:
+            usati.add(nodo)
+            nodo = pred[nodo]
+    return usati
+
+def ripara_alberi(grafi, pos, gruppi, alberi, nodi_bloccati=(), archi_bloccati=(), archi_per_grafo=None):
+    """
+    Alberi dei cammini minimi dopo la chiusura di nodi e archi (what-if): si
+    ricalcolano solo le ricerche (sorgente, grafo) in cui un percorso verso una
+    destinazione attraversa un elemento bloccato. Le altre restano valide,
+    perché togliere nodi o archi non accorcia nessun cammino. Se il tratto
+    macchina -> corridoio di partenza è bloccato, la partenza viene riscelta e
+    la sorgente ricalcolata su tutti i grafi.
+    `archi_per_grafo` aggiunge archi bloccati propri di ciascun grafo (gli archi
+    contratti dei grafi semplificati).
+    Restituisce (alberi aggiornati, {sorgente: [ricalcolata per grafo]}) con le
+    sole sorgenti ricalcolate.
+    """
+    bloccati = set(nodi_bloccati)
+    archi = [set(archi_bloccati).union(extra) for extra in (archi_per_grafo or [()] * len(grafi))]
+    nuovi = dict(alberi)
+    colpite = {}
+    for sorgente, destinazioni in gruppi.items():
+        partenza, ricerche = alberi[sorgente]
+        if partenza is None:
+            continue
+        colpita = []
+        for (_, pred), archi_k in zip(ricerche, archi):
+            usati = nodi_sui_percorsi(pred, destinazioni)
+            colpita.append(bool(usati & bloccati)
+                           or any(pred[n] is not None and (pred[n], n) in archi_k for n in usati))
+        if partenza in bloccati or (sorgente, partenza) in archi[0]:
+            partenza = corridoio_di_partenza(nx.restricted_view(grafi[0], bloccati, archi[0]), pos, sorgente)
+            colpita = [True] * len(grafi)
+        if not any(colpita):
+            continue
+        if partenza is None:
+            nuovi[sorgente] = (None, [({}, {})] * len(grafi))
+        else:
+            nuovi[sorgente] = (partenza, [dijkstra_verso(G, partenza, destinazioni, nodi_esclusi=bloccati,
+                                                         archi_esclusi=archi_k) if c else r
+                                          for G, r, c, archi_k in zip(grafi, ricerche, colpita, archi)])
+        colpite[sorgente] = colpita
+    return nuovi, colpite
+
+###############################
+# 6. KPI di movimentazione pesata sui flussi
+###############################
+
+def matrice_flussi(df_flussi, nomi_macchine, colonna_volume=None, colonna="Path"):
+    """
+    Matrice sparsa from-to (macchine x macchine, nell'ordine di `nomi_macchine`)
+    dei volumi: ogni coppia consecutiva di un percorso "A --> B" riceve il volume
+    della riga (1 se non c'è una colonna dei volumi); i duplicati si sommano.
+    Restituisce (matrice CSR, volume delle coppie non riconosciute).
+    """
+    indice = {nome: k for k, nome in enumerate(nomi_macchine)}
+    percorsi = df_flussi[colonna].astype(str).tolist()
+    volumi = (pd.to_numeric(df_flussi[colonna_volume], errors="coerce").fillna(0.0).tolist()
+              if colonna_volume else [1.0] * len(percorsi))
+    righe, colonne, valori = [], [], []
+    ignorato = 0.0
+    for percorso, volume in zip(percorsi, volumi):
+        nomi = [n.strip() for n in percorso.split("-->") if n.strip()]
+        for a, b in zip(nomi, nomi[1:]):
+            if a in indice and b in indice and a != b:
+                righe.append(indice[a])
+                colonne.append(indice[b])
+                valori.append(volume)
+            else:
+                ignorato += volume
+    n = len(nomi_macchine)
+    # La conversione in CSR somma le coppie ripetute
+    F = coo_matrix((valori, (righe, colonne)), shape=(n, n), dtype=float).tocsr()
+    F.eliminate_zeros()
+    return F, ignorato
+
+def distanze_sui_flussi(F, distanza):
+    """
+    Distanze lette solo sulle coppie con flusso (struttura sparsa di F, stesso
+    ordine di F.data): la matrice delle distanze non viene mai costruita densa.
+    `distanza` è un dizionario (i, j) -> lunghezza (None/NaN se non c'è percorso).
+    """
+    coo = F.tocoo()
+    valori = [distanza.get((i, j)) for i, j in zip(coo.row.tolist(), coo.col.tolist())]
+    return np.array([np.nan if v is None else v for v in valori], dtype=float)
+
+def kpi_percorrenza(F, distanze):
+    """
+    Percorrenza pesata volume x distanza sulle coppie di F (distanze allineate a F.data).
+    Restituisce (riepilogo, uscita, ingresso): totali e percorrenza pesata per
+    macchina di partenza e di arrivo. Il volume senza percorso è escluso e riportato a parte.
+    """
+    F = F.tocsr()
+    coo = F.tocoo()
+    instradabile = ~np.isnan(distanze)
+    W = coo_matrix((coo.data[instradabile] * distanze[instradabile],
+                    (coo.row[instradabile], coo.col[instradabile])), shape=F.shape).tocsr()
+    volume_instradato = coo.data[instradabile].sum()
+    totale = W.sum()
+    riepilogo = {
+        "Percorrenza pesata totale": float(totale),
+        "Volume instradato": float(volume_instradato),
+        "Volume senza percorso": float(coo.data[~instradabile].sum()),
+        "Distanza media pesata": float(totale / volume_instradato) if volume_instradato else None,
+    }
+    uscita = np.asarray(W.sum(axis=1)).ravel()
+    ingresso = np.asarray(W.sum(axis=0)).ravel()
+    return riepilogo, uscita, ingresso
+
+###############################
+# 7. Carichi sugli archi
+###############################
+
+def indice_archi(G):
+    """Id degli archi: posizione di (u, v) in G.edges(), lo stesso ordine di disegno.arrays_grafo."""
+    return {arco: k for k, arco in enumerate(G.edges())}
+
+def carichi_archi(alberi, k, volumi, indici):
+    """
+    Volume che attraversa ogni arco del grafo k, sommando i flussi lungo gli alberi
+    dei predecessori invece di ripercorrere i singoli percorsi: per ogni sorgente
+    i volumi delle destinazioni risalgono l'albero dai nodi visitati per ultimi,
+    per cui il costo è lineare nella dimensione degli alberi.
+    `volumi` è {sorgente: {destinazione: volume}}; restituisce un array per id di arco.
+    """
+    carichi = np.zeros(len(indici))
+    for sorgente, per_destinazione in volumi.items():
+        partenza, ricerche = alberi.get(sorgente, (None, None))
+        if partenza is None:
+            continue
+        dist, pred = ricerche[k]
+        carico = {d: v for d, v in per_destinazione.items() if d in dist and v}
+        totale = sum(carico.values())
+        if not totale:
+            continue
+        for nodo in reversed(list(dist)):
+            c = carico.get(nodo)
+            padre = pred[nodo]
+            if not c or padre is None:
+                continue
+            carichi[indici[(padre, nodo)]] += c
+            carico[padre] = carico.get(padre, 0.0) + c
+        # Tratto iniziale macchina -> corridoio di partenza
+        carichi[indici[(sorgente, partenza)]] += totale
+    return carichi
+
+###############################
+# 8. Semplificazione della rete
+###############################
+
+def accorpa_duplicati(df_all, tolleranza):
+    """
+    Corridoi quasi coincidenti (a distanza <= `tolleranza`, stessi Size/URL)
+    ridotti al primo del gruppo: le coppie vicine vengono dal KD-tree e i gruppi
+    sono le componenti connesse delle coppie, per cui anche le catene di punti
+    vicini si accorpano. Le macchine restano tutte.
+    Restituisce (DataFrame senza i duplicati, numero di punti rimossi).
+    """
+    if tolleranza <= 0:
+        return df_all, 0
+    corridoi = np.flatnonzero((df_all["Tag"] == "Corridoio").to_numpy())
+    coords = df_all[["X", "Y"]].to_numpy(dtype=float)[corridoi]
+    # I duplicati si cercano solo fra i corridoi con coordinate valide
+    validi = np.flatnonzero(np.isfinite(coords).all(axis=1))
+    if len(validi) < 2:
+        return df_all, 0
+    coppie = cKDTree(coords[validi]).query_pairs(r=tolleranza, output_type="ndarray")
+    a, b = validi[coppie[:, 0]], validi[coppie[:, 1]]
+    size = come_testo(df_all["Size"].to_numpy()[corridoi])
+    url = come_testo(df_all["URL"].to_numpy()[corridoi])
+    stessi = (size[a] == size[b]) & (url[a] == url[b])
+    a, b = a[stessi], b[stessi]
+    _, gruppo = connected_components(coo_matrix((np.ones(len(a)), (a, b)), shape=(len(corridoi),) * 2),
+                                     directed=False)
+    # Nell'ordine di df_all il primo corridoio di ogni gruppo resta
+    doppio = np.zeros(len(df_all), dtype=bool)
+    doppio[corridoi] = pd.Series(gruppo).duplicated().to_numpy()
+    return df_all[~doppio], int(doppio.sum())
+
+def _allineati(coords, a, b, tolleranza):
+    """True se tutti i punti `coords` distano al più `tolleranza` dalla retta per a e b."""
+    ab = b - a
+    norma = math.hypot(ab[0], ab[1])
+    if norma == 0:
+        return False
+    scarto = np.abs(ab[0] * (coords[:, 1] - a[1]) - ab[1] * (coords[:, 0] - a[0])) / norma
+    return bool((scarto <= tolleranza).all())
+
+def contrai_catene(G, tolleranza):
+    """
+    Contrae le catene di corridoi di grado 2 (un solo vicino per lato, nessuna
+    macchina agganciata, stessi Size/URL dei vicini e punti allineati entro
+    `tolleranza`) in archi singoli con peso pari alla somma dei tratti: le
+    distanze fra i nodi rimasti non cambiano.
+    Restituisce (grafo semplificato, interni) con interni[(u, w)] = nodi
+    intermedi, nell'ordine di percorrenza, degli archi contratti.
+    """
+    H = G.copy()
+    interni = {}
+    for v in list(G.nodes()):
+        dati = H.nodes[v]
+        if dati["tag"] != "Corridoio":
+            continue
+        vicini = (set(H.pred[v]) | set(H.succ[v])) - {v}
+        if len(vicini) != 2:
+            continue
+        u, w = vicini
+        # Confronto come testo, come le maschere di direzione (NaN letti da Excel inclusi)
+        if any(H.nodes[n]["tag"] != "Corridoio" or str(H.nodes[n]["size"]) != str(dati["size"])
+               or str(H.nodes[n]["stream"]) != str(dati["stream"]) for n in (u, w)):
+            continue
+        # Tutti i punti della nuova catena (anche quelli già contratti) vicini alla corda u-w
+        catena = (interni.get((u, v), interni.get((v, u), [])[::-1]) + [v]
+                  + interni.get((v, w), interni.get((w, v), [])[::-1]))
+        punti = np.array([[G.nodes[n]["x"], G.nodes[n]["y"]] for n in catena], dtype=float)
+        a = np.array([G.nodes[u]["x"], G.nodes[u]["y"]], dtype=float)
+        b = np.array([G.nodes[w]["x"], G.nodes[w]["y"]], dtype=float)
+        if not _allineati(punti, a, b, tolleranza):
+            continue
+        nuovi = []
+        for x, y in ((u, w), (w, u)):
+            if H.has_edge(x, v) and H.has_edge(v, y):
+                peso = H[x][v]["weight"] + H[v][y]["weight"]
+                sequenza = interni.get((x, v), []) + [v] + interni.get((v, y), [])
+                # Un arco diretto già presente e non più lungo rende superflua la catena
+                if not H.has_edge(x, y) or H[x][y]["weight"] > peso:
+                    nuovi.append((x, y, peso, sequenza))
+        for x, y in ((u, v), (v, u), (v, w), (w, v)):
+            interni.pop((x, y), None)
+        H.remove_node(v)
+        for x, y, peso, sequenza in nuovi:
+            H.add_edge(x, y, weight=peso)
+            interni[(x, y)] = sequenza
+    return H, interni
+
+def espandi_percorso(percorso, interni):
+    """Percorso sul grafo completo: i nodi intermedi degli archi contratti vengono reinseriti."""
+    if not percorso:
+        return percorso
+    completo = [percorso[0]]
+    for u, w in zip(percorso, percorso[1:]):
+        completo.extend(interni.get((u, w), ()))
+        completo.append(w)
+    return completo
+
+def espandi_percorsi(percorsi, interni_per_grafo):
+    """espandi_percorso su {coppia: [percorso o None per grafo]}, con un mapping per grafo."""
+    return {coppia: [None if p is None else espandi_percorso(p, interni)
+                     for p, interni in zip(lista, interni_per_grafo)]
+            for coppia, lista in percorsi.items()}
+
+def espandi_carichi(carichi, indici_semplificati, interni, indici):
+    """
+    Carichi degli archi del grafo semplificato riportati sugli archi del grafo
+    completo (ids di `indici`): ogni tratto di un arco contratto riceve il suo carico.
+    """
+    completi = np.zeros(len(indici))
+    for (u, w), k in indici_semplificati.items():
+        if not carichi[k]:
+            continue
+        sequenza = [u] + list(interni.get((u, w), ())) + [w]
+        for arco in zip(sequenza, sequenza[1:]):
+            completi[indici[arco]] += carichi[k]
+    return completi
+
+def archi_contratti_bloccati(interni, nodi_bloccati, archi_bloccati):
+    """Archi contratti che contengono un nodo o un tratto bloccato del grafo completo."""
+    nodi_bloccati = set(nodi_bloccati)
+    archi_bloccati = set(archi_bloccati)
+    bloccati = set()
+    for (u, w), sequenza in interni.items():
+        completa = [u] + list(sequenza) + [w]
+        if nodi_bloccati.intersection(sequenza) or any(a in archi_bloccati for a in zip(completa, completa[1:])):
+            bloccati.add((u, w))
+    return bloccati
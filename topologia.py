@@ -0,0 +1,414 @@
+import gzip
+import io
+import itertools
+import json
+import math
+
+import numpy as np
+import geopandas as gpd
+import shapely
+
+"""
+======================================
+COSTRUZIONE VETTORIALE DEL TOPOJSON DEI RETTANGOLI
+======================================
+
+- Vertici di tutti i rettangoli (X, Y, LenX, LenY), proiezione geografica
+  attorno a Bergamo e quantizzazione calcolati come array NumPy.
+- Topologia vera: i lati vengono spezzati nei vertici degli altri rettangoli che
+  vi giacciono sopra, i segmenti identici (in qualsiasi verso) vengono salvati
+  una sola volta come arco condiviso e referenziati con ~indice quando percorsi
+  al contrario; i tratti consecutivi non condivisi di un anello diventano un
+  unico arco.
+- Esportazione: JSON minificato scritto a blocchi direttamente nel buffer di
+  download (eventualmente compresso gzip), anteprima riassuntiva invece
+  dell'intero oggetto e formati binari (GeoParquet/FlatGeobuf) per chi non usa Power BI.
+"""
+
+# Riferimento geografico: Bergamo
+BERGAMO_LAT = 45.698
+BERGAMO_LON = 9.677
+# Metri per grado di latitudine (per la longitudine si moltiplica per cos(lat))
+METRI_GRADO = 111111
+# Valore di quantizzazione
+Q = 10000
+
+###############################
+# 1. Vertici, proiezione e quantizzazione
+###############################
+
+def vertici_rettangoli(x, y, len_x, len_y):
+    """Array (N, 5, 2) con i vertici di ogni rettangolo, poligono chiuso (primo punto ripetuto)."""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    x2 = x + np.asarray(len_x, dtype=float)
+    y2 = y + np.asarray(len_y, dtype=float)
+    return np.stack([
+        np.column_stack([x, y]),
+        np.column_stack([x2, y]),
+        np.column_stack([x2, y2]),
+        np.column_stack([x, y2]),
+        np.column_stack([x, y]),
+    ], axis=1)
+
+def locale_a_geo(punti, lon0=BERGAMO_LON, lat0=BERGAMO_LAT):
+    """
+    Converte coordinate locali (metri) in [lon, lat] centrando il bounding box
+    locale sul punto di riferimento. Funziona su array di forma (..., 2).
+    """
+    piatti = punti.reshape(-1, 2)
+    centro = (piatti.min(axis=0) + piatti.max(axis=0)) / 2
+    delta = punti - centro
+    geo = np.empty_like(punti, dtype=float)
+    geo[..., 0] = lon0 + delta[..., 0] / (METRI_GRADO * math.cos(math.radians(lat0)))
+    geo[..., 1] = lat0 + delta[..., 1] / METRI_GRADO
+    return geo
+
+def trasformazione(geo, q=Q):
+    """Bounding box e trasformazione (scale/translate) di quantizzazione del TopoJSON."""
+    piatti = geo.reshape(-1, 2)
+    bbox = [float(v) for v in (*piatti.min(axis=0), *piatti.max(axis=0))]
+    scale_x = (bbox[2] - bbox[0]) / (q - 1) if q > 1 else 1
+    scale_y = (bbox[3] - bbox[1]) / (q - 1) if q > 1 else 1
+    transform = {"scale": [scale_x or 1.0, scale_y or 1.0], "translate": [bbox[0], bbox[1]]}
+    return bbox, transform
+
+def quantizza(geo, transform):
+    """Quantizzazione vettoriale (arrotondamento agli interi della griglia)."""
+    scale = np.asarray(transform["scale"])
+    translate = np.asarray(transform["translate"])
+    return np.rint((geo - translate) / scale).astype(np.int64)
+
+###############################
+# 2. Segmenti spezzati nei vertici condivisi
+###############################
+
+def _punti_interni(chiavi_vertici, base, lo, hi):
+    """
+    Per segmenti assiali con coordinata fissa `base` e intervallo aperto (lo, hi),
+    restituisce (conteggi, valori) delle coordinate dei vertici che vi cadono dentro.
+    `chiavi_vertici` sono le chiavi ordinate base * B + valore dei vertici.
+    """
+    B = np.int64(1 << 31)
+    sx = np.searchsorted(chiavi_vertici, base * B + lo, side="right")
+    dx = np.searchsorted(chiavi_vertici, base * B + hi, side="left")
+    conteggi = np.maximum(dx - sx, 0)
+    indici = np.repeat(sx, conteggi) + (np.arange(conteggi.sum()) - np.repeat(np.cumsum(conteggi) - conteggi, conteggi))
+    return conteggi, chiavi_vertici[indici] - np.repeat(base, conteggi) * B
+
+def spezza_segmenti(quant):
+    """
+    Segmenti degli anelli (N, 5, 2) quantizzati, spezzati in ogni vertice di un
+    altro rettangolo che giace all'interno del lato (i lati sono assiali).
+    Restituisce (anello, a, b): indice dell'anello e estremi di ogni segmento,
+    nell'ordine di percorrenza degli anelli. I segmenti di lunghezza nulla sono scartati.
+    """
+    N = quant.shape[0]
+    a = quant[:, :-1].reshape(-1, 2)
+    b = quant[:, 1:].reshape(-1, 2)
+    anello = np.repeat(np.arange(N), 4)
+    non_nulli = (a != b).any(axis=1)
+    a, b, anello = a[non_nulli], b[non_nulli], anello[non_nulli]
+
+    B = np.int64(1 << 31)
+    vertici = quant[:, :-1].reshape(-1, 2)
+    chiavi_yx = np.unique(vertici[:, 1] * B + vertici[:, 0])
+    chiavi_xy = np.unique(vertici[:, 0] * B + vertici[:, 1])
+
+    orizzontale = a[:, 1] == b[:, 1]
+    conteggi = np.zeros(len(a), dtype=np.int64)
+    # Punti interni ai lati orizzontali (y fissa) e verticali (x fissa)
+    c_o, v_o = _punti_interni(chiavi_yx, a[orizzontale, 1],
+                              np.minimum(a[orizzontale, 0], b[orizzontale, 0]),
+                              np.maximum(a[orizzontale, 0], b[orizzontale, 0]))
+    c_v, v_v = _punti_interni(chiavi_xy, a[~orizzontale, 0],
+                              np.minimum(a[~orizzontale, 1], b[~orizzontale, 1]),
+                              np.maximum(a[~orizzontale, 1], b[~orizzontale, 1]))
+    conteggi[orizzontale] = c_o
+    conteggi[~orizzontale] = c_v
+    if conteggi.sum() == 0:
+        return anello, a, b
+
+    # Coordinate dei punti interni nell'ordine dei segmenti
+    punti_o = np.column_stack([v_o, np.repeat(a[orizzontale, 1], c_o)])
+    punti_v = np.column_stack([np.repeat(a[~orizzontale, 0], c_v), v_v])
+    seg_o = np.repeat(np.flatnonzero(orizzontale), c_o)
+    seg_v = np.repeat(np.flatnonzero(~orizzontale), c_v)
+    seg = np.concatenate([seg_o, seg_v])
+    punti = np.concatenate([punti_o, punti_v])
+    # Ordina per segmento e poi lungo il verso di percorrenza del segmento
+    verso = np.sign((b - a).sum(axis=1))[seg]
+    lungo = np.where(orizzontale[seg], punti[:, 0], punti[:, 1]) * verso
+    ordine = np.lexsort([lungo, seg])
+    seg, punti = seg[ordine], punti[ordine]
+
+    # Sequenza dei punti di ogni segmento: a, interni..., poi b come inizio del successivo
+    n_sotto = conteggi + 1
+    inizio_seg = np.cumsum(n_sotto) - n_sotto
+    nuovi_a = np.repeat(a, n_sotto, axis=0)
+    nuovi_b = np.repeat(b, n_sotto, axis=0)
+    pos_interni = inizio_seg[seg] + (np.arange(len(seg)) - (np.cumsum(conteggi) - conteggi)[seg])
+    nuovi_b[pos_interni] = punti
+    nuovi_a[pos_interni + 1] = punti
+    return np.repeat(anello, n_sotto), nuovi_a, nuovi_b
+
+###############################
+# 3. Archi condivisi e anelli
+###############################
+
+def costruisci_topologia(quant):
+    """
+    Archi e riferimenti agli archi per anello a partire dagli anelli quantizzati (N, 5, 2).
+    Restituisce (punti, lunghezze, anelli): i punti assoluti di tutti gli archi
+    concatenati, il numero di punti di ogni arco e, per ogni rettangolo, la lista
+    degli indici degli archi (con ~i per gli archi percorsi al contrario).
+    """
+    N = quant.shape[0]
+    anello, a, b = spezza_segmenti(quant)
+    if len(a) == 0:
+        return np.empty((0, 2), dtype=np.int64), np.empty(0, dtype=np.int64), [[] for _ in range(N)]
+    # Chiave canonica del segmento: estremi in ordine lessicografico
+    inverti = (a[:, 0] > b[:, 0]) | ((a[:, 0] == b[:, 0]) & (a[:, 1] > b[:, 1]))
+    lo = np.where(inverti[:, None], b, a)
+    hi = np.where(inverti[:, None], a, b)
+    # Con la quantizzazione le coordinate stanno in [0, Q): quattro cifre in base Q in un int64
+    base = np.int64(max(int(quant.max()) + 1, 1))
+    chiavi = ((lo[:, 0] * base + lo[:, 1]) * base + hi[:, 0]) * base + hi[:, 1]
+    _, primo, inverso, conteggi = np.unique(chiavi, return_index=True,
+                                            return_inverse=True, return_counts=True)
+    condiviso = conteggi[inverso] > 1
+
+    # Un nuovo arco inizia a ogni segmento condiviso, dopo un segmento condiviso
+    # e all'inizio di ogni anello
+    inizio_run = np.ones(len(a), dtype=bool)
+    inizio_run[1:] = (anello[1:] != anello[:-1]) | condiviso[1:] | condiviso[:-1]
+    inizi = np.flatnonzero(inizio_run)
+    fini = np.append(inizi[1:], len(a))
+    run_condiviso = condiviso[inizi]
+
+    # Segmenti condivisi: un arco per segmento unico, nel verso della prima occorrenza
+    unici_condivisi = np.flatnonzero(conteggi > 1)
+    id_condiviso = np.full(len(conteggi), -1, dtype=np.int64)
+    id_condiviso[unici_condivisi] = np.arange(len(unici_condivisi))
+    seg_primo = primo[unici_condivisi]
+    punti_condivisi = np.stack([a[seg_primo], b[seg_primo]], axis=1).reshape(-1, 2)
+
+    # Tratti non condivisi: un arco per run, con il punto iniziale del primo
+    # segmento seguito dai punti finali di tutti i segmenti del run
+    inizi_liberi = inizi[~run_condiviso]
+    lunghezze_libere = fini[~run_condiviso] - inizi_liberi
+    posizioni = np.cumsum(lunghezze_libere) - lunghezze_libere
+    punti_liberi = np.insert(b[~condiviso], posizioni, a[inizi_liberi], axis=0)
+
+    punti = np.concatenate([punti_condivisi, punti_liberi])
+    lunghezze = np.concatenate([np.full(len(unici_condivisi), 2), lunghezze_libere + 1])
+
+    # Riferimenti di ogni run: arco condiviso (eventualmente invertito) o arco proprio
+    riferimenti = np.empty(len(inizi), dtype=np.int64)
+    u = inverso[inizi[run_condiviso]]
+    idx = id_condiviso[u]
+    stesso_verso = (a[inizi[run_condiviso]] == a[primo[u]]).all(axis=1)
+    riferimenti[run_condiviso] = np.where(stesso_verso, idx, ~idx)
+    riferimenti[~run_condiviso] = len(unici_condivisi) + np.arange(len(inizi_liberi))
+    per_anello = np.bincount(anello[inizi], minlength=N)
+    lista = riferimenti.tolist()
+    fine_anello = np.cumsum(per_anello).tolist()
+    anelli = [lista[f - n:f] for f, n in zip(fine_anello, per_anello.tolist())]
+    return punti, lunghezze, anelli
+
+def delta_encode(punti, lunghezze):
+    """Delta encoding degli archi: primo punto assoluto, poi differenze (vettoriale sui punti)."""
+    if len(lunghezze) == 0:
+        return []
+    delta = np.diff(punti, axis=0, prepend=punti[:1])
+    inizi = np.cumsum(lunghezze) - lunghezze
+    delta[inizi] = punti[inizi]
+    valori = delta.tolist()
+    return [valori[s:s + n] for s, n in zip(inizi.tolist(), lunghezze.tolist())]
+
+def costruisci_topojson(df, nome_oggetto="limits_IT_provinces"):
+    """
+    TopoJSON dei rettangoli del DataFrame (colonne X, Y, LenX, LenY, Definition Name),
+    con coordinate geografiche quantizzate e archi condivisi.
+    """
+    vertici = vertici_rettangoli(df["X"], df["Y"], df["LenX"], df["LenY"])
+    geo = locale_a_geo(vertici)
+    bbox, transform = trasformazione(geo)
+    quant = quantizza(geo, transform)
+    punti, lunghezze, anelli = costruisci_topologia(quant)
+    nomi = df["Definition Name"].tolist()
+    geometries = [
+        {
+            "type": "Polygon",
+            "arcs": [refs],
+            "id": nome,  # Usa l'Entity Description come id
+            "properties": {"name": nome, "Definition Name": nome}
+        }
+        for nome, refs in zip(nomi, anelli)
+    ]
+    return {
+        "type": "Topology",
+        "transform": transform,
+        "bbox": bbox,
+        "objects": {
+            nome_oggetto: {
+                "type": "GeometryCollection",
+                "geometries": geometries
+            }
+        },
+        "arcs": delta_encode(punti, lunghezze)
+    }
+
+###############################
+# 4. Esportazione e anteprima
+###############################
+
+# Elementi per blocco quando si serializzano le liste lunghe (geometrie e archi)
+BLOCCO_JSON = 10000
+
+def _scrivi_lista(testo, lista, blocco):
+    """Scrive una lista JSON a blocchi: ogni blocco passa dall'encoder C di json.dumps."""
+    testo.write("[")
+    for inizio in range(0, len(lista), blocco):
+        if inizio:
+            testo.write(",")
+        testo.write(json.dumps(lista[inizio:inizio + blocco], ensure_ascii=False, separators=(",", ":"))[1:-1])
+    testo.write("]")
+
+def serializza_topojson(topojson, comprimi=False, blocco=BLOCCO_JSON):
+    """
+    Bytes del TopoJSON minificato (senza indentazione), scritto a blocchi nel buffer
+    di destinazione senza costruire prima l'intera stringa; con `comprimi` il buffer è gzip.
+    """
+    buffer = io.BytesIO()
+    destinazione = gzip.GzipFile(fileobj=buffer, mode="wb", mtime=0) if comprimi else buffer
+    testo = io.TextIOWrapper(destinazione, encoding="utf-8")
+
+    def valore(v):
+        return json.dumps(v, ensure_ascii=False, separators=(",", ":"))
+
+    testo.write('{"type":' + valore(topojson["type"]) + ',"transform":' + valore(topojson["transform"])
+                + ',"bbox":' + valore(topojson["bbox"]) + ',"objects":{')
+    for k, (nome, oggetto) in enumerate(topojson["objects"].items()):
+        if k:
+            testo.write(",")
+        testo.write(valore(nome) + ':{"type":' + valore(oggetto["type"]) + ',"geometries":')
+        _scrivi_lista(testo, oggetto["geometries"], blocco)
+        testo.write("}")
+    testo.write('},"arcs":')
+    _scrivi_lista(testo, topojson["arcs"], blocco)
+    testo.write("}")
+    testo.flush()
+    testo.detach()
+    if comprimi:
+        destinazione.close()
+    return buffer.getvalue()
+
+def riepilogo_topojson(topojson, n_geometrie=5):
+    """Anteprima leggera: conteggi, bbox, trasformazione e solo le prime geometrie."""
+    oggetti = {}
+    for nome, oggetto in topojson["objects"].items():
+        geometrie = oggetto["geometries"]
+        riferimenti = [ref for g in geometrie for anello in g["arcs"] for ref in anello]
+        oggetti[nome] = {
+            "geometrie": len(geometrie),
+            "riferimenti agli archi": len(riferimenti),
+            "riferimenti invertiti (archi condivisi)": sum(ref < 0 for ref in riferimenti),
+            "prime geometrie": geometrie[:n_geometrie],
+        }
+    return {
+        "type": topojson["type"],
+        "bbox": topojson["bbox"],
+        "transform": topojson["transform"],
+        "archi": len(topojson["arcs"]),
+        "punti": sum(len(arco) for arco in topojson["arcs"]),
+        "objects": oggetti,
+    }
+
+def geodataframe_rettangoli(df):
+    """GeoDataFrame (EPSG:4326) dei rettangoli con le stesse coordinate geografiche del TopoJSON."""
+    vertici = vertici_rettangoli(df["X"], df["Y"], df["LenX"], df["LenY"])
+    geo = locale_a_geo(vertici)
+    return gpd.GeoDataFrame({"Definition Name": df["Definition Name"].to_numpy()},
+                            geometry=shapely.polygons(geo), crs="EPSG:4326")
+
+# Formati binari: (driver/metodo, estensione, mime)
+FORMATI_BINARI = {
+    "GeoParquet": ("parquet", "quadrati_geo.parquet", "application/vnd.apache.parquet"),
+    "FlatGeobuf": ("FlatGeobuf", "quadrati_geo.fgb", "application/octet-stream"),
+}
+
+def esporta_binario(gdf, formato):
+    """Bytes del GeoDataFrame in GeoParquet (pyarrow) o FlatGeobuf (pyogrio)."""
+    buffer = io.BytesIO()
+    driver = FORMATI_BINARI[formato][0]
+    if driver == "parquet":
+        gdf.to_parquet(buffer)
+    else:
+        gdf.to_file(buffer, driver=driver, engine="pyogrio")
+    return buffer.getvalue()
+
+###############################
+# 5. Decodifica
+###############################
+
+def _intervalli(lunghezze):
+    """Posizione di ogni elemento all'interno del proprio intervallo (0..n-1 per ogni n)."""
+    inizi = np.cumsum(lunghezze) - lunghezze
+    return np.arange(int(lunghezze.sum())) - np.repeat(inizi, lunghezze)
+
+def decodifica_archi(topojson):
+    """
+    Archi in coordinate geografiche: somma cumulativa dei delta per arco e
+    quantizzazione inversa su tutti i punti insieme.
+    Restituisce (punti (P, 2), inizio di ogni arco, lunghezza di ogni arco).
+    """
+    archi = topojson["arcs"]
+    lunghezze = np.fromiter((len(arco) for arco in archi), dtype=np.int64, count=len(archi))
+    inizi = np.cumsum(lunghezze) - lunghezze
+    if not lunghezze.sum():
+        return np.empty((0, 2)), inizi, lunghezze
+    delta = np.array(list(itertools.chain.from_iterable(archi)), dtype=np.int64)
+    somma = np.cumsum(delta, axis=0)
+    # La somma cumulativa riparte a ogni arco: si sottrae quanto accumulato prima del suo inizio
+    base = somma[inizi] - delta[inizi]
+    quant = somma - np.repeat(base, lunghezze, axis=0)
+    scale = np.asarray(topojson["transform"]["scale"])
+    translate = np.asarray(topojson["transform"]["translate"])
+    return quant * scale + translate, inizi, lunghezze
+
+def decodifica_anelli(topojson, nome_oggetto="limits_IT_provinces"):
+    """
+    Anelli di tutte le geometrie dell'oggetto come array di punti geografici,
+    risolvendo in blocco gli archi invertiti (~i) ed eliminando il punto
+    ripetuto alla giunzione tra archi consecutivi.
+    Restituisce (anelli, geometria): lista di array (k, 2) e indice della geometria di ogni anello.
+    """
+    punti, inizi, lunghezze = decodifica_archi(topojson)
+    geometrie = topojson["objects"][nome_oggetto]["geometries"]
+    refs = []
+    anello_ref = []
+    geometria = []
+    for g, geom in enumerate(geometrie):
+        for anello in geom["arcs"]:
+            anello_ref.extend([len(geometria)] * len(anello))
+            refs.extend(anello)
+            geometria.append(g)
+    if not refs:
+        return [], np.asarray(geometria, dtype=np.int64)
+    refs = np.asarray(refs, dtype=np.int64)
+    anello_ref = np.asarray(anello_ref, dtype=np.int64)
+    invertito = refs < 0
+    arco = np.where(invertito, ~refs, refs)
+    n = lunghezze[arco]
+    pos = _intervalli(n)
+    # Indici dei punti di ogni riferimento, letti al contrario per gli archi invertiti
+    indici = np.repeat(inizi[arco], n) + np.where(np.repeat(invertito, n), np.repeat(n - 1, n) - pos, pos)
+    # Il primo punto di ogni arco che non apre l'anello coincide con l'ultimo del precedente
+    primo_ref = np.ones(len(refs), dtype=bool)
+    primo_ref[1:] = anello_ref[1:] != anello_ref[:-1]
+    tieni = (pos > 0) | np.repeat(primo_ref, n)
+    indici = indici[tieni]
+    per_anello = np.bincount(np.repeat(anello_ref, n)[tieni], minlength=len(geometria))
+    anelli = np.split(punti[indici], np.cumsum(per_anello)[:-1])
+    return anelli, np.asarray(geometria, dtype=np.int64)